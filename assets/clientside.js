@@ -0,0 +1,140 @@
+// Client-side charts for CLIENTSIDE_FILTERS=1: the hour, weekday and heatmap charts of count_figures, drawn from the
+// hourly level of the time pyramid that is already in the page, so filter changes need no request to the server.
+(function () {
+    var arrayTypes = {
+        'u1': Uint8Array, 'i1': Int8Array, 'u2': Uint16Array, 'i2': Int16Array, 'u4': Uint32Array, 'i4': Int32Array,
+        'i8': BigInt64Array, 'f8': Float64Array
+    };
+    var decoded = {bdata: null, counts: null};
+    var counted = {key: null, matrix: null};
+
+    // encode_array in the dashboard: {dtype, shape, bdata}, little-endian.
+    function decodeArray(encoded) {
+        if (decoded.bdata !== encoded.bdata) {
+            var binary = atob(encoded.bdata);
+            var bytes = new Uint8Array(binary.length);
+            for (var i = 0; i < binary.length; i++) {
+                bytes[i] = binary.charCodeAt(i);
+            }
+            var values = new arrayTypes[encoded.dtype.slice(1)](bytes.buffer);
+            decoded = {bdata: encoded.bdata, counts: values instanceof BigInt64Array ? Array.from(values, Number) : values};
+        }
+        return decoded.counts;
+    }
+
+    // users x 7 x 24 message counts for the filters, like pyramid_weekday_hour in the dashboard. The page holds the
+    // pyramid's hourly level only, as levels[0].
+    function weekdayHour(pyramid, dateRange, users, hidden, config) {
+        var key = JSON.stringify([pyramid.levels[0].first, pyramid.levels[0].counts.shape, dateRange, users, hidden]);
+        if (counted.key === key && decoded.bdata === pyramid.levels[0].counts.bdata) {
+            return counted.matrix;
+        }
+        var level = pyramid.levels[0];
+        var counts = decodeArray(level.counts);
+        var width = level.counts.shape[1];
+        var hiddenFlags = (hidden || []).reduce(function (mask, name) { return mask | config.flags[name]; }, 0);
+        var start = Math.max(dateRange[0] * 24 - level.first, 0);
+        var end = Math.min((dateRange[1] + 1) * 24 - level.first, width);
+        var matrix = users.map(function () {
+            return config.days.map(function () { return new Array(24).fill(0); });
+        });
+        pyramid.series.forEach(function (series, row) {
+            var user = users.indexOf(series[0]);
+            if (user < 0 || (series[1] & hiddenFlags)) {
+                return;
+            }
+            for (var i = start; i < end; i++) {
+                var count = counts[row * width + i];
+                if (count) {
+                    var index = level.first + i;
+                    matrix[user][(Math.floor(index / 24) + 3) % 7][index % 24] += count;
+                }
+            }
+        });
+        counted = {key: key, matrix: matrix};
+        return matrix;
+    }
+
+    function hourBins(hourBin) {
+        var starts = [];
+        for (var hour = 0; hour < 24; hour += hourBin) {
+            starts.push(hour);
+        }
+        return starts;
+    }
+
+    function binHours(row, hourBin) {
+        return hourBins(hourBin).map(function (hour) {
+            return row.slice(hour, hour + hourBin).reduce(function (a, b) { return a + b; }, 0);
+        });
+    }
+
+    function stackedBars(x, counts, users, config, xaxis) {
+        return {
+            data: users.map(function (user, i) {
+                return {type: 'bar', x: x, y: counts[i], name: user, marker: {color: config.colors[i % config.colors.length]}};
+            }),
+            layout: {barmode: 'relative', legend: {title: {text: 'User'}}, yaxis: {title: {text: 'count'}}, xaxis: xaxis}
+        };
+    }
+
+    function inputs(args) {
+        // pyramid, date range, users, hidden categories, hours per bar, config; null until a chat is loaded.
+        if (!args[0] || !args[1] || !args[2]) {
+            return null;
+        }
+        return {matrix: weekdayHour(args[0], args[1], args[2], args[3], args[5]), users: args[2], hourBin: args[4] || 1,
+                config: args[5]};
+    }
+
+    function noUpdate() {
+        return window.dash_clientside.no_update;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        chat: {
+            showCharts: function (pyramid) {
+                return pyramid ? {'margin-bottom': '10px'} : {'display': 'none'};
+            },
+            hourFigure: function () {
+                var c = inputs(arguments);
+                if (!c) {
+                    return noUpdate();
+                }
+                var x = hourBins(c.hourBin);
+                var counts = c.matrix.map(function (days) {
+                    var byHour = new Array(24).fill(0);
+                    days.forEach(function (hours) { hours.forEach(function (n, h) { byHour[h] += n; }); });
+                    return binHours(byHour, c.hourBin);
+                });
+                return stackedBars(x, counts, c.users, c.config,
+                                   {title: {text: 'Hour'}, categoryorder: 'array', categoryarray: x, type: 'category'});
+            },
+            weekdayFigure: function () {
+                var c = inputs(arguments);
+                if (!c) {
+                    return noUpdate();
+                }
+                var counts = c.matrix.map(function (days) {
+                    return days.map(function (hours) { return hours.reduce(function (a, b) { return a + b; }, 0); });
+                });
+                var figure = stackedBars(c.config.days, counts, c.users, c.config,
+                                         {title: {text: 'Day'}, categoryorder: 'array', categoryarray: c.config.days});
+                figure.layout.bargap = 0.1;
+                return figure;
+            },
+            heatmapFigure: function () {
+                var c = inputs(arguments);
+                if (!c) {
+                    return noUpdate();
+                }
+                var z = c.config.days.map(function (day, d) {
+                    var byHour = new Array(24).fill(0);
+                    c.matrix.forEach(function (days) { days[d].forEach(function (n, h) { byHour[h] += n; }); });
+                    return binHours(byHour, c.hourBin);
+                });
+                return {data: [{type: 'heatmap', x: hourBins(c.hourBin), y: c.config.days, z: z}], layout: {}};
+            }
+        }
+    });
+})();
@@ -0,0 +1,75 @@
+# Peak memory of the chunked ingest (CHAT_STORAGE=chunked) against export size: writes WhatsApp exports of growing
+# size over the same time span, then ingests each one as an upload, base64 contents and all, in a fresh process and
+# reports its peak RSS growth over the contents themselves, optionally next to the in-memory ingest of the same
+# export. The chunked ingest decodes the contents a block at a time as it parses them.
+# Usage: python benchmarks/bench_chunked.py [--sizes 250000 500000 1000000 2000000] [--chunk-rows 100000] [--in-memory]
+import argparse
+import base64
+import os
+import subprocess
+import sys
+import tempfile
+
+from common import synthetic_chat
+
+# One ingest in a fresh process, after a small warm-up one so that imports are not counted. The peak is read from
+# VmHWM because ru_maxrss can be inherited from this process.
+child_run = '''
+import base64, sys, time, warnings
+warnings.filterwarnings('ignore')
+sys.path.insert(0, {benchmarks_dir!r})
+from common import load_dashboard, synthetic_chat
+dashboard = load_dashboard()
+dashboard.chunk_rows = {chunk_rows!r}
+dashboard.storage_backend = 'chunked' if {chunked!r} else 'memory'
+def peak():
+    with open('/proc/self/status') as status:
+        return next(int(line.split()[1]) for line in status if line.startswith('VmHWM:'))
+dashboard.ingest(synthetic_chat(1000))
+with open({path!r}, 'rb') as export:
+    contents = 'data:text/plain;base64,' + base64.b64encode(export.read()).decode('ascii')
+before = peak()
+start = time.perf_counter()
+dashboard.ingest(contents)
+print(peak() - before, time.perf_counter() - start)
+'''
+
+
+def write_export(path, n_messages, years):
+    content_string = synthetic_chat(n_messages, years=years).split(',', 1)[1]
+    with open(path, 'wb') as export:
+        export.write(base64.b64decode(content_string))
+
+
+def peak_rss(path, chunk_rows, chunked):
+    code = child_run.format(benchmarks_dir=os.path.dirname(os.path.abspath(__file__)), chunk_rows=chunk_rows,
+                            path=path, chunked=chunked)
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    peak, seconds = result.stdout.split()[-2:]
+    return int(peak) * 1024, float(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[250000, 500000, 1000000, 2000000])
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--chunk-rows', type=int, default=100000)
+    parser.add_argument('--in-memory', action='store_true', help='also measure the in-memory ingest')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for n_messages in args.sizes:
+            path = os.path.join(directory, f'chat_{n_messages}.txt')
+            write_export(path, n_messages, args.years)
+            line = f'{n_messages:>9,} messages, {os.path.getsize(path) / 1e6:6.1f} MB export: '
+            chunked, seconds = peak_rss(path, args.chunk_rows, True)
+            line += f'chunked peak +{chunked / 1e6:6.1f} MB in {seconds:5.1f} s'
+            if args.in_memory:
+                memory, seconds = peak_rss(path, args.chunk_rows, False)
+                line += f', in-memory peak +{memory / 1e6:6.1f} MB in {seconds:5.1f} s'
+            print(line)
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
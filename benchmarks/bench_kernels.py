@@ -0,0 +1,83 @@
+# Compares the bincount kernels used by update_graphs with the pandas groupby path they replaced.
+# Usage: python benchmarks/bench_kernels.py [--rows 10000000] [--users 5] [--repeat 3]
+import argparse
+
+import numpy as np
+
+from common import load_dashboard, synthetic_frame, timed
+
+
+def groupby_heatmap(df):
+    return df \
+        .groupby(['Day', 'Hour']) \
+        .Message \
+        .count() \
+        .reset_index() \
+        .sort_values(['Hour', 'Day']) \
+        .reset_index(drop=True)
+
+
+def groupby_histograms(df):
+    return {
+        'hour': df.groupby(['User', 'Hour']).size(),
+        'day': df.groupby(['User', 'Day']).size(),
+        'month': df.groupby(['User', df.Timestamp.dt.to_period('M')]).size()
+    }
+
+
+def kernel_histograms(dashboard, df, users):
+    codes = dashboard.time_codes(df.Timestamp)
+    user_code = dashboard.user_codes(df.User, users)
+    weekday_hour = dashboard.count_by_user(user_code, codes['weekday'] * 24 + codes['hour'], 7 * 24,
+                                           len(users)).reshape(len(users), 7, 24)
+    return {
+        'weekday_hour': weekday_hour,
+        'hour': dashboard.count_by_user(user_code, codes['hour'], 24, len(users)),
+        'day': weekday_hour.sum(axis=2),
+        'month': dashboard.count_span(user_code, codes['month'], len(users)),
+        'minute': dashboard.count_by_user(user_code, codes['minute'], 1440, len(users))
+    }
+
+
+def check(df, kernels, heatmap):
+    dense = heatmap.pivot(index='Day', columns='Hour', values='Message').reindex(columns=range(24)).fillna(0)
+    assert np.array_equal(dense.values.astype('int64'), kernels['weekday_hour'].sum(axis=0))
+    hours = df.groupby(['User', 'Hour']).size().unstack(fill_value=0).reindex(columns=range(24), fill_value=0)
+    assert np.array_equal(hours.values, kernels['hour'])
+    first_month, months = kernels['month']
+    by_period = df.Timestamp.dt.to_period('M').value_counts().sort_index()
+    assert str(by_period.index[0]) == str(np.datetime64(first_month, 'M'))
+    assert np.array_equal(by_period.values, months.sum(axis=0)[months.sum(axis=0) > 0])
+    assert kernels['minute'].sum() == len(df)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    dashboard = load_dashboard()
+    df = synthetic_frame(args.rows, n_users=args.users)
+    users = list(df.User.cat.categories)
+    print(f'{args.rows:,} rows, {args.users} users, best of {args.repeat}')
+
+    groupby_heatmap_time, heatmap = timed(groupby_heatmap, df, repeat=args.repeat)
+    groupby_histograms_time, _ = timed(groupby_histograms, df, repeat=args.repeat)
+    codes_time, codes = timed(dashboard.time_codes, df.Timestamp, repeat=args.repeat)
+    user_code = dashboard.user_codes(df.User, users)
+    heatmap_time, _ = timed(dashboard.count_by_user, user_code, codes['weekday'] * 24 + codes['hour'], 7 * 24,
+                            len(users), repeat=args.repeat)
+    kernels_time, kernels = timed(kernel_histograms, dashboard, df, users, repeat=args.repeat)
+    check(df, kernels, heatmap)
+
+    print(f'groupby heatmap           {groupby_heatmap_time:8.3f} s')
+    print(f'groupby hour/day/month    {groupby_histograms_time:8.3f} s')
+    print(f'time_codes                {codes_time:8.3f} s')
+    print(f'bincount weekday x hour   {heatmap_time:8.3f} s')
+    print(f'all kernels incl. codes   {kernels_time:8.3f} s')
+
+
+if __name__ == '__main__':
+    main()
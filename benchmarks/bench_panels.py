@@ -0,0 +1,67 @@
+# Time to first panel after Submit: the whole dashboard computed by one task, as update_graphs did before the
+# panels were split, against the stats, graphs, words and count chart callbacks sent at once, as the page sends them.
+# Reports when each panel is ready, and the same Submit again, answered from the per-panel caches.
+# Usage: python benchmarks/bench_panels.py [--rows 200000 1000000] [--users 5]
+import argparse
+import threading
+import time
+
+from common import load_dashboard, post_callback, synthetic_frame
+
+
+def submit(dashboard, reference, date_range, users):
+    # Every panel callback from its own thread; returns the seconds until each one answered.
+    filters = [('date-range.value', date_range), ('user-selection.value', users), ('hidden-categories.value', [])]
+    requests = {panel: ([f'{panel}.children', f'{panel}-state.data'],
+                        [('submit-val.n_clicks', 1), ('dataset-refined.data', None)],
+                        [('intermediate-values.children', reference)] + filters + [(f'{panel}-state.data', None)])
+                for panel in ['stats', 'graphs', 'words']}
+    for graph_id in dashboard.count_graph_ids:
+        requests[graph_id] = ([f'{graph_id}.figure'], [('submit-val.n_clicks', 1)],
+                              [('intermediate-values.children', reference)] + filters)
+    ready = {}
+    start = time.perf_counter()
+
+    def send(name, body):
+        response = post_callback(dashboard.app.server.test_client(), *body)
+        assert response.status_code == 200, response.data[:500]
+        ready[name] = time.perf_counter() - start
+
+    threads = [threading.Thread(target=send, args=item) for item in requests.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return ready
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[200_000, 1_000_000])
+    parser.add_argument('--users', type=int, default=5)
+    args = parser.parse_args()
+
+    dashboard = load_dashboard()
+    for n_rows in args.rows:
+        df = synthetic_frame(n_rows, n_users=args.users)
+        df['Session'], sessions = dashboard.session_index(df)
+        payload = dashboard.encode_dataset(dashboard.message_tables(df, sessions))
+        meta = dashboard.dataset_metadata(df)
+        users = [user['name'] for user in meta['users']]
+        date_range = [meta['start_day'], meta['end_day']]
+
+        start = time.perf_counter()
+        dashboard.run_task(dashboard.dataset_dashboard, payload, date_range, users, 0)
+        whole = time.perf_counter() - start
+        reference = dashboard.register_dataset(payload)
+        dashboard.register_pyramid(reference, dashboard.time_pyramid(df))
+        first = submit(dashboard, reference, date_range, users)
+        again = submit(dashboard, reference, date_range, users)
+        print(f'{n_rows:,} rows: one task {whole:6.2f} s; per panel ' +
+              ', '.join(f'{name} {seconds:.2f} s' for name, seconds in sorted(first.items(), key=lambda item: item[1])) +
+              f'; again, from the caches, all in {max(again.values()):.2f} s')
+        dashboard.delete_dataset(reference)
+
+
+if __name__ == '__main__':
+    main()
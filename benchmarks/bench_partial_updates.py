@@ -0,0 +1,60 @@
+# Bytes and server time of update_stats, update_graphs and update_words for a sequence of filter changes, sending
+# the whole panels each time (no panel state) against the partial updates made from the state of the previous
+# response. The dataset is registered again under the same key before every request, so that each one computes its
+# panel rather than finding the result of the one before cached with the dataset.
+# Usage: python benchmarks/bench_partial_updates.py [--rows 200000] [--users 5]
+import argparse
+import json
+import os
+import time
+
+from common import load_dashboard, post_callback, synthetic_frame
+
+panels = ['stats', 'graphs', 'words']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--users', type=int, default=5)
+    args = parser.parse_args()
+
+    dashboard = load_dashboard()
+    df = synthetic_frame(args.rows, n_users=args.users)
+    df['Session'], sessions = dashboard.session_index(df)
+    payload = dashboard.encode_dataset(dashboard.message_tables(df, sessions))
+    meta = dashboard.dataset_metadata(df)
+    users = [user['name'] for user in meta['users']]
+    start, end = meta['start_day'], meta['end_day']
+    steps = [
+        ('first render', [start, end], users, []),
+        ('submit again', [start, end], users, []),
+        ('remove a user', [start, end], users[:-1], []),
+        ('add it back', [start, end], users, []),
+        ('narrow dates', [start + 60, end - 60], users, []),
+        ('hide media', [start + 60, end - 60], users, ['media'])
+    ]
+    key = os.urandom(16).hex()
+    client = dashboard.app.server.test_client()
+    states = {panel: None for panel in panels}
+    print(f'{args.rows:,} rows, {args.users} users: full response vs partial update')
+    for label, date_range, selected_users, hidden in steps:
+        sizes, times = [0, 0], [0, 0]
+        for panel in panels:
+            for i, previous in enumerate((None, states[panel])):
+                reference = dashboard.register_dataset(payload, key)
+                inputs = [('intermediate-values.children', reference), ('date-range.value', date_range),
+                          ('user-selection.value', selected_users), ('hidden-categories.value', hidden),
+                          (f'{panel}-state.data', previous)]
+                begin = time.perf_counter()
+                response = post_callback(client, [f'{panel}.children', f'{panel}-state.data'],
+                                         [('submit-val.n_clicks', 1), ('dataset-refined.data', None)], inputs)
+                times[i] += time.perf_counter() - begin
+                assert response.status_code == 200, response.data[:500]
+                sizes[i] += len(response.data)
+            states[panel] = json.loads(response.data)['response'][f'{panel}-state']['data']
+        print(f'{label:14} {sizes[0] / 1e3:8.1f} kB {times[0]:6.3f} s   {sizes[1] / 1e3:8.1f} kB {times[1]:6.3f} s')
+
+
+if __name__ == '__main__':
+    main()
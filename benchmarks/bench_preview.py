@@ -0,0 +1,59 @@
+# Time to the first stats cards of a preview upload (stratified sample, exact dashboard later) against a full upload,
+# and how close the preview is: the share of exact message counts and mean words per message, by user, inside the
+# 95% intervals its cards show.
+# Usage: python benchmarks/bench_preview.py [--sizes 250000 1000000] [--preview-rows 50000]
+import argparse
+import time
+import warnings
+
+from common import load_dashboard, synthetic_chat
+
+
+def first_stats(dashboard, ingest, contents):
+    start = time.perf_counter()
+    dataset, meta, _ = ingest(contents)
+    users = [user['name'] for user in meta['users']]
+    stats, _ = dashboard.dataset_dashboard(dataset, [meta['start_day'], meta['end_day']], users,
+                                           dashboard.flags_mask(dashboard.default_hidden_categories), ('stats',))
+    return time.perf_counter() - start, stats
+
+
+def card_values(stats, label):
+    # The numbers on one line of every user's card: the value, and for a preview the half-width of its interval.
+    values = {}
+    for lines in stats:
+        for line in lines[1:]:
+            if line.startswith(label + ': '):
+                values[lines[0]] = [float(part) for part in
+                                    line[len(label) + 2:].replace('about ', '').replace(',', '').split(' ± ')]
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[250000, 1000000])
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--preview-rows', type=int, default=50000)
+    args = parser.parse_args()
+
+    warnings.filterwarnings('ignore')
+    dashboard = load_dashboard()
+    dashboard.preview_rows = args.preview_rows
+    for n_messages in args.sizes:
+        contents = synthetic_chat(n_messages, years=args.years)
+        preview_time, preview_stats = first_stats(dashboard, dashboard.ingest_preview, contents)
+        exact_time, exact_stats = first_stats(dashboard, dashboard.ingest, contents)
+        inside = total = 0
+        # Half the last digit the cards show, for the rounding.
+        for label, rounding in (('Messages sent', 0.5), ('Mean words per message', 0.005)):
+            exact = card_values(exact_stats, label)
+            for user, (value, *interval) in card_values(preview_stats, label).items():
+                if interval:
+                    inside += abs(value - exact[user][0]) <= interval[0] + rounding
+                    total += 1
+        print(f'{n_messages:>9,} messages: stats in {preview_time:6.2f} s from the preview, {exact_time:6.2f} s '
+              f'exact; {inside}/{total} exact values inside the 95% intervals')
+
+
+if __name__ == '__main__':
+    main()
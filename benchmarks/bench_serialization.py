@@ -0,0 +1,64 @@
+# Measures the dataset payload codec and the update_graphs response, before and after the fast serialization path.
+# "Before" is DataFrame.to_json/pd.read_json, figures as Python lists and no compression.
+# Usage: python benchmarks/bench_serialization.py [--rows 1000000] [--repeat 3]
+import argparse
+
+import pandas as pd
+
+from common import load_dashboard, post_callback, synthetic_frame, timed
+
+
+def legacy_round_trip(df):
+    payload = df.to_json(date_format='iso', orient='split')
+    return payload, pd.read_json(payload, orient='split')
+
+
+def fast_round_trip(dashboard, tables):
+    payload = dashboard.encode_dataset(tables)
+    return payload, dashboard.decode_dataset(payload)['messages']
+
+
+def post_graphs(dashboard, client, payload, meta, users, accept):
+    # On a newly registered dataset each time, so that the panel is computed rather than found cached with it.
+    reference = dashboard.register_dataset(payload)
+    response = post_callback(
+        client, ['graphs.children', 'graphs-state.data'], [('submit-val.n_clicks', 1), ('dataset-refined.data', None)],
+        [('intermediate-values.children', reference), ('date-range.value', [meta['start_day'], meta['end_day']]),
+         ('user-selection.value', users), ('hidden-categories.value', []), ('graphs-state.data', None)],
+        headers={'Accept-Encoding': accept})
+    dashboard.delete_dataset(reference)
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    dashboard = load_dashboard()
+    df = synthetic_frame(args.rows)
+    print(f'{args.rows:,} rows, best of {args.repeat}')
+
+    legacy_time, (legacy_payload, _) = timed(legacy_round_trip, df, repeat=args.repeat)
+    df['Session'], sessions = dashboard.session_index(df)
+    tables = dashboard.message_tables(df, sessions)
+    fast_time, (payload, decoded) = timed(fast_round_trip, dashboard, tables, repeat=args.repeat)
+    assert decoded.Timestamp.equals(df.Timestamp) and decoded.Message.equals(df.Message)
+    print(f'dataset to_json/read_json          {legacy_time:8.3f} s {len(legacy_payload) / 1e6:10.1f} MB')
+    print(f'dataset encode/decode_dataset      {fast_time:8.3f} s {len(payload) / 1e6:10.1f} MB')
+
+    meta = dashboard.dataset_metadata(decoded)
+    users = [user['name'] for user in meta['users']]
+    client = dashboard.app.server.test_client()
+    for encoding, accept, label in [('list', 'identity', 'before'), ('typed', 'identity', ''),
+                                    ('list', 'br', ''), ('typed', 'br', 'after')]:
+        dashboard.figure_encoding = encoding
+        elapsed, response = timed(
+            post_graphs, dashboard, client, payload, meta, users, accept, repeat=args.repeat)
+        assert response.status_code == 200, response.data[:500]
+        print(f'update_graphs {encoding:5} {accept:8} {elapsed:8.3f} s {len(response.data) / 1e3:10.1f} kB  {label}')
+
+
+if __name__ == '__main__':
+    main()
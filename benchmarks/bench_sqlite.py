@@ -0,0 +1,87 @@
+# Compares the SQLite storage backend with the in-memory dataset: checks that build_dashboard_sql gives exactly the
+# same stats and figures as build_dashboard, then times both and measures each one's peak RSS in a fresh process.
+# Usage: python benchmarks/bench_sqlite.py [--rows 1000000] [--users 5] [--repeat 3]
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from common import load_dashboard, synthetic_frame, timed
+
+# One dashboard in a fresh process; the peak is read from VmHWM because ru_maxrss can be inherited from this one.
+child_run = '''
+import sys, warnings
+warnings.filterwarnings('ignore')
+sys.path.insert(0, {benchmarks_dir!r})
+from common import load_dashboard
+dashboard = load_dashboard()
+dashboard.storage_dir = {storage_dir!r}
+args = {args!r}
+def peak():
+    with open('/proc/self/status') as status:
+        return next(int(line.split()[1]) for line in status if line.startswith('VmHWM:'))
+before = peak()
+dataset = open(args['dataset']).read() if args['dataset'].endswith('.json') else args['dataset']
+dashboard.dataset_dashboard(dataset, args['date_range'], args['users'], args['hidden_flags'])
+print(peak() - before)
+'''
+
+
+def figure_json(figures):
+    return [fig.to_json() for fig in figures]
+
+
+def peak_rss(storage_dir, **args):
+    code = child_run.format(benchmarks_dir=os.path.dirname(os.path.abspath(__file__)), storage_dir=storage_dir,
+                            args=args)
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return int(result.stdout.split()[-1]) * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    dashboard = load_dashboard()
+    df = synthetic_frame(args.rows, args.users)
+    df['Flags'] = np.random.default_rng(1).choice(np.array([0, 0, 0, 1, 4, 8], dtype='uint8'), len(df))
+    df['Session'], sessions = dashboard.session_index(df)
+    meta = dashboard.dataset_metadata(df)
+    users = [user['name'] for user in meta['users']]
+    full = [meta['start_day'], meta['end_day']]
+    inner = [meta['start_day'] + 30, meta['end_day'] - 30]
+
+    with tempfile.TemporaryDirectory() as storage_dir:
+        dashboard.storage_dir = storage_dir
+        payload = dashboard.encode_dataset(dashboard.message_tables(df, sessions))
+        write_time, reference = timed(dashboard.write_sqlite, df, sessions, repeat=1)
+        path = dashboard.sqlite_path(reference)
+        print(f'{args.rows:,} rows, {os.path.getsize(path) / 1e6:.1f} MB database written in {write_time:.2f} s')
+
+        for date_range, selected, hidden_flags in [(full, users, 0), (inner, users[:2], 1), (inner, users[1:], 12)]:
+            tables = dashboard.decode_dataset(payload)
+            memory_time, (stats, figures) = timed(dashboard.build_dashboard, tables, date_range, selected,
+                                                  hidden_flags, repeat=args.repeat)
+            sqlite_time, (sql_stats, sql_figures) = timed(dashboard.build_dashboard_sql, path, date_range, selected,
+                                                          hidden_flags, repeat=args.repeat)
+            assert sql_stats == stats, (sql_stats, stats)
+            assert figure_json(sql_figures) == figure_json(figures)
+            print(f'{len(selected)} users, days {date_range}, hidden {hidden_flags:2}: identical results, '
+                  f'in-memory {memory_time:.3f} s, sqlite {sqlite_time:.3f} s')
+
+        with open(os.path.join(storage_dir, 'dataset.json'), 'w') as file:
+            file.write(payload)
+        run = {'date_range': inner, 'users': users[:2], 'hidden_flags': 1}
+        memory = peak_rss(storage_dir, dataset=os.path.join(storage_dir, 'dataset.json'), **run)
+        sqlite = peak_rss(storage_dir, dataset=reference, **run)
+        print(f'peak RSS growth for one dashboard: in-memory {memory / 1e6:.1f} MB, sqlite {sqlite / 1e6:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# Cold-start benchmark: time from interpreter start to the first served layout, plus an import-time breakdown.
+# Exits non-zero when the median cold start is over budget, so it can gate changes.
+# Usage: python benchmarks/bench_startup.py [--repeat 5] [--budget 2.0] [--top 10]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+dashboard_path = os.path.join(repo_dir, 'dashboard_v0.6.py')
+heavy_modules = ['pandas', 'numpy', 'plotly.express', 'plotly.graph_objs', 'emoji']
+
+# Deliberately does not import benchmarks/common.py, which pulls in pandas and numpy.
+first_layout = f'''
+import importlib.util, sys, warnings
+warnings.filterwarnings('ignore')
+spec = importlib.util.spec_from_file_location('dashboard', {dashboard_path!r})
+dashboard = importlib.util.module_from_spec(spec)
+sys.modules['dashboard'] = dashboard
+spec.loader.exec_module(dashboard)
+client = dashboard.app.server.test_client()
+assert client.get('/').status_code == 200
+assert client.get('/_dash-layout').status_code == 200
+print(','.join(name for name in {heavy_modules!r} if name in sys.modules))
+'''
+
+
+def cold_start():
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', first_layout], capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, result.stdout.strip()
+
+
+def import_breakdown(top):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', first_layout], capture_output=True, text=True,
+                            check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # top-level imports only; nested ones are included in their parent
+            rows.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=2.0, help='seconds to first served layout')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    cold_start()  # warm the OS file cache so runs are comparable
+    runs = [cold_start() for _ in range(args.repeat)]
+    median = statistics.median(elapsed for elapsed, _ in runs)
+    loaded = runs[-1][1]
+
+    print('import breakdown (cumulative, top-level):')
+    for seconds, name in import_breakdown(args.top):
+        print(f'  {seconds:7.3f} s  {name}')
+    print(f'heavy modules loaded by first layout: {loaded or "none"}')
+    print(f'time to first served layout: median {median:.3f} s over {args.repeat} runs, budget {args.budget:.3f} s')
+    if median > args.budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
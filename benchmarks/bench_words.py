@@ -0,0 +1,102 @@
+# Word statistics from the message x term index built at ingest: the time to build it (tokenizing every message
+# once), its size, and the time of the words panel for a few filters, end to end through dashboard_panel on a
+# registered dataset: cutting its tables out of the payload, sending them to a compute worker, decoding them there
+# and summing index entries. The first filter pays for sending and decoding; the others find the tables decoded in
+# the worker. Messages draw their words from a Zipf distribution. Above --tokenize-max rows the index is generated
+# directly with the same distribution, since only the query side is measured there.
+# Usage: python benchmarks/bench_words.py [--rows 1000000 10000000] [--vocabulary 20000] [--cloud]
+import argparse
+import os
+import string
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from common import load_dashboard, synthetic_frame, timed
+
+
+def zipf_terms(rng, n, vocabulary):
+    return ((rng.zipf(1.3, n) - 1) % vocabulary).astype('int32')
+
+
+def pseudo_words(vocabulary):
+    # Four letters each, so that the token pattern keeps every word and none is a stop word: 'aaaa', 'aaab', ...
+    letters = np.array(list(string.ascii_lowercase), dtype=object)
+    codes = np.arange(vocabulary)
+    return letters[codes // 26 ** 3 % 26] + letters[codes // 26 ** 2 % 26] + letters[codes // 26 % 26] + letters[codes % 26]
+
+
+def zipf_messages(rng, n_rows, vocabulary):
+    words = pseudo_words(vocabulary)
+    lengths = rng.integers(1, 9, n_rows)
+    tokens = words[zipf_terms(rng, int(lengths.sum()), vocabulary)]
+    ends = np.cumsum(lengths)
+    return np.array([' '.join(tokens[end - length:end]) for end, length in zip(ends, lengths)], dtype=object)
+
+
+def generated_index(dashboard, rng, df, vocabulary):
+    # The tables word_tables would give for Zipf messages, without the text: up to 8 distinct terms a message.
+    offsets = np.concatenate([[0], np.cumsum(rng.integers(1, 9, len(df)))])
+    terms, counts = zipf_terms(rng, int(offsets[-1]), vocabulary), np.ones(int(offsets[-1]), dtype='int32')
+    return {
+        'word_offsets': pd.DataFrame({'Offset': dashboard.narrow_integers(offsets)}),
+        'word_entries': pd.DataFrame({'Term': dashboard.narrow_integers(terms),
+                                      'Count': dashboard.narrow_integers(counts)}),
+        'vocabulary': pd.DataFrame({'Term': pseudo_words(vocabulary), 'Words': np.ones(vocabulary, dtype='int8')}),
+        **dashboard.word_blocks(df, offsets, terms, counts, vocabulary)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--tokenize-max', type=int, default=1_000_000)
+    parser.add_argument('--cloud', action='store_true', help='also draw the word cloud (needs wordcloud)')
+    args = parser.parse_args()
+
+    warnings.filterwarnings('ignore')
+    if not args.cloud:
+        # Read by the compute workers too, which load the dashboard themselves.
+        os.environ['WORD_CLOUD'] = '0'
+    dashboard = load_dashboard()
+    # Starts a compute worker, so that the first filter does not count that.
+    dashboard.run_task(int)
+    for n_rows in args.rows:
+        rng = np.random.default_rng(0)
+        df = synthetic_frame(n_rows, n_users=args.users)
+        line = f'{n_rows:>10,} rows: '
+        if n_rows <= args.tokenize_max:
+            df['Message'] = zipf_messages(rng, n_rows, args.vocabulary)
+            start = time.perf_counter()
+            tables = dashboard.word_tables(df)
+            line += f'index built in {time.perf_counter() - start:6.2f} s, '
+        else:
+            start = time.perf_counter()
+            tables = generated_index(dashboard, rng, df, args.vocabulary)
+            line += f'index generated, monthly blocks in {time.perf_counter() - start:6.2f} s, '
+        # Only what the words panel reads is registered, which keeps 10M rows within a few GB.
+        df['Session'], sessions = dashboard.session_index(df)
+        tables.update(messages=df.drop(columns=['Message', 'Emojis']), sessions=sessions)
+        size = sum(table.memory_usage(index=False).sum() for name, table in tables.items() if name.startswith('word'))
+        line += f'{len(tables["vocabulary"]):,} terms, {len(tables["word_entries"]):,} entries ({size / 1e6:.0f} MB); '
+        reference = dashboard.register_dataset(dashboard.encode_dataset(tables))
+        del tables, df['Message']
+        users = list(df.User.cat.categories)
+        first, last = dashboard.epoch_days(df.Timestamp.iloc[[0, -1]]).tolist()
+        filters = {'whole chat': ([first, last], users), 'one year, two users': ([last - 365, last], users[:2]),
+                   'one month, one user': ([last - 30, last], users[:1])}
+        timings = []
+        for name, (date_range, selected) in filters.items():
+            # Once each: the panel's result is cached with the dataset, so a repeat would only time that lookup.
+            seconds, _ = timed(dashboard.dashboard_panel, 'words', reference, date_range, selected, [], repeat=1)
+            timings.append(f'{name} {seconds:.3f} s')
+        dashboard.delete_dataset(reference)
+        print(line + 'words panel: ' + ', '.join(timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# Regression check for the export parsers and the message classifier: parses the sample exports in chats/ and
+# asserts their message, user and category counts, then a few hand-written exports for the formats and failure
+# cases the samples do not cover. Exits with an assertion error on the first mismatch.
+# Usage: python benchmarks/check_parsers.py
+import base64
+import io
+import os
+import warnings
+
+import pandas as pd
+
+from common import load_dashboard, repo_dir
+
+# messages, users, first and last timestamp, and messages per category, as parsed and classified at ingest
+expected = {
+    'other_android.txt': (17207, 2, '2023-07-16 12:01:00', '2024-05-07 11:50:00',
+                          {'media': 371, 'system': 0, 'link': 220, 'edited': 175, 'deleted': 22}),
+    'pixel_7.txt': (40, 3, '2024-04-27 01:30:00', '2024-05-07 12:54:00',
+                    {'media': 1, 'system': 2, 'link': 0, 'edited': 1, 'deleted': 1}),
+    'result.json': (10301, 2, '2023-12-12 06:57:01', '2024-05-07 10:58:22',
+                    {'media': 393, 'system': 2, 'link': 178, 'edited': 1124, 'deleted': 0})
+}
+
+
+def parse_export(dashboard, path):
+    with open(path, encoding='utf-8') as export:
+        text = export.read()
+    if path.endswith('.json'):
+        return dashboard.parse_telegram(pd.concat(list(dashboard.telegram_frames(io.StringIO(text))),
+                                                  ignore_index=True))
+    return dashboard.parse_whatsapp(dashboard.split_whatsapp(text))
+
+
+def summary(dashboard, df):
+    categories = {name: int(((df.Flags.values & bit) > 0).sum()) for name, bit in dashboard.message_flags.items()}
+    return len(df), df.User.nunique(), str(df.Timestamp.min()), str(df.Timestamp.max()), categories
+
+
+def text_upload(text):
+    return 'data:text/plain;base64,' + base64.b64encode(text.encode('utf-8')).decode('ascii')
+
+
+def check_samples(dashboard):
+    for name, counts in expected.items():
+        path = os.path.join(repo_dir, 'chats', name)
+        assert summary(dashboard, parse_export(dashboard, path)) == counts, name
+        if name.endswith('.txt'):
+            # The chunked ingest splits the same messages, whatever the chunk size.
+            with open(path, encoding='utf-8') as export:
+                chunks = pd.concat(dashboard.whatsapp_chunks(export, 500), ignore_index=True)
+            with open(path, encoding='utf-8') as export:
+                assert chunks.equals(dashboard.split_whatsapp(export.read())), name
+        print(f'{name}: {counts[0]} messages as expected')
+
+
+def check_formats(dashboard):
+    pixel = dashboard.split_whatsapp(open(os.path.join(repo_dir, 'chats', 'pixel_7.txt'), encoding='utf-8').read())
+    assert pixel.User[0] == dashboard.system_user and pixel.Message[2].endswith('<This message was edited>')
+
+    ios = dashboard.split_whatsapp('[27/04/24, 01:30:05] Ann: hi\nsecond line\n[27/04/24, 13:02:00] Bob: yo')
+    assert ios.Timestamp.astype(str).tolist() == ['2024-04-27 01:30:05', '2024-04-27 13:02:00']
+    assert ios.Message.tolist() == ['hi\nsecond line', 'yo']
+
+    # US exports are month first; 12-hour times.
+    us = dashboard.split_whatsapp('12/31/23, 10:00 PM - Ann: hi\n1/2/24, 9:05 AM - Bob: yo')
+    assert us.Timestamp.astype(str).tolist() == ['2023-12-31 22:00:00', '2024-01-02 09:05:00']
+    chunks = list(dashboard.whatsapp_chunks('12/31/23, 10:00 PM - Ann: hi\n1/2/24, 9:05 AM - Bob: yo\n'
+                                            .splitlines(True), 1))
+    assert pd.concat(chunks, ignore_index=True).equals(us)
+
+    # A date that cannot be read in the export's order is skipped, not guessed.
+    assert len(dashboard.split_whatsapp('31/02/23, 10:00 - Ann: hi\n1/2/24, 9:05 - Bob: yo')) == 1
+
+    # Nothing to parse: ingest returns None, which the page reports as "No messages were found".
+    for text in ['', 'hello\nworld']:
+        assert len(dashboard.split_whatsapp(text)) == 0
+        assert dashboard.ingest(text_upload(text)) is None
+        assert dashboard.ingest_preview(text_upload(text)) is None
+    print('export formats and empty uploads as expected')
+
+
+def main():
+    warnings.filterwarnings('ignore')
+    dashboard = load_dashboard()
+    check_samples(dashboard)
+    check_formats(dashboard)
+
+
+if __name__ == '__main__':
+    main()
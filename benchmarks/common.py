@@ -0,0 +1,91 @@
+import base64
+import importlib.util
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sample_messages = np.array([
+    'ok', 'haha', 'see you later', 'lunch?', 'on my way 😂', 'I think tele is down since more than an hour ago',
+    'Dennis says move off at 7:30, so probably wake up at 7', 'what even', 'nooders time 🤪', 'LOLOL'
+], dtype=object)
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+dashboard_path = os.path.join(repo_dir, 'dashboard_v0.6.py')
+
+
+class DashboardFinder:
+    # The dashboard file name is not importable as-is, so 'dashboard' is found by path. Installed on import, so that
+    # the dashboard's worker processes, which import the benchmark script and with it this module, find it too.
+    def find_spec(self, name, path=None, target=None):
+        if name == 'dashboard':
+            return importlib.util.spec_from_file_location('dashboard', dashboard_path)
+        return None
+
+
+sys.meta_path.append(DashboardFinder())
+
+
+def load_dashboard():
+    return importlib.import_module('dashboard')
+
+
+def synthetic_frame(n_rows, n_users=5, years=5, seed=0):
+    # Same columns as parse_whatsapp/parse_telegram produce, generated without any per-row Python.
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2019-01-01T00:00:00', 's').astype('int64')
+    seconds = np.sort(start + rng.integers(0, years * 365 * 86400, n_rows))
+    timestamps = pd.Series(seconds.astype('datetime64[s]').astype('datetime64[ns]'))
+    users = [f'User {i}' for i in range(n_users)]
+    days_of_week = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    messages = sample_messages[rng.integers(0, len(sample_messages), n_rows)]
+    return pd.DataFrame({
+        'Timestamp': timestamps,
+        'Hour': timestamps.dt.hour,
+        'Day': pd.Categorical.from_codes(timestamps.dt.weekday, categories=days_of_week, ordered=True),
+        'User': pd.Categorical.from_codes(rng.integers(0, n_users, n_rows), categories=users),
+        'Message': messages,
+        'Emojis': pd.Series(messages).map({m: ''.join(c for c in m if ord(c) > 0xffff) for m in sample_messages}),
+        'Words': (pd.Series(messages).str.count(' ') + 1).astype('int32'),
+        'Flags': np.zeros(n_rows, dtype='uint8')
+    })
+
+
+def synthetic_chat(n_messages, n_users=5, years=1, seed=0):
+    # synthetic_frame written out as an iOS WhatsApp export, encoded the way dcc.Upload sends it.
+    df = synthetic_frame(n_messages, n_users, years, seed)
+    lines = '[' + df.Timestamp.dt.strftime('%d/%m/%y, %H:%M:%S') + '] ' + df.User.astype(str) + ': ' + df.Message
+    return 'data:text/plain;base64,' + base64.b64encode('\n'.join(lines).encode('utf-8')).decode('ascii')
+
+
+def timed(function, *args, repeat=3, **kwargs):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def callback_body(outputs, inputs, state=()):
+    # Request body of Dash's /_dash-update-component endpoint; ids are given as 'component.property'
+    # and the first input is the one that fired.
+    def prop(spec, value=None):
+        component, name = spec.split('.', 1)
+        return {'id': component, 'property': name, 'value': value}
+
+    return {
+        'output': outputs[0] if len(outputs) == 1 else '..' + '...'.join(outputs) + '..',
+        'outputs': [{'id': spec.split('.')[0], 'property': spec.split('.', 1)[1]} for spec in outputs]
+        if len(outputs) > 1 else {'id': outputs[0].split('.')[0], 'property': outputs[0].split('.', 1)[1]},
+        'inputs': [prop(spec, value) for spec, value in inputs],
+        'changedPropIds': [inputs[0][0]],
+        'state': [prop(spec, value) for spec, value in state]
+    }
+
+
+def post_callback(client, outputs, inputs, state=(), headers=None):
+    return client.post('/_dash-update-component', json=callback_body(outputs, inputs, state), headers=headers or {})
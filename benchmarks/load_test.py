@@ -0,0 +1,194 @@
+# Load test: N simulated sessions drive the real callback endpoints (upload, filters, Submit) concurrently, either
+# in-process through Flask's test client or against a running local server, and report throughput, latency
+# percentiles and memory growth per callback. A Submit fires every callback the button drives: the stats, graphs
+# and words panels, the timeline, the message scatter unless CHAT_STORAGE=chunked, and the three count charts unless
+# CLIENTSIDE_FILTERS=1 (with --url, set both as the server has them). Errors count the requests whose task failed:
+# a busy server or a timeout, as well as HTTP errors. Synthetic chats only, so it runs offline.
+# Usage: python benchmarks/load_test.py [--sessions 8] [--messages 20000] [--rounds 3] [--same-chat]
+#        python benchmarks/load_test.py --url http://127.0.0.1:8050 [--pid <server pid>]
+import argparse
+import glob
+import json
+import os
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from common import callback_body, load_dashboard, synthetic_chat
+
+
+def process_tree_rss(pid):
+    # Resident memory of a process and all its descendants (the compute pool workers), from /proc; Linux only.
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            rss = next(int(line.split()[1]) * 1024 for line in status if line.startswith('VmRSS:'))
+        children = []
+        for path in glob.glob(f'/proc/{pid}/task/*/children'):
+            with open(path) as file:
+                children += file.read().split()
+    except (OSError, StopIteration):
+        return None
+    return rss + sum(process_tree_rss(child) or 0 for child in children)
+
+
+def in_process_poster():
+    client = load_dashboard().app.server.test_client()
+
+    def post(body):
+        response = client.post('/_dash-update-component', json=body)
+        return response.status_code, response.get_json() if response.status_code == 200 else None
+    return post
+
+
+def server_poster(url):
+    def post(body):
+        request = urllib.request.Request(url.rstrip('/') + '/_dash-update-component', data=json.dumps(body).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read()) if response.status == 200 else None
+        except urllib.error.HTTPError as e:
+            return e.code, None
+    return post
+
+
+def upload_body(contents):
+    return callback_body(['intermediate-values.children', 'dataset-meta.data', 'dataset-pyramid.data',
+                          'upload-status.children', 'refine-interval.disabled', 'pending-upload.data',
+                          'dataset-refined.data'],
+                         [('upload-data.contents', contents), ('refine-interval.n_intervals', None)],
+                         [('intermediate-values.children', None), ('upload-options.value', []),
+                          ('pending-upload.data', None)])
+
+
+def filters_body(meta):
+    return callback_body(['filter-selection.children'], [('dataset-meta.data', meta)])
+
+
+def filter_state(intermediate_values, meta):
+    return [('intermediate-values.children', intermediate_values),
+            ('date-range.value', [meta['start_day'], meta['end_day']]),
+            ('user-selection.value', [user['name'] for user in meta['users']]),
+            ('hidden-categories.value', [])]
+
+
+def panel_body(panel, intermediate_values, meta):
+    # update_stats, update_graphs or update_words.
+    return callback_body([f'{panel}.children', f'{panel}-state.data'],
+                         [('submit-val.n_clicks', 1), ('dataset-refined.data', None)],
+                         filter_state(intermediate_values, meta) + [(f'{panel}-state.data', None)])
+
+
+def timeline_body(intermediate_values, meta):
+    return callback_body(['timeline.figure', 'timeline-container.style'],
+                         [('submit-val.n_clicks', 1), ('timeline.relayoutData', None)],
+                         filter_state(intermediate_values, meta))
+
+
+def count_graph_body(graph_id, intermediate_values, meta):
+    return callback_body([f'{graph_id}.figure'], [('submit-val.n_clicks', 1)], filter_state(intermediate_values, meta))
+
+
+def scatter_body(intermediate_values, meta):
+    return callback_body(['message-scatter.figure', 'message-scatter-container.style'],
+                         [('submit-val.n_clicks', 1), ('message-scatter.relayoutData', None),
+                          ('dataset-refined.data', None)],
+                         filter_state(intermediate_values, meta))
+
+
+def submit_bodies(intermediate_values, meta, clientside, chunked):
+    # Every callback a Submit click fires. Count charts drawn in the browser and the scatter of a chunked dataset,
+    # which keeps no messages, never reach the server.
+    bodies = [panel_body(panel, intermediate_values, meta) for panel in ('stats', 'graphs', 'words')]
+    bodies.append(timeline_body(intermediate_values, meta))
+    if not clientside:
+        bodies += [count_graph_body(graph_id, intermediate_values, meta)
+                   for graph_id in ('hour-counts', 'weekday-counts', 'weekday-hour-counts')]
+    if not chunked:
+        bodies.append(scatter_body(intermediate_values, meta))
+    return bodies
+
+
+def run_phase(post, bodies, pid):
+    # Every session sends its request at once; returns per-request latencies and responses, wall time and RSS growth.
+    def timed_post(body):
+        start = time.perf_counter()
+        status, payload = post(body)
+        return time.perf_counter() - start, status, payload
+
+    rss_before = process_tree_rss(pid)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(bodies)) as pool:
+        results = list(pool.map(timed_post, bodies))
+    wall = time.perf_counter() - start
+    rss_after = process_tree_rss(pid)
+    growth = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+    return results, wall, growth
+
+
+def summary(name, results, wall, growth, failed):
+    latencies = np.array([latency for latency, _, _ in results])
+    errors = sum(1 for result in results if failed(result))
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    growth = f'{growth / 1e6:8.1f}' if growth is not None else '       -'
+    return f'{name:18} {len(results):5} {errors:6} {len(results) / wall:9.2f} {p50:8.3f} {p95:8.3f} {p99:8.3f} {growth}'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=20000, help='messages per synthetic chat')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=3, help='Submit clicks per session')
+    parser.add_argument('--same-chat', action='store_true', help='every session uploads the same chat')
+    parser.add_argument('--url', help='a running dashboard; in-process when omitted')
+    parser.add_argument('--pid', type=int, help='server process id, for memory readings with --url')
+    args = parser.parse_args()
+
+    post = server_poster(args.url) if args.url else in_process_poster()
+    pid = args.pid if args.url else os.getpid()
+    clientside = os.environ.get('CLIENTSIDE_FILTERS') == '1'
+    chunked = os.environ.get('CHAT_STORAGE') == 'chunked'
+    chats = [synthetic_chat(args.messages, args.users, seed=0 if args.same_chat else seed)
+             for seed in range(args.sessions)]
+    print(f'{args.sessions} sessions, {args.messages:,} messages each, {args.rounds} rounds of Submit, '
+          f'{"server " + args.url if args.url else "in-process"}')
+    rss_start = process_tree_rss(pid)
+
+    def upload_failed(result):
+        _, status, payload = result
+        return status != 200 or bool(payload['response']['upload-status']['children'])
+
+    def request_failed(result):
+        # A failed task still gets a 200 from the panels, with no state (the stats show an error card, the others
+        # keep what they had); the figure callbacks answer 204 instead.
+        _, status, payload = result
+        return status != 200 or any(output['data'] is None for name, output in payload['response'].items()
+                                    if name.endswith('-state'))
+
+    rows = []
+    results, wall, growth = run_phase(post, [upload_body(chat) for chat in chats], pid)
+    rows.append(summary('parse_data', results, wall, growth, upload_failed))
+    sessions = [(payload['response']['intermediate-values']['children'], payload['response']['dataset-meta']['data'])
+                for result in results if not upload_failed(result) for payload in [result[2]]]
+    if not sessions:
+        raise SystemExit('every upload failed')
+
+    results, wall, growth = run_phase(post, [filters_body(meta) for _, meta in sessions], pid)
+    rows.append(summary('generate_filters', results, wall, growth, request_failed))
+    for i in range(args.rounds):
+        results, wall, growth = run_phase(post, [body for values, meta in sessions
+                                                 for body in submit_bodies(values, meta, clientside, chunked)], pid)
+        rows.append(summary(f'Submit #{i + 1}', results, wall, growth, request_failed))
+
+    print(f'{"callback":18} {"calls":>5} {"errors":>6} {"calls/s":>9} {"p50 s":>8} {"p95 s":>8} {"p99 s":>8} {"RSS +MB":>8}')
+    print('\n'.join(rows))
+    rss_end = process_tree_rss(pid)
+    if rss_start is not None and rss_end is not None:
+        print(f'RSS {rss_start / 1e6:.1f} MB -> {rss_end / 1e6:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,140 +1,2668 @@
 import base64
+import hashlib
+import concurrent.futures
+import importlib
+import importlib.util
+import io
+import itertools
+import multiprocessing
+import os
 import re
-from collections import Counter
-from datetime import datetime
-from statistics import mean, median, stdev
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from html import escape
+from contextlib import closing
+from fractions import Fraction
 import json
+import math
+import sqlite3
 
 import dash
+import flask
 import dash_core_components as dcc
 import dash_html_components as html
-import emoji
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objs as go
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class LazyModule:
+    # Imports the named module on first attribute access, so the heavy ones stay out of cold start.
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+emoji = LazyModule('emoji')
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+go = LazyModule('plotly.graph_objs')
+subplots = LazyModule('plotly.subplots')
+pio = LazyModule('plotly.io')
+plotly_offline = LazyModule('plotly.offline')
+colors = LazyModule('plotly.colors')
+feature_text = LazyModule('sklearn.feature_extraction.text')
+wordcloud = LazyModule('wordcloud')
+# optional, for the word cloud figure; WORD_CLOUD=0 leaves it out
+wordcloud_installed = importlib.util.find_spec('wordcloud') is not None and os.environ.get('WORD_CLOUD') != '0'
 
 days_of_week = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-color_theme = [px.colors.qualitative.Plotly[i] for i in range(10)]
-hhmm_list = pd.date_range('00:00', '23:59', freq='1min').time
+date_marks_count = 6
+max_reply_delay = 12 * 60 * 60  # a longer silence starts a new conversation instead of counting as a reply
+session_gap = 60 * 60  # a silence longer than this ends a session
+timeline_max_bars = 400  # the timeline uses the finest resolution that fits in this many bars
+# What the dashboard builders compute on request: the stats cards, the figures and the word figures. The page shows
+# each as its own output, updated by its own callback. The count figures (hour, weekday and heatmap) are drawn from
+# the time pyramid instead, exact even for a preview.
+dashboard_panels = ('stats', 'graphs', 'words')
+# The tables each panel and the message scatter read, as {table: columns, or None for all of them}, over the
+# in-memory, preview and chunked datasets. Their tasks are sent, and decode, only these; none reads the message text.
+panel_tables = {
+    'stats': {'messages': ['Timestamp', 'User', 'Flags', 'Emojis', 'ReplyTo', 'Depth', 'EditDelay', 'Forwarded'],
+              'sessions': None, 'lengths': None, 'length_sketch': None, 'reply_offsets': None, 'reply_children': None,
+              'sample': None, 'strata': None, 'series': None, 'emojis': None, 'replies': None, 'reply_hours': None},
+    'graphs': {'messages': ['Timestamp', 'User', 'Flags', 'ReplyTo', 'Depth', 'EditDelay', 'Forwarded'],
+               'sessions': None, 'links': None, 'reply_offsets': None, 'reply_children': None, 'sample': None,
+               'strata': None, 'series': None, 'domains': None, 'replies': None, 'reply_hours': None},
+    'words': {'messages': ['Timestamp', 'User', 'Flags'], 'vocabulary': None, 'word_offsets': None,
+              'word_entries': None, 'word_blocks': None, 'word_block_entries': None, 'sample': None, 'strata': None,
+              'series': None, 'sessions': None, 'replies': None, 'reply_hours': None},
+    'scatter': {'messages': ['Timestamp', 'User', 'Flags', 'Words']}
+}
+count_graph_ids = ['hour-counts', 'weekday-counts', 'weekday-hour-counts']
+scatter_point_budget = 20000  # most points the message scatter sends for any viewport
+delay_bins_per_octave = 4
+# Words-per-message sketch: exact counts below sketch_exact words, log-spaced buckets above it, per_octave per doubling.
+# A quantile is exact while it falls below sketch_exact, and within 2^(1/2k) - 1 (about 1.1%) of the exact value above.
+sketch_exact = 128
+sketch_per_octave = 32
+compute_workers = int(os.environ.get('COMPUTE_WORKERS', min(4, os.cpu_count() or 1)))  # 0 runs everything inline
+# Tasks that may wait for a worker. A Submit sends one per panel_tables entry at once, so the default holds two
+# Submits per worker, and one Submit on an idle server is never turned away in part.
+compute_queue = int(os.environ.get('COMPUTE_QUEUE', 2 * max(compute_workers, 1) * len(panel_tables)))
+compute_timeout = int(os.environ.get('COMPUTE_TIMEOUT', 120))  # seconds a request waits for its task
+compute_slots = threading.BoundedSemaphore(max(compute_workers + compute_queue, 1))
+# Uploads are parsed in processes of their own, at most UPLOAD_WORKERS at a time, so the compute pool is left whole
+# to interactive requests even on a single CPU.
+upload_workers = int(os.environ.get('UPLOAD_WORKERS', max(compute_workers - 1, 1)))
+upload_slots = threading.BoundedSemaphore(max(upload_workers, 1))
+# Compute and upload processes are forked from a server process of their own, which loads this module and the heavy
+# libraries once and runs no threads, never from this one: a request thread may hold a lock (an import's, a
+# library's) at any moment, and a process forked then would wait on it forever.
+process_context = multiprocessing.get_context('forkserver')
+process_context.set_forkserver_preload(list(dict.fromkeys(['__main__', __name__, 'numpy', 'pandas', 'plotly.graph_objs'])))
+# Message categories, stored as bits of the uint8 Flags column; the filters hide any message with a hidden bit set.
+message_flags = {'media': 1, 'system': 2, 'link': 4, 'edited': 8, 'deleted': 16}
+default_hidden_categories = ['system']
+system_user = '(system)'  # sender of WhatsApp system lines, which have none
+whatsapp_header = (r'^\u200e?\[?(\d{1,2})/(\d{1,2})/(\d{2,4}),? (\d{1,2}):(\d{2})(?::(\d{2}))?'
+                   r'(?:\s?([AaPp])\.?[Mm]\.?)?(?:\]| -) (.*)$')
+whatsapp_patterns = {
+    'media': r'<Media omitted>|\(file attached\)|<attached: |^\u200e?(?:image|video|audio|sticker|GIF|document|Contact card) omitted$',
+    'link': r'https?://|www\.',
+    'edited': r'<This message was edited>$',
+    'deleted': r'^\u200e?(?:This message was deleted|You deleted this message)\.?$',
+    'system': r'^\u200e|^Messages and calls are end-to-end encrypted'
+}
+edited_marker = r'\s*\u200e?<This message was edited>$'
+url_pattern = r'(?:https?://|www\.)[^\s<>"]+'  # the links counted by the 'link' category
+domain_pattern = r'^(?:[A-Za-z][A-Za-z0-9+.-]*://)?(?:[^@/?#]*@)?(?:www\d*\.)?([^/:?#]+)'
+domains_shown = 10
+# Word statistics: a message x term count matrix built at ingest, single words and word pairs, with English stop
+# words removed before the pairs are formed (as in the notebook). Terms found in fewer than word_min_messages
+# messages are left out; media, system and deleted messages and links add no words.
+word_token = r'(?u)\b[^\W\d_]{2,}\b'
+word_min_messages = 2
+word_skip_flags = message_flags['media'] | message_flags['system'] | message_flags['deleted']
+words_shown = 20
+word_cloud_terms = 200
+telegram_columns = ['id', 'date_unixtime', 'from', 'text', 'type', 'actor', 'edited_unixtime', 'reply_to_message_id']
+telegram_media_columns = ['photo', 'file', 'media_type', 'sticker_emoji', 'location_information', 'contact_information',
+                          'poll']
+# Telegram text entities counted into side columns of the messages; the text itself is the concatenation of all of them.
+telegram_entity_columns = {'mention': 'Mentions', 'mention_name': 'Mentions', 'link': 'Links', 'text_link': 'Links',
+                           'hashtag': 'Hashtags'}
+telegram_block_size = 1 << 20  # characters read at a time while decoding an export
+reports_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports')
+# Exported reports get random names and are deleted REPORT_TTL seconds after they are written; at most REPORTS_MAX
+# are kept, the oldest going first.
+report_ttl = int(os.environ.get('REPORT_TTL', 3600))
+reports_max = int(os.environ.get('REPORTS_MAX', 100))
+# CHAT_STORAGE=sqlite keeps uploaded chats in on-disk SQLite files and answers the filters with indexed queries,
+# for chats that do not fit in memory; CHAT_STORAGE=chunked parses the export CHUNK_ROWS lines at a time and keeps
+# only aggregates, never the messages. The default keeps the whole dataset in the page.
+storage_backend = os.environ.get('CHAT_STORAGE', 'memory')
+storage_dir = os.environ.get('CHAT_STORAGE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage')
+sqlite_prefix = 'sqlite:'
+# In-memory datasets stay on the server, in the dataset registry, and the page only holds their key. Past
+# DATASET_MEMORY_MB of datasets and derived caches, the least recently used datasets are spilled to disk.
+dataset_prefix = 'dataset:'
+dataset_memory_budget = int(os.environ.get('DATASET_MEMORY_MB', 1024)) << 20
+# Spilled datasets are kept within DATASET_DISK_MB, the least recently used deleted first, and datasets no page has
+# used for DATASET_TTL seconds are deleted; a page that comes back to one asks for the upload again.
+dataset_disk_budget = int(os.environ.get('DATASET_DISK_MB', 4096)) << 20
+dataset_ttl = int(os.environ.get('DATASET_TTL', 86400))
+# /datasets/usage, the registry's sizes and every session's key prefix, answers only requests from these addresses
+# (space separated; behind a proxy, the proxy's).
+usage_addresses = os.environ.get('USAGE_ADDRESSES', '127.0.0.1 ::1').split()
+# Preview uploads: a first, approximate dashboard from a stratified sample (by user and month) of about PREVIEW_ROWS
+# messages, at least preview_min_stratum from each stratum, replaced by the exact one when the full ingest is done.
+preview_rows = int(os.environ.get('PREVIEW_ROWS', 50000))
+preview_min_stratum = 30
+preview_poll_ms = 2000
+upload_hash_block = 1 << 22  # base64 characters decoded at a time when fingerprinting or streaming an upload
+sqlite_insert_rows = 100000
+chunk_rows = int(os.environ.get('CHUNK_ROWS', 100000))
+# CLIENTSIDE_FILTERS=1 draws the hour, weekday and heatmap charts in the browser (assets/clientside.js) from the hourly
+# level of the time pyramid, so moving a filter redraws them without a request; the other panels still update on Submit.
+# Only in this mode is that level sent to the page; the whole pyramid stays on the server, in the dataset registry.
+clientside_filters = os.environ.get('CLIENTSIDE_FILTERS') == '1'
+hour_bins = [1, 2, 3, 4, 6, 8, 12]  # hours per bar offered for the client-side charts
+# Keys of the partial aggregates, built at ingest and merged across chunks in chunked mode. Each table also has a
+# Count column, summed when merging, plus the value columns below. No key grows with the number of messages, only
+# with the span and the users.
+aggregate_keys = {
+    'counts': ['Series', 'Day', 'Hour'],
+    'lengths': ['User', 'Flags', 'Day'],
+    'length_sketch': ['User', 'Flags', 'Day', 'Bucket'],
+    'emojis': ['Series', 'Day', 'Emoji'],
+    'replies': ['User', 'Day', 'Bin'],
+    'reply_hours': ['User', 'Month', 'Hour', 'Bin'],
+    'domains': ['Series', 'Day', 'Domain']
+}
+aggregate_values = {
+    'lengths': {'Sum': 'sum', 'SumSquares': 'sum', 'Max': 'max'},
+    'emojis': {'First': 'min'},
+    'replies': {'Seconds': 'sum'}
+}
+aggregate_merge_every = 8  # partials kept per table before they are merged into one
+sqlite_schema = """
+CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE messages (ts INTEGER NOT NULL, hour INTEGER NOT NULL, weekday INTEGER NOT NULL, user INTEGER NOT NULL,
+                       words INTEGER NOT NULL, flags INTEGER NOT NULL, session INTEGER NOT NULL, emojis TEXT NOT NULL,
+                       message TEXT NOT NULL, reply_to INTEGER, depth INTEGER, edit_delay INTEGER,
+                       forwarded INTEGER);
+CREATE TABLE sessions (started INTEGER NOT NULL, ended INTEGER NOT NULL, messages INTEGER NOT NULL,
+                       participants INTEGER NOT NULL, initiator INTEGER NOT NULL);
+CREATE TABLE domains (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE links (message INTEGER NOT NULL, domain INTEGER NOT NULL);
+CREATE TABLE terms (id INTEGER PRIMARY KEY, term TEXT NOT NULL, words INTEGER NOT NULL);
+CREATE TABLE message_terms (message INTEGER NOT NULL, term INTEGER NOT NULL, count INTEGER NOT NULL);
+CREATE TABLE month_terms (month INTEGER NOT NULL, user INTEGER NOT NULL, flags INTEGER NOT NULL, term INTEGER NOT NULL,
+                          count INTEGER NOT NULL);
+"""
+sqlite_indexes = """
+CREATE INDEX messages_user_ts ON messages (user, ts);
+CREATE INDEX messages_ts ON messages (ts);
+CREATE INDEX sessions_started ON sessions (started);
+CREATE INDEX links_message ON links (message);
+CREATE INDEX message_terms_message ON message_terms (message);
+CREATE INDEX month_terms_month ON month_terms (month);
+CREATE INDEX messages_reply_to ON messages (reply_to) WHERE reply_to IS NOT NULL;
+ANALYZE;
+"""
+report_template = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Chat report</title>
+<style>
+body {{font-family: sans-serif; background-color: #f5f5f5; margin: 10px;}}
+.card {{display: inline-block; vertical-align: top; background-color: white; padding: 10px; margin: 0 10px 10px 0; font-size: 14px;}}
+.chart {{display: inline-block; width: 50%; margin-bottom: 10px;}}
+</style>
+<script type="text/javascript">{plotlyjs}</script>
+</head>
+<body>
+<h2>Chat report</h2>
+<p>{subtitle}</p>
+<div>{cards}</div>
+<div>{charts}</div>
+</body>
+</html>
+"""
+typed_array_dtypes = {'int8': 'i1', 'uint8': 'u1', 'int16': 'i2', 'uint16': 'u2',
+                      'int32': 'i4', 'uint32': 'u4', 'float32': 'f4', 'float64': 'f8'}
 
 
-def day_of_week(i):
-    return days_of_week[i]
+@lru_cache(maxsize=None)
+def color_theme():
+    return colors.qualitative.Plotly[:10]
 
 
 def extract_emojis(s):
     return ''.join(c for c in s if str(c) in emoji.UNICODE_EMOJI)
 
 
+def epoch_days(timestamps):
+    return timestamps.values.astype('datetime64[D]').astype('int64')
+
+
+def epoch_day_to_date(day):
+    return (datetime(1970, 1, 1) + timedelta(days=int(day))).strftime('%Y-%m-%d')
+
+
+def dataset_metadata(df):
+    # Everything the filters need, so they never have to re-read the dataset itself.
+    days = epoch_days(df.Timestamp)
+    user_counts = df.User.value_counts()
+    return {
+        'start': df.Timestamp.min().isoformat(),
+        'end': df.Timestamp.max().isoformat(),
+        'start_day': int(days.min()),
+        'end_day': int(days.max()),
+        'messages': int(df.shape[0]),
+        'users': [{'name': user, 'messages': int(user_counts[user])} for user in sorted(user_counts.index)],
+        'categories': [{'name': category, 'messages': int(((df.Flags.values & flag) > 0).sum())}
+                       for category, flag in message_flags.items()]
+    }
+
+
+def date_marks(start_day, end_day):
+    # A fixed number of marks, however many days the chat spans.
+    if end_day <= start_day:
+        return {start_day: epoch_day_to_date(start_day)}
+    step = (end_day - start_day) / (date_marks_count - 1)
+    marks = sorted({int(round(start_day + i * step)) for i in range(date_marks_count)})
+    return {day: epoch_day_to_date(day) for day in marks}
+
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def loads(s):
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+
+def encode_array(values):
+    values = np.ascontiguousarray(values)
+    return {
+        'dtype': values.dtype.str,
+        'shape': list(values.shape),
+        'bdata': base64.b64encode(values.tobytes()).decode('ascii')
+    }
+
+
+def series_rows(pyramid, selected_users, hidden_flags=0):
+    # users x series 0/1 matrix that sums the pyramid's visible series into one row per selected user.
+    return np.array([[series_user == user and not flags & hidden_flags for series_user, flags in pyramid['series']]
+                     for user in selected_users], dtype='int64').reshape(len(selected_users), len(pyramid['series']))
+
+
+def pyramid_weekday_hour(pyramid, selected_users, date_range, hidden_flags=0):
+    # Messages by user, weekday and hour for the filters, from the hourly level of the time pyramid instead of the
+    # messages. Mirrored by weekdayHour in assets/clientside.js.
+    level = pyramid['levels'][0]
+    counts = decode_array(level['counts'])
+    start = max(int(date_range[0]) * 24 - level['first'], 0)
+    end = min((int(date_range[1]) + 1) * 24 - level['first'], counts.shape[1])
+    by_hour = series_rows(pyramid, selected_users, hidden_flags) @ counts[:, start:max(start, end)]
+    hours = level['first'] + np.arange(start, max(start, end))
+    cells = np.tile(((hours // 24 + 3) % 7) * 24 + hours % 24, len(selected_users))
+    users = np.repeat(np.arange(len(selected_users)), by_hour.shape[1])
+    return count_by_user(users, cells, 7 * 24, len(selected_users), by_hour.ravel()).reshape(-1, 7, 24)
+
+
+def decode_array(encoded):
+    buffer = bytearray(base64.b64decode(encoded['bdata']))
+    return np.frombuffer(buffer, dtype=encoded['dtype']).reshape(encoded['shape'])
+
+
+def encode_column(column):
+    # Numeric and datetime columns travel as raw buffers, categoricals as codes; only text stays a JSON list.
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return {
+            'kind': 'category',
+            'categories': column.cat.categories.tolist(),
+            'ordered': bool(column.cat.ordered),
+            'codes': encode_array(column.cat.codes.values)
+        }
+    if column.dtype.kind in 'biufmM':
+        return {'kind': 'array', 'values': encode_array(column.values)}
+    return {'kind': 'object', 'values': column.astype(str).tolist()}
+
+
+def decode_column(encoded):
+    if encoded['kind'] == 'category':
+        return pd.Categorical.from_codes(decode_array(encoded['codes']), categories=encoded['categories'],
+                                         ordered=encoded['ordered'])
+    if encoded['kind'] == 'array':
+        return decode_array(encoded['values'])
+    return pd.Series(encoded['values'], dtype='object')
+
+
+def encode_dataset(tables):
+    # An index, {table: [[column, start, end], ...]}, on the first line, then every column encoded on its own at
+    # those offsets into the rest, so that a reader can take and decode only the columns it needs.
+    index, parts, end = {}, [], 0
+    for name, table in tables.items():
+        index[name] = []
+        for column in table.columns:
+            parts.append(dumps(encode_column(table[column])))
+            index[name].append([column, end, end + len(parts[-1])])
+            end += len(parts[-1])
+    return dumps(index) + '\n' + ''.join(parts)
+
+
+def dataset_index(payload):
+    # The index of an encoded dataset, and where its columns start.
+    header = payload.index('\n')
+    return loads(payload[:header]), header + 1
+
+
+def select_dataset(payload, tables):
+    # The encoded dataset cut down to tables, {table: columns, or None for all of them}, without decoding anything.
+    # Tables and columns the dataset does not have are skipped.
+    index, body = dataset_index(payload)
+    selected, parts, end = {}, [], 0
+    for name, columns in tables.items():
+        if name not in index:
+            continue
+        selected[name] = []
+        for column, start, stop in index[name]:
+            if columns is None or column in columns:
+                parts.append(payload[body + start:body + stop])
+                selected[name].append([column, end, end + stop - start])
+                end += stop - start
+    return dumps(selected) + '\n' + ''.join(parts)
+
+
+def decode_dataset(payload):
+    index, body = dataset_index(payload)
+    return {name: pd.DataFrame({column: decode_column(loads(payload[body + start:body + end]))
+                                for column, start, end in columns})
+            for name, columns in index.items()}
+
+
+def narrow_integers(values):
+    # The narrowest integer type that holds every value (counts usually fit in one or two bytes).
+    low, high = (int(values.min()), int(values.max())) if values.size else (0, 0)
+    for dtype in ['uint8', 'int8', 'uint16', 'int16', 'uint32', 'int32']:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return values.astype(dtype, copy=False)
+    return values
+
+
+def typed_array(values):
+    # plotly.js reads {dtype, bdata, shape} objects as typed arrays, but has no 64-bit integer type.
+    if values.dtype.kind in 'iu':
+        values = narrow_integers(values)
+        if values.dtype.itemsize == 8:
+            values = values.astype('float64')
+    values = np.ascontiguousarray(values)
+    encoded = {'dtype': typed_array_dtypes[values.dtype.name], 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+    if values.ndim > 1:
+        encoded['shape'] = ', '.join(str(n) for n in values.shape)
+    return encoded
+
+
+def encode_typed_arrays(obj):
+    if isinstance(obj, dict):
+        return {key: encode_typed_arrays(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [encode_typed_arrays(value) for value in obj]
+    if isinstance(obj, np.ndarray) and obj.dtype.kind in 'iuf' and obj.ndim <= 2:
+        if obj.dtype.kind in 'iu' or obj.dtype.name in typed_array_dtypes:
+            return typed_array(obj)
+    return obj
+
+
+def encode_figure_list(figure):
+    # NumPy arrays are left in place for the JSON engine (orjson when available) to write directly.
+    return figure
+
+
+def encode_figure_typed(figure):
+    figure = dict(figure)
+    figure['data'] = encode_typed_arrays(figure['data'])
+    return figure
+
+
+def default_figure_encoding():
+    # Typed arrays need plotly.js 2.28+, which ships with Dash 2.16 onwards.
+    version = tuple(int(part) for part in re.findall(r'\d+', dash.__version__)[:2])
+    return 'typed' if version >= (2, 16) else 'list'
+
+
+figure_encoders = {
+    'list': encode_figure_list,
+    'typed': encode_figure_typed
+}
+figure_encoding = os.environ.get('FIGURE_ENCODING') or default_figure_encoding()
+
+
+def encode_figure(fig):
+    # Takes a figure or, from the compute pool, its to_dict().
+    return figure_encoders[figure_encoding](fig if isinstance(fig, dict) else fig.to_dict())
+
+
+def time_codes(timestamps):
+    # Integer codes for the bincount kernels below, all derived from one datetime64 column.
+    minutes = np.asarray(timestamps).astype('datetime64[m]').astype('int64')
+    days = minutes // 1440
+    minute = minutes - days * 1440
+    return {
+        'minute': minute,
+        'hour': minute // 60,
+        'weekday': (days + 3) % 7,  # 1970-01-01 was a Thursday
+        'day': days,
+        'month': month_codes(days)
+    }
+
+
+def month_codes(days):
+    # Months through a per-day lookup table; casting every row to datetime64[M] is several times slower.
+    if len(days) == 0:
+        return days
+    first = days.min()
+    month_of_day = np.arange(first, days.max() + 1).astype('datetime64[D]').astype('datetime64[M]')
+    return month_of_day.astype('int64')[days - first]
+
+
+def user_codes(users, selected_users):
+    return pd.Categorical(users, categories=selected_users).codes.astype('int64')
+
+
+def count_by_user(user_code, code, size, n_users, weights=None):
+    # One bincount pass over (user, code) pairs gives a dense, zero-filled n_users x size matrix. With weights,
+    # each pair counts that many times (for rows that are already counts).
+    counts = np.bincount(user_code * size + code, weights=weights, minlength=n_users * size)
+    return counts.astype('int64', copy=False).reshape(n_users, size)
+
+
+def count_span(user_code, index, n_users, weights=None):
+    # Counts over a contiguous range of indices (months, days, ...); returns the first index alongside.
+    if len(index) == 0:
+        return 0, np.zeros((n_users, 0), dtype='int64')
+    first = int(index.min())
+    return first, count_by_user(user_code, index - first, int(index.max()) - first + 1, n_users, weights)
+
+
+def time_pyramid(df):
+    # Message counts at every timeline resolution, computed once at ingest. Each level records how its bucket labels
+    # are generated: first + i * step, in numpy datetime64 units. Weeks start on Monday. Rows are (user, flags)
+    # series, so hiding a message category drops rows instead of recounting messages.
+    users = sorted(df.User.unique())
+    series, series_code = np.unique(user_codes(df.User, users) * 256 + df.Flags.values, return_inverse=True)
+    codes = time_codes(df.Timestamp)
+    return pyramid_levels([[users[code // 256], int(code % 256)] for code in series], series_code, codes['day'],
+                          codes['hour'])
+
+
+def pyramid_levels(series, series_code, day, hour, weights=None):
+    week = (day + 3) // 7
+    month = month_codes(day)
+    levels = []
+    for name, unit, step, index in [('hour', 'h', 1, day * 24 + hour),
+                                    ('day', 'D', 1, day),
+                                    ('week', 'D', 7, week),
+                                    ('month', 'M', 1, month),
+                                    ('year', 'Y', 1, month // 12)]:
+        first, counts = count_span(series_code, index, len(series), weights)
+        levels.append({
+            'name': name,
+            'unit': unit,
+            'step': step,
+            'first': first * 7 - 3 if name == 'week' else first,
+            'counts': encode_array(narrow_integers(counts))
+        })
+    return {'series': series, 'levels': levels}
+
+
+def level_bounds(level, n_buckets, x_range):
+    # Slice of bucket indices overlapping x_range, clipped to the level.
+    unit, step, first = level['unit'], level['step'], level['first']
+    start, end = (np.datetime64(pd.Timestamp(x), unit).astype('int64') for x in x_range)
+    return max((start - first) // step, 0), min((end - first) // step + 1, n_buckets)
+
+
+def timeline_figure(pyramid, selected_users, date_range, hidden_flags=0, x_range=None):
+    # Picks the finest level that shows x_range in at most timeline_max_bars bars and slices it; the raw messages
+    # are never touched. x_range defaults to, and is clipped by, the selected date range.
+    full_range = [np.datetime64(epoch_day_to_date(date_range[0])), np.datetime64(epoch_day_to_date(date_range[1] + 1))]
+    if x_range is None:
+        x_range = full_range
+    else:
+        x_range = [max(np.datetime64(pd.Timestamp(x_range[0])), full_range[0]),
+                   min(np.datetime64(pd.Timestamp(x_range[1])), full_range[1])]
+    rows = series_rows(pyramid, selected_users, hidden_flags)
+    for level in pyramid['levels']:
+        counts = decode_array(level['counts'])
+        i0, i1 = level_bounds(level, counts.shape[1], x_range)
+        if i1 - i0 <= timeline_max_bars or level['name'] == 'year':
+            break
+    starts = (level['first'] + np.arange(i0, i1 + 1) * level['step']).astype(f'datetime64[{level["unit"]}]')
+    starts = starts.astype('datetime64[ms]')
+    widths = 0.9 * np.diff(starts).astype('int64')
+    fig = stacked_bars(starts[:-1].astype(str), rows @ counts[:, i0:i1], selected_users)
+    return fig.update_traces(width=widths, offset=0).update_layout(
+        title=f'Messages per {level["name"]}',
+        xaxis={'type': 'date', 'range': [str(x) for x in x_range]}
+    )
+
+
+def relayout_range(relayout_data, axis='xaxis'):
+    # The range a zoom or pan left the axis at; None for a reset to the full range.
+    if f'{axis}.range[0]' in relayout_data:
+        return [relayout_data[f'{axis}.range[0]'], relayout_data[f'{axis}.range[1]']]
+    if f'{axis}.range' in relayout_data:
+        return relayout_data[f'{axis}.range']
+    return None
+
+
+def scatter_viewport(date_range, x_range=None, y_range=None):
+    # The message scatter's viewport: epoch ms of the first and after the last day on screen, and the hours shown.
+    x0, x1 = (date_range[0] * 86400000, (date_range[1] + 1) * 86400000) if x_range is None else \
+        (int(pd.Timestamp(x).value // 1000000) for x in x_range)
+    y0, y1 = (0, 24) if y_range is None else (float(y) for y in y_range)
+    return x0, x1, y0, y1
+
+
+def density_grid(x0, x1, n_users):
+    # Columns and rows of the density grid: a column a day at most, and n_users * nx * ny cells within the budget.
+    ny = 48
+    return max(1, min(int(np.ceil((x1 - x0) / 86400000)), scatter_point_budget // (n_users * ny))), ny
+
+
+def scatter_layout(fig, title, x0, x1, y0, y1):
+    return fig.update_layout(
+        title=title,
+        legend_title_text='User',
+        xaxis={'type': 'date', 'range': [str(np.datetime64(x0, 'ms')), str(np.datetime64(x1, 'ms'))]},
+        yaxis={'title': 'Time of day (hours)', 'range': [y0, y1]}
+    )
+
+
+def density_figure(counts, selected_users, x0, x1, y0, y1):
+    # counts: users x (nx * ny) messages per cell of the grid, column major, drawn as a point per non-empty cell.
+    nx, ny = density_grid(x0, x1, len(selected_users))
+    fig = go.Figure()
+    for i, user in enumerate(selected_users):
+        cells = np.flatnonzero(counts[i])
+        fig.add_trace(go.Scattergl(
+            x=(x0 + (cells // ny + 0.5) * (x1 - x0) / nx), y=(y0 + (cells % ny + 0.5) * (y1 - y0) / ny).astype('float32'),
+            name=user, mode='markers', customdata=counts[i, cells], hovertemplate='%{customdata} messages',
+            marker={'color': color_theme()[i % len(color_theme())], 'opacity': 0.6,
+                    'size': np.minimum(3 + 2 * np.sqrt(counts[i, cells]), 20).astype('uint8')}))
+    return scatter_layout(fig, f'Message density ({int(counts.sum())} messages in {int((counts > 0).sum())} cells)',
+                          x0, x1, y0, y1)
+
+
+def message_scatter_figure(df, selected_users, date_range, x_range=None, y_range=None):
+    # Every message as a WebGL point, date against time of day, sized by length. When more than
+    # scatter_point_budget messages fall in the viewport they are aggregated into a density grid over the viewport
+    # instead, so the payload stays under the budget whatever the chat size.
+    ms = df.Timestamp.values.astype('datetime64[ms]').astype('int64')
+    day_ms = ms // 86400000 * 86400000
+    hours = (ms - day_ms) / 3600000
+    x0, x1, y0, y1 = scatter_viewport(date_range, x_range, y_range)
+    visible = (x0 <= day_ms) & (day_ms < x1) & (y0 <= hours) & (hours <= y1)
+    user_code = user_codes(df.User, selected_users)[visible]
+    day_ms, hours, words = day_ms[visible], hours[visible], df.Words.values[visible]
+
+    if len(day_ms) > scatter_point_budget:
+        n_users = len(selected_users)
+        nx, ny = density_grid(x0, x1, n_users)
+        x_bin = np.minimum((day_ms - x0) * nx // (x1 - x0), nx - 1)
+        y_bin = np.minimum(((hours - y0) * ny // max(y1 - y0, 1e-9)).astype('int64'), ny - 1)
+        counts = count_by_user(user_code, x_bin * ny + y_bin, nx * ny, n_users)
+        return density_figure(counts, selected_users, x0, x1, y0, y1)
+    fig = go.Figure()
+    for i, user in enumerate(selected_users):
+        mine = user_code == i
+        fig.add_trace(go.Scattergl(
+            x=day_ms[mine].astype('float64'), y=hours[mine].astype('float32'), name=user, mode='markers',
+            marker={'color': color_theme()[i % len(color_theme())], 'opacity': 0.6,
+                    'size': np.minimum(3 + 2 * np.sqrt(words[mine]), 20).astype('uint8')}))
+    return scatter_layout(fig, f'Messages ({len(day_ms)} shown)', x0, x1, y0, y1)
+
+
+def stacked_bars(x, counts, users):
+    return go.Figure(
+        data=[go.Bar(x=x, y=counts[i], name=user, marker_color=color_theme()[i % len(color_theme())])
+              for i, user in enumerate(users)],
+        layout=dict(barmode='relative', legend_title_text='User', yaxis_title='count')
+    )
+
+
+def split_whatsapp(text, day_first=None):
+    # Splits an iOS ("[27/04/24, 01:30:00] Name: text") or Android ("27/4/24, 01:30 - Name: text", 12 or 24 hour)
+    # export with vectorised string operations. Lines without a header continue the previous message, and header
+    # lines without a "Name: " are system lines. Dates are read day first unless the export shows they are month
+    # first (US exports, "12/31/23, 10:00 - Name: text"); day_first fixes the order for the chunks of one export.
+    lines = pd.Series(text.splitlines(), dtype=object)
+    parts = lines.str.extract(whatsapp_header)
+    header = parts[0].notna().values
+    if not header.any():
+        return pd.DataFrame({'Timestamp': pd.Series(dtype='datetime64[ns]'), 'User': pd.Series(dtype=object),
+                             'Message': pd.Series(dtype=object)})
+    message = np.cumsum(header) - 1
+    parts = parts[header].reset_index(drop=True)
+    body = parts[7]
+    continued = lines[~header & (message >= 0)]
+    if len(continued):
+        continued = continued.groupby(message[continued.index]).agg('\n'.join)
+        body[continued.index] = body[continued.index] + '\n' + continued
+
+    sender = body.str.partition(': ')
+    system = sender[1] == ''
+    number = parts[[0, 1, 2, 3, 4, 5]].fillna('0').astype('int64')
+    if day_first is None:
+        day_first = whatsapp_day_first(parts)
+    day, month = (number[0], number[1]) if day_first is not False else (number[1], number[0])
+    meridiem = parts[6].str.lower()
+    timestamp = pd.to_datetime(pd.DataFrame({
+        'year': number[2].where(number[2] >= 100, number[2] + 2000),
+        'month': month,
+        'day': day,
+        'hour': number[3].where(meridiem.isna(), number[3] % 12 + 12 * (meridiem == 'p')),
+        'minute': number[4],
+        'second': number[5]
+    }), errors='coerce')
+    if timestamp.isna().any():
+        print(f'Warning: skipped {timestamp.isna().sum()} messages with an invalid date.')
+    df = pd.DataFrame({
+        'Timestamp': timestamp,
+        'User': sender[0].where(~system, system_user),
+        'Message': sender[2].where(~system, body)
+    })
+    return df[timestamp.notna().values].reset_index(drop=True)
+
+
+def whatsapp_day_first(parts):
+    # True or False when the header dates of an export show their order, None when every one reads both ways.
+    first, second = (pd.to_numeric(parts[i], errors='coerce') for i in (0, 1))
+    if (first > 12).any():
+        return True
+    if (second > 12).any():
+        return False
+    return None
+
+
+def classify_whatsapp(df):
+    matches = {category: df.Message.str.contains(pattern, regex=True).values
+               for category, pattern in whatsapp_patterns.items()}
+    matches['system'] = (df.User.values == system_user) | (matches['system'] & ~matches['media'] & ~matches['deleted'])
+    return category_flags(matches)
+
+
+def classify_telegram(df):
+    matches = {
+        'media': np.zeros(len(df), dtype=bool),
+        'system': (df['type'] == 'service').values,
+        'link': df.Message.str.contains(whatsapp_patterns['link'], regex=True).values | (df.Links.values > 0),
+        'edited': df.edited_unixtime.notna().values
+    }
+    for column in telegram_media_columns:
+        matches['media'] |= df[column].values
+    return category_flags(matches)
+
+
+def category_flags(matches):
+    flags = np.zeros(len(next(iter(matches.values()))), dtype='uint8')
+    for category, match in matches.items():
+        flags[match] |= message_flags[category]
+    return flags
+
+
+def flags_mask(categories):
+    return sum(message_flags[category] for category in categories or [])
+
+
+def link_table(df):
+    # One row per link, keyed by the row of its message, with the link reduced to its lower-case host. A single
+    # extractall pass over the messages the classifier already flagged as links.
+    messages = df.Message[(df.Flags.values & message_flags['link']) > 0]
+    urls = messages.str.extractall(f'({url_pattern})')[0]
+    domain = urls.str.extract(domain_pattern, expand=False).str.lower().str.rstrip('.')
+    domain = domain[domain.notna() & (domain.str.len() > 0)]
+    return pd.DataFrame({
+        'Row': df.index.get_indexer(domain.index.get_level_values(0)).astype('int32'),
+        'Domain': pd.Categorical(domain.values)
+    })
+
+
+def word_tables(df):
+    # The message x term count matrix of the messages, in CSR form: the entries (Term, Count) of message i are rows
+    # word_offsets.Offset[i] to word_offsets.Offset[i + 1] of word_entries, and vocabulary lists the terms by id.
+    # Built once at ingest, so word statistics for any filters never tokenize text again.
+    text = df.Message.where((df.Flags.values & word_skip_flags) == 0, '').str.replace(url_pattern, ' ', regex=True)
+    vectorizer = feature_text.CountVectorizer(ngram_range=(1, 2), stop_words='english', token_pattern=word_token,
+                                              min_df=word_min_messages, dtype=np.int32)
+    try:
+        matrix = vectorizer.fit_transform(text.values)
+        terms = np.empty(len(vectorizer.vocabulary_), dtype=object)
+        terms[list(vectorizer.vocabulary_.values())] = list(vectorizer.vocabulary_)
+        offsets, entries, counts = matrix.indptr, matrix.indices, matrix.data
+    except ValueError:
+        # No term left to count: a chat of media only, or too short for any term to repeat.
+        terms = np.empty(0, dtype=object)
+        offsets, entries = np.zeros(len(df) + 1, dtype='int64'), np.empty(0, dtype='int32')
+        counts = entries
+    # Term ids and counts take one or two bytes each in most chats, which halves what the words panel decodes.
+    return {
+        'word_offsets': pd.DataFrame({'Offset': narrow_integers(offsets.astype('int64'))}),
+        'word_entries': pd.DataFrame({'Term': narrow_integers(entries.astype('int32')),
+                                      'Count': narrow_integers(counts.astype('int32'))}),
+        'vocabulary': pd.DataFrame({'Term': terms, 'Words': (pd.Series(terms, dtype=object).str.count(' ') + 1)
+                                   .astype('int8')}),
+        **word_blocks(df, offsets, entries, counts, len(terms))
+    }
+
+
+def word_blocks(df, offsets, entries, counts, n_terms):
+    # The same counts summed per month and (user, flags) series, in CSR form too: block i covers rows
+    # word_blocks.Offset[i] to word_blocks.Offset[i + 1] (or the end) of word_block_entries. Blocks are in month
+    # order, so a date range reads whole months from here and only the days at either end from the messages.
+    users = sorted(df.User.unique())
+    n_series, n_terms = len(users) * 256, max(n_terms, 1)
+    series = user_codes(df.User, users) * 256 + df.Flags.values
+    blocks, message_block = np.unique(month_codes(epoch_days(df.Timestamp)) * n_series + series, return_inverse=True)
+    keys, entry_key = np.unique(np.repeat(message_block, np.diff(offsets)) * n_terms + entries, return_inverse=True)
+    block_series = blocks % n_series
+    return {
+        'word_blocks': pd.DataFrame({
+            'Month': blocks // n_series,
+            'User': pd.Categorical.from_codes(block_series // 256, categories=users),
+            'Flags': (block_series % 256).astype('uint8'),
+            'Offset': np.searchsorted(keys // n_terms, np.arange(len(blocks)))
+        }),
+        'word_block_entries': pd.DataFrame({
+            'Term': narrow_integers((keys % n_terms).astype('int32')),
+            'Count': narrow_integers(np.bincount(entry_key, weights=counts, minlength=len(keys)).astype('int64'))
+        })
+    }
+
+
 def parse_whatsapp(input_df):
     df = input_df.copy()
-    df.Date = pd.to_datetime(df.Date, format='%d/%m/%y')
-    df['MMYYYY'] = df.Date.apply(lambda x: x.strftime("%m/%Y"))
-    df.MMYYYY = pd.to_datetime(df.MMYYYY, format='%m/%Y')
-    df.Time = pd.to_datetime(df.Time, format='%H:%M:%S').dt.time
-    df['Hour'] = pd.to_datetime(df.Time, format='%H:%M:%S').dt.hour
-    df['Day'] = df.Date.dt.weekday
-    df.Day = df.Day.apply(day_of_week)
-    df.Day = df.Day.astype('category')
-    df.Day.cat.reorder_categories(days_of_week, ordered=True, inplace=True)
+    df['Flags'] = classify_whatsapp(df)
+    df.Message = df.Message.str.replace(edited_marker, '', regex=True)
+    df['Date'] = df.Timestamp.dt.normalize()
+    df['Time'] = df.Timestamp.dt.time
+    df['MMYYYY'] = df.Timestamp.values.astype('datetime64[M]')
+    df['Hour'] = df.Timestamp.dt.hour
+    df['Day'] = pd.Categorical.from_codes(df.Timestamp.dt.weekday, categories=days_of_week, ordered=True)
     df['Emojis'] = df.Message.apply(extract_emojis)
+    df = df[['Timestamp', 'Date', 'Time', 'MMYYYY', 'Hour', 'Day', 'User', 'Message', 'Emojis', 'Flags']]
     print('Dataframe created and WhatsApp data parsed.')
     return df
 
 
 def parse_telegram(input_df):
     df = input_df.copy()
-    df.date_unixtime = df.date_unixtime.apply(lambda x: int(x) + 8 * 60 * 60)  # For GMT+8
-    df['Date'] = pd.to_datetime(df.date_unixtime, unit='s').dt.date
-    df['Time'] = pd.to_datetime(df.date_unixtime, unit='s').dt.time
-    df['MMYYYY'] = df.Date.apply(lambda x: x.strftime("%m/%Y"))
-    df.MMYYYY = pd.to_datetime(df.MMYYYY, format='%m/%Y')
-    df['Hour'] = pd.to_datetime(df.date_unixtime, unit='s').dt.hour
-    df['Day'] = pd.to_datetime(df.date_unixtime, unit='s').dt.weekday
-    df.Day = df.Day.apply(day_of_week)
-    df.Day = df.Day.astype('category')
-    df.Day.cat.reorder_categories(days_of_week, ordered=True, inplace=True)
-    df.Date = df.Date.apply(lambda x: x.strftime('%Y-%m-%d'))
-    df['Message'] = df.text.apply(lambda x: str(x))
-    df = df[df['Message'].str.len() > 0]
+    seconds = pd.to_numeric(df.date_unixtime).values + 8 * 60 * 60  # For GMT+8
+    df['Timestamp'] = pd.to_datetime(seconds, unit='s')
+    df['Date'] = df.Timestamp.dt.normalize()
+    df['Time'] = df.Timestamp.dt.time
+    df['MMYYYY'] = df.Timestamp.values.astype('datetime64[M]')
+    df['Hour'] = df.Timestamp.dt.hour
+    df['Day'] = pd.Categorical.from_codes(df.Timestamp.dt.weekday, categories=days_of_week, ordered=True)
+    df['Message'] = df.text
+    df['Flags'] = classify_telegram(df)
+    # Ids, reply targets (-1 for none) and edit delays in seconds (-1 if never edited) as compact integer columns.
+    df['MessageId'] = pd.to_numeric(df['id']).values.astype('int64')
+    df['ReplyToId'] = pd.to_numeric(df.reply_to_message_id).fillna(-1).values.astype('int64')
+    df['EditDelay'] = (pd.to_numeric(df.edited_unixtime) - pd.to_numeric(df.date_unixtime)).fillna(-1).values.astype('int32')
+    df['Forwarded'] = df.forwarded_from.values
+    # Media without a caption and service messages have no text but are kept, flagged.
+    df = df[(df['Message'].str.len() > 0) | (df.Flags & (message_flags['media'] | message_flags['system']) > 0)]
     df['Emojis'] = df.Message.apply(extract_emojis)
-    df['User'] = df['from']
-    df = df[['Date', 'Time', 'MMYYYY', 'Hour', 'Day', 'User', 'Message', 'Emojis']]
+    df['User'] = df['from'].fillna(df['actor'])
+    df = df[['Timestamp', 'Date', 'Time', 'MMYYYY', 'Hour', 'Day', 'User', 'Message', 'Emojis', 'Flags', 'Mentions',
+             'Links', 'Hashtags', 'MessageId', 'ReplyToId', 'EditDelay', 'Forwarded']]
     print('Dataframe created and Telegram data parsed.')
     return df
 
 
-app = dash.Dash(
-    __name__,
-    external_stylesheets=[
-        "https://fonts.googleapis.com/css?family=Product+Sans:400,400i,700,700i",
-        "https://cdn.rawgit.com/plotly/dash-app-stylesheets/2cc54b8c03f4126569a3440aae611bbef1d7a5dd/stylesheet.css",
-        "https://codepen.io/bcd/pen/KQrXdb.css"
+def telegram_messages(stream, block_size=telegram_block_size):
+    # The objects of the export's "messages" array, decoded one at a time with raw_decode while the stream is read
+    # block by block, so the export is never held as one parsed object.
+    decoder = json.JSONDecoder()
+    separator = re.compile(r'[\s,]*')
+    buffer = ''
+    while True:
+        start = re.search(r'"messages"\s*:\s*\[', buffer)
+        if start:
+            break
+        block = stream.read(block_size)
+        if not block:
+            print("Error: 'messages' field not found in JSON data.")
+            return
+        buffer += block
+    position = start.end()
+    while True:
+        position = separator.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            message, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # An object cut by the end of the buffer; anything else is a broken export.
+            block = stream.read(block_size)
+            if not block:
+                raise
+            buffer, position = buffer[position:] + block, 0
+            continue
+        yield message
+
+
+def telegram_frame(messages):
+    # Only the columns parse_telegram reads, with text_entities joined into plain text (older exports have the same
+    # parts in a list-form text) and the mention, link and hashtag entities counted per message.
+    columns = {column: [message.get(column) for message in messages] for column in telegram_columns}
+    for column in telegram_media_columns + ['forwarded_from']:
+        columns[column] = [column in message for message in messages]
+    texts, entity_rows, entity_columns = [], [], []
+    for i, message in enumerate(messages):
+        entities = message.get('text_entities', message.get('text', ''))
+        if isinstance(entities, str):
+            entities = [entities]
+        texts.append(''.join(entity if isinstance(entity, str) else entity.get('text', '') for entity in entities))
+        for entity in entities:
+            if isinstance(entity, dict) and entity.get('type') in telegram_entity_columns:
+                entity_rows.append(i)
+                entity_columns.append(telegram_entity_columns[entity['type']])
+    columns['text'] = texts
+    entity_rows, entity_columns = np.array(entity_rows, dtype='int64'), np.array(entity_columns, dtype=object)
+    for name in set(telegram_entity_columns.values()):
+        columns[name] = np.bincount(entity_rows[entity_columns == name], minlength=len(messages)).astype('int16')
+    return pd.DataFrame(columns)
+
+
+def telegram_frames(stream, n_messages=None):
+    n_messages = n_messages or chunk_rows
+    messages = telegram_messages(stream)
+    while True:
+        block = list(itertools.islice(messages, n_messages))
+        if not block:
+            return
+        yield telegram_frame(block)
+
+
+def filter_dates(df, date_range):
+    days = epoch_days(df.Timestamp)
+    return df[(date_range[0] <= days) & (days <= date_range[1])]
+
+
+def delay_bins(delay, per_octave=delay_bins_per_octave):
+    # Log-spaced bins, per_octave per doubling: bin 0 holds 0 s, bin b >= 1 holds [2^((b-1)/k), 2^(b/k)).
+    scaled = np.floor(per_octave * np.log2(np.maximum(delay, 1))).astype('int64') + 1
+    return np.where(delay < 1, 0, scaled)
+
+
+def delay_bin_values(n_bins):
+    values = 2 ** ((np.arange(n_bins) - 0.5) / delay_bins_per_octave)
+    values[0] = 0
+    return values
+
+
+def histogram_medians(hist):
+    # Geometric midpoint of the bin holding the median, so within 2^(1/2k) - 1 (about 9%) of the exact value.
+    total = hist.sum(axis=-1)
+    below_half = hist.cumsum(axis=-1) < (total[..., None] + 1) // 2
+    index = np.minimum(below_half.sum(axis=-1), hist.shape[-1] - 1)
+    return np.where(total > 0, delay_bin_values(hist.shape[-1])[index], np.nan)
+
+
+def reply_analytics(df, selected_users):
+    # Turn-taking over everyone's time-sorted messages in one pass of shifted arrays: a reply is a message whose
+    # sender differs from the previous one, within max_reply_delay, and is attributed to its sender.
+    n_users = len(selected_users)
+    timestamps = df.Timestamp.values
+    speaker, names = pd.factorize(df.User.values)
+    if len(timestamps) > 1 and (timestamps[1:] < timestamps[:-1]).any():
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, speaker = timestamps[order], speaker[order]
+    seconds = timestamps.astype('datetime64[s]').astype('int64')
+    replier = user_codes(names, selected_users)[speaker] if len(names) else speaker
+
+    changed = speaker[1:] != speaker[:-1]
+    delay = seconds[1:] - seconds[:-1]
+    is_reply = changed & (delay <= max_reply_delay) & (replier[1:] >= 0)
+    replier, delay = replier[1:][is_reply], delay[is_reply]
+    codes = time_codes(timestamps[1:][is_reply])
+
+    n_bins = int(delay_bins(np.array([max_reply_delay]))[0]) + 1
+    bins = delay_bins(delay)
+    return {
+        'speaker_changes': int(changed.sum()),
+        'replier': replier,
+        'delay': delay,
+        'timestamp': timestamps[1:][is_reply],
+        'by_hour': count_by_user(replier, codes['hour'] * n_bins + bins, 24 * n_bins, n_users)
+        .reshape(n_users, 24, n_bins),
+        'by_weekday': count_by_user(replier, codes['weekday'] * n_bins + bins, 7 * n_bins, n_users)
+        .reshape(n_users, 7, n_bins)
+    }
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f'{seconds}s'
+    if seconds < 3600:
+        return f'{seconds // 60}m {seconds % 60}s'
+    return f'{seconds // 3600}h {seconds % 3600 // 60}m'
+
+
+def reply_stats(replies, i):
+    return reply_stats_lines(*np.unique(replies['delay'][replies['replier'] == i], return_counts=True))
+
+
+def reply_stats_lines(delays, counts):
+    n = int(counts.sum())
+    return reply_summary_lines(n, histogram_median(delays, counts) if n else 0, (delays * counts).sum() / n if n else 0)
+
+
+def reply_summary_lines(n, median, mean):
+    if n == 0:
+        return ['Replies: 0']
+    return [
+        f'Replies: {n}',
+        f'Median reply time: {format_duration(median)}',
+        f'Mean reply time: {format_duration(mean)}'
     ]
-)
 
-app.layout = html.Div([
-    html.Div([
-        html.Div(
-            children=[
-                html.Div(dcc.Upload(
-                    id='upload-data',
-                    children=html.Div([
-                        'Drag and Drop or ',
-                        html.A('Select File (.txt or .json)')
-                    ]),
-                    style={
-                        'width': '100%',
-                        'height': '40',
-                        'lineHeight': '60px',
-                        'borderWidth': '1px',
-                        'borderStyle': 'dashed',
-                        'borderRadius': '5px',
-                        'textAlign': 'center',
-                        'margin-bottom': '5px',
-                        'font-size': '14px'
-                    }
-                )),
-            ]
-        ),
-        html.Div(id='intermediate-values', style={'display': 'none'}),
-        html.Div(id='filter-selection', children=[
-            html.Div(
-                children=[dcc.Dropdown(
-                    id='start-date'
-                )],
-                style={'margin-bottom': '5px', 'font-size': '14px', 'display': 'none'}
-            ),
-            html.Div(
-                children=[dcc.Dropdown(
-                    id='end-date'
-                )],
-                style={'margin-bottom': '5px', 'font-size': '14px', 'display': 'none'}
-            ),
-            html.Div(
-                children=[dcc.Checklist(
-                    id='user-selection'
-                )],
-                style={'display': 'none'}
-            ),
-            html.Div(
-                children=[html.Button('Submit', id='submit-val', n_clicks=0)],
-                style={'display': 'none'}
-            ),
+
+def reply_figure(replies, selected_users):
+    fig = subplots.make_subplots(rows=1, cols=2, shared_yaxes=True, column_widths=[0.7, 0.3])
+    by_hour = histogram_medians(replies['by_hour']) / 60
+    by_weekday = histogram_medians(replies['by_weekday']) / 60
+    for i, user in enumerate(selected_users):
+        color = color_theme()[i % len(color_theme())]
+        fig.add_trace(go.Scatter(x=list(range(24)), y=by_hour[i], name=user, legendgroup=user, mode='lines+markers',
+                                 line_color=color), row=1, col=1)
+        fig.add_trace(go.Scatter(x=days_of_week, y=by_weekday[i], name=user, legendgroup=user, mode='lines+markers',
+                                 line_color=color, showlegend=False), row=1, col=2)
+    return fig.update_layout(title='Median reply time (minutes)', legend_title_text='User') \
+        .update_xaxes(title='Hour', row=1, col=1) \
+        .update_xaxes(title='Day', row=1, col=2)
+
+
+def session_index(df):
+    # Sessions split at gaps longer than session_gap, with one diff + cumsum over the time-sorted messages.
+    # Returns the per-message session id and a session table holding one row per session.
+    seconds = df.Timestamp.values.astype('datetime64[s]').astype('int64')
+    starts = np.ones(len(seconds), dtype=bool)
+    starts[1:] = np.diff(seconds) > session_gap
+    session_id = (np.cumsum(starts) - 1).astype('int32')
+    first = np.flatnonzero(starts)
+    last = np.append(first[1:], len(seconds)) - 1
+
+    user_code, users = pd.factorize(df.User.values, sort=True)
+    pairs = np.unique(session_id.astype('int64') * max(len(users), 1) + user_code)
+    sessions = pd.DataFrame({
+        'Start': df.Timestamp.values[first],
+        'End': df.Timestamp.values[last],
+        'Messages': (last - first + 1).astype('int32'),
+        'Participants': np.bincount(pairs // max(len(users), 1), minlength=len(first)).astype('int16'),
+        'Initiator': pd.Categorical.from_codes(user_code[first], categories=users)
+    })
+    return session_id, sessions
+
+
+def session_stats(sessions, user):
+    started = int((sessions.Initiator == user).sum())
+    share = 100 * started / len(sessions) if len(sessions) else 0
+    return [f'Conversations started: {started} ({share:.0f}%)']
+
+
+def session_figure(sessions, selected_users):
+    duration = (sessions.End.values - sessions.Start.values).astype('timedelta64[s]').astype('int64')
+    bins = delay_bins(duration, per_octave=1)
+    n_bins = int(bins.max()) + 1 if len(bins) else 1
+    labels = ['0s'] + [format_duration(2 ** (b - 1)) for b in range(1, n_bins)]
+    initiator = user_codes(sessions.Initiator, selected_users)
+    selected = initiator >= 0
+    counts = count_by_user(initiator[selected], bins[selected], n_bins, len(selected_users)) \
+        if len(bins) else np.zeros((len(selected_users), 1), dtype='int64')
+    return stacked_bars(labels, counts, selected_users).update_layout(
+        title=f'Session length ({len(sessions)} sessions, median {int(sessions.Messages.median()) if len(sessions) else 0} messages)',
+        bargap=0.1, xaxis={'title': 'Duration (at least)', 'type': 'category'}, legend_title_text='Initiator')
+
+
+def reply_parents(message_id, reply_to_id):
+    # Row of the message each row replies to, or -1 when it replies to nothing or to a message that is not kept.
+    order = np.argsort(message_id, kind='stable')
+    ids = np.append(message_id[order], -1)
+    position = np.searchsorted(ids[:-1], reply_to_id)
+    found = (reply_to_id >= 0) & (ids[position] == reply_to_id)
+    return np.where(found, np.append(order, -1)[position], -1).astype('int32')
+
+
+def reply_index(parent):
+    # CSR adjacency of the reply graph: the replies to row i are children[offsets[i]:offsets[i + 1]], in row order.
+    replies = np.flatnonzero(parent >= 0)
+    children = replies[np.argsort(parent[replies], kind='stable')].astype('int32')
+    offsets = np.zeros(len(parent) + 1, dtype='int64')
+    offsets[1:] = np.cumsum(np.bincount(parent[replies], minlength=len(parent)))
+    return offsets, children
+
+
+def thread_depths(offsets, children):
+    # Depth of every message in its reply thread, breadth-first from the messages that reply to nothing: one
+    # vectorised step per level, so O(n) overall.
+    depth = np.zeros(len(offsets) - 1, dtype='int16')
+    is_reply = np.zeros(len(depth), dtype=bool)
+    is_reply[children] = True
+    frontier, level = np.flatnonzero(~is_reply), 0
+    while len(frontier) and level < len(depth):
+        counts = offsets[frontier + 1] - offsets[frontier]
+        first = np.repeat(offsets[frontier] - np.cumsum(counts) + counts, counts)
+        frontier, level = children[first + np.arange(counts.sum())], level + 1
+        depth[frontier] = level
+    return depth
+
+
+def add_thread_columns(df):
+    # ReplyTo (row of the parent) and Depth for exports that carry message ids; df must already be in its final order.
+    df['ReplyTo'] = reply_parents(df.MessageId.values, df.ReplyToId.values)
+    df['Depth'] = thread_depths(*reply_index(df.ReplyTo.values))
+    return df.drop(columns='ReplyToId')
+
+
+def thread_stats_lines(delays, counts, received, forwarded):
+    n = int(counts.sum())
+    lines = [f'Replies received: {int(received)}', f'Forwarded messages: {int(forwarded)}', f'Edited messages: {n}']
+    if n:
+        lines.append(f'Median edit delay: {format_duration(histogram_median(delays, counts))}')
+    return lines
+
+
+def thread_figure(matrix, depth, selected_users):
+    return go.Figure(data=[go.Heatmap(x=selected_users, y=selected_users, z=matrix)]).update_layout(
+        title=f'Who replies to whom ({int(matrix.sum())} replies, deepest thread {depth})',
+        xaxis={'title': 'Replied to', 'type': 'category'}, yaxis={'title': 'Replier', 'type': 'category'})
+
+
+def thread_summary(tables, selected, df, selected_users):
+    # Thread stats and figure for the selected messages df (selected is the same selection as a row mask), from the
+    # precomputed ReplyTo, Depth and reply index. The matrix counts the selected replies to any message of a
+    # selected user; replies received only count selected replies to selected messages.
+    messages = tables['messages']
+    offsets, children = tables['reply_offsets'].Offset.values, tables['reply_children'].Row.values
+    n_users = len(selected_users)
+    user = user_codes(df.User, selected_users)
+    parent = df.ReplyTo.values
+    parent_user = np.full(len(df), -1, dtype='int64')
+    parent_user[parent >= 0] = user_codes(messages.User.values[parent[parent >= 0]], selected_users)
+    replied = parent_user >= 0
+    matrix = count_by_user(user[replied], parent_user[replied], n_users, n_users)
+    selected_children = np.append(0, np.cumsum(selected[children]))
+    rows = df.index.values
+    received = np.bincount(user, weights=selected_children[offsets[rows + 1]] - selected_children[offsets[rows]],
+                           minlength=n_users)
+    forwarded = np.bincount(user, weights=df.Forwarded.values, minlength=n_users)
+    edited = df.EditDelay.values >= 0
+    stats = [thread_stats_lines(*np.unique(df.EditDelay.values[edited & (user == i)], return_counts=True), received[i],
+                                forwarded[i]) for i in range(n_users)]
+    return stats, thread_figure(matrix, int(df.Depth.max()) if len(df) else 0, selected_users)
+
+
+def histogram_median(values, counts):
+    # Same result as np.median over the values each repeated counts times; values must be sorted.
+    total = int(counts.sum())
+    cumulative = np.cumsum(counts)
+    low = values[np.searchsorted(cumulative, (total - 1) // 2, side='right')]
+    high = values[np.searchsorted(cumulative, total // 2, side='right')]
+    return (low + high) / 2
+
+
+def sketch_buckets(words):
+    words = np.asarray(words, dtype='int64')
+    above = sketch_exact + np.floor(sketch_per_octave * np.log2(np.maximum(words, sketch_exact) / sketch_exact))
+    return np.where(words < sketch_exact, words, above.astype('int64'))
+
+
+def sketch_values(buckets):
+    # The value a bucket stands for: itself below sketch_exact, the geometric midpoint of the bucket above it.
+    buckets = np.asarray(buckets, dtype='int64')
+    return np.where(buckets < sketch_exact, buckets,
+                    sketch_exact * 2 ** ((buckets - sketch_exact + 0.5) / sketch_per_octave))
+
+
+def sketch_quantile(buckets, counts, q):
+    # Interpolates between the two nearest ranks like np.quantile; buckets must be sorted.
+    position = (int(counts.sum()) - 1) * q
+    cumulative = np.cumsum(counts)
+    low = sketch_values(buckets[np.searchsorted(cumulative, math.floor(position), side='right')])
+    high = sketch_values(buckets[np.searchsorted(cumulative, math.ceil(position), side='right')])
+    return low + (high - low) * (position - math.floor(position))
+
+
+def length_columns(user, flags, day, words):
+    words = np.asarray(words, dtype='int64')
+    return {
+        'lengths': {'User': user, 'Flags': flags, 'Day': day, 'Sum': words, 'SumSquares': words * words, 'Max': words},
+        'length_sketch': {'User': user, 'Flags': flags, 'Day': day, 'Bucket': sketch_buckets(words)}
+    }
+
+
+def length_tables(df):
+    # Words-per-message summaries per (user, flags, day): count, sum, sum of squares and max, plus the quantile
+    # sketch. Both merge by addition (and max), so the stats of any selection of users, categories and days come
+    # from these tables alone, and chunked ingest keeps them current chunk by chunk.
+    columns = length_columns(df.User.values, df.Flags.values, epoch_days(df.Timestamp), df.Words.values)
+    return {name: partial_aggregate(name, table) for name, table in columns.items()}
+
+
+def length_stats(tables, date_range, selected_users, hidden_flags=0):
+    # One merged summary and sketch per selected user; the work depends on the number of groups, not of messages.
+    def select(name):
+        table = tables[name]
+        user = user_codes(table.User, selected_users)
+        keep = (user >= 0) & ((table.Flags.values & hidden_flags) == 0) & \
+            (date_range[0] <= table.Day.values) & (table.Day.values <= date_range[1])
+        return table[keep].assign(User=user[keep])
+
+    lengths = select('lengths').groupby('User').agg(aggregate_how('lengths'))
+    sketch = select('length_sketch').groupby(['User', 'Bucket']).Count.sum()
+    stats = []
+    for i in range(len(selected_users)):
+        if i in lengths.index:
+            stats.append((lengths.loc[i].to_dict(), sketch.loc[i].index.values, sketch.loc[i].values))
+        else:
+            stats.append(histogram_lengths(np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')))
+    return stats
+
+
+def histogram_lengths(words, counts):
+    # The same summary and sketch from an exact words-per-message histogram.
+    buckets, inverse = np.unique(sketch_buckets(words), return_inverse=True)
+    lengths = {'Count': int(counts.sum()), 'Sum': int((words * counts).sum()),
+               'SumSquares': int((words * words * counts).sum()), 'Max': int(words.max()) if len(words) else 0}
+    return lengths, buckets, np.bincount(inverse, weights=counts, minlength=len(buckets)).astype('int64')
+
+
+def user_emojis(df, user):
+    return Counter(x for y in df.Emojis[df.User == user] for x in y)
+
+
+def user_stats_lines(user, lengths, buckets, counts, emoji_counts):
+    # From the words-per-message summary, exactly as the statistics module would compute the count, mean, standard
+    # deviation and max from every message; the median and 90th percentile come from the sketch.
+    n = int(lengths['Count'])
+    if not n:
+        return [f'User: {user}', 'Messages sent: 0']
+    total, squares = int(lengths['Sum']), int(lengths['SumSquares'])
+    mean_words = Fraction(total, n)
+    return [
+        f'User: {user}',
+        f'Messages sent: {n}',
+        f'Mean words per message: {mean_words.numerator if mean_words.denominator == 1 else float(mean_words)}',
+        f'Median words per message: {int(sketch_quantile(buckets, counts, 0.5))}',
+        f'90th percentile words per message: {int(sketch_quantile(buckets, counts, 0.9))}',
+        f'Standard deviation: {math.sqrt(Fraction(n * squares - total * total, n * (n - 1))) if n > 1 else 0}',
+        f'Max message length: {int(lengths["Max"])}',
+        f'Most used emojis: {" ".join(k for k, v in sorted(emoji_counts.items(), key=lambda item: item[1], reverse=True)[:5])}'
+    ]
+
+
+def stats_card(lines):
+    return html.Div([html.P(
+        [part for line in lines for part in (line, html.Br())][:-1],
+        style={'font-size': '14px', 'backgroundColor': 'white', 'padding': '10px'})],
+        style={'display': 'inline-block', 'margin-right': '10px'})
+
+
+def graph_panel(figure):
+    return html.Div([dcc.Graph(figure=figure)], style={'width': '50%', 'display': 'inline-block', 'margin-bottom': '10px'})
+
+
+def fingerprint(value):
+    # Short digest of a stats card or a part of a figure; the page keeps these instead of what it shows.
+    text = json.dumps(value, sort_keys=True, default=lambda obj: obj.tolist() if hasattr(obj, 'tolist') else str(obj))
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def trace_keys(traces):
+    # Traces are matched across updates by type and name, numbered when several share both.
+    seen = Counter()
+    keys = []
+    for trace in traces:
+        key = f"{trace.get('type', '')}:{trace.get('name', '')}"
+        keys.append(f'{key}:{seen[key]}')
+        seen[key] += 1
+    return keys
+
+
+def stats_state(dataset, selected_users, stats):
+    # Fingerprints of the stats cards update_stats put on the page, kept in the stats-state store.
+    return {'dataset': dataset, 'users': list(selected_users), 'stats': [fingerprint(lines) for lines in stats]}
+
+
+def graphs_state(dataset, figures):
+    # The same for the figures of update_graphs and update_words, kept in graphs-state and words-state.
+    return {
+        'dataset': dataset,
+        'figures': [{
+            'layout': fingerprint(figure.get('layout', {})),
+            'traces': trace_keys(figure['data']),
+            'props': [{prop: fingerprint(value) for prop, value in trace.items()} for trace in figure['data']]
+        } for figure in figures]
+    }
+
+
+def stats_updates(previous, state, stats):
+    # The stats output: dash.no_update when no card changed and, on Dash versions with partial property updates, a
+    # Patch of only the cards that did. Anything that cannot be matched up against what the page shows is sent in
+    # full.
+    stats_output = [stats_card(lines) for lines in stats]
+    if previous is None or previous['dataset'] != state['dataset']:
+        return stats_output
+    if previous['users'] == state['users'] and previous['stats'] == state['stats']:
+        return dash.no_update
+    if hasattr(dash, 'Patch'):
+        patch = dash.Patch()
+        if patch_list(patch, previous['users'], state['users'], stats_output):
+            old_stats = dict(zip(previous['users'], previous['stats']))
+            for i, (user, lines) in enumerate(zip(state['users'], state['stats'])):
+                if user in old_stats and old_stats[user] != lines:
+                    patch[i] = stats_output[i]
+            return patch
+    return stats_output
+
+
+def graphs_updates(previous, state, figures):
+    # The graphs output, likewise down to the traces and properties that changed.
+    graphs_output = [graph_panel(figure) for figure in figures]
+    if previous is None or previous['dataset'] != state['dataset']:
+        return graphs_output
+    if previous['figures'] == state['figures']:
+        return dash.no_update
+    if hasattr(dash, 'Patch') and len(previous['figures']) == len(state['figures']):
+        patch = dash.Patch()
+        for i, (old, new) in enumerate(zip(previous['figures'], state['figures'])):
+            if old != new and not patch_figure(patch[i]['props']['children'][0]['props']['figure'], old, new,
+                                               figures[i]):
+                patch[i] = graphs_output[i]
+        return patch
+    return graphs_output
+
+
+def patch_list(patch, old_keys, new_keys, new_items):
+    # Deletes and inserts items so a list shown as old_keys becomes new_keys. Only possible when the keys in both
+    # keep their order; returns whether it was.
+    if len(set(new_keys)) != len(new_keys) or \
+            [key for key in old_keys if key in new_keys] != [key for key in new_keys if key in old_keys]:
+        return False
+    for i in reversed(range(len(old_keys))):
+        if old_keys[i] not in new_keys:
+            del patch[i]
+    for i, key in enumerate(new_keys):
+        if key not in old_keys:
+            patch.insert(i, new_items[i])
+    return True
+
+
+def patch_figure(patch, old, new, figure):
+    # Assigns only the layout and the trace properties whose fingerprints changed, and adds or removes whole
+    # traces (a user toggled); False when the traces cannot be matched up.
+    data = patch['data']
+    if not patch_list(data, old['traces'], new['traces'], figure['data']):
+        return False
+    if old['layout'] != new['layout']:
+        patch['layout'] = figure.get('layout', {})
+    old_props = dict(zip(old['traces'], old['props']))
+    for i, (key, props) in enumerate(zip(new['traces'], new['props'])):
+        if key not in old_props:
+            continue
+        for prop, value in props.items():
+            if old_props[key].get(prop) != value:
+                data[i][prop] = figure['data'][i][prop]
+        for prop in old_props[key]:
+            if prop not in props:
+                del data[i][prop]
+    return True
+
+
+def count_figures(weekday_hour, selected_users):
+    return [count_figure(weekday_hour, selected_users, i) for i in range(len(count_graph_ids))]
+
+
+def count_figure(weekday_hour, selected_users, i):
+    # The hour, weekday and heatmap charts, in that order. Mirrored by assets/clientside.js; keep the two in step.
+    if i == 0:
+        return stacked_bars(list(range(24)), weekday_hour.sum(axis=1), selected_users) \
+            .update_layout(xaxis={'title': 'Hour', 'categoryorder': 'array', 'categoryarray': list(range(24))})
+    if i == 1:
+        return stacked_bars(days_of_week, weekday_hour.sum(axis=2), selected_users) \
+            .update_layout(bargap=0.1, xaxis={'title': 'Day', 'categoryorder': 'array', 'categoryarray': days_of_week})
+    return go.Figure(data=[
+        go.Heatmap(
+            x=list(range(24)),
+            y=days_of_week,
+            z=weekday_hour.sum(axis=0)
+        )
+    ])
+
+
+def domain_figure(domains, user_code, counts, selected_users):
+    # The domains_shown most shared domains of the selection, from (domain, user, count) rows.
+    names, domain_code = np.unique(np.asarray(domains, dtype=object).astype(str), return_inverse=True)
+    matrix = count_by_user(np.asarray(user_code, dtype='int64'), domain_code, len(names), len(selected_users),
+                           np.asarray(counts, dtype='int64'))
+    top = np.argsort(-matrix.sum(axis=0), kind='stable')[:domains_shown]
+    return stacked_bars(names[top].tolist(), matrix[:, top], selected_users).update_layout(
+        title='Most shared domains', xaxis={'title': 'Domain', 'type': 'category'})
+
+
+def term_counts(offsets, terms, counts, message_user, n_users, n_terms):
+    # users x terms counts of the messages with a user code (-1 leaves a message out): the codes are spread over
+    # the CSR entries between the first and the last selected message, then one bincount sums the columns.
+    rows = np.flatnonzero(message_user >= 0)
+    if not len(rows):
+        return np.zeros((n_users, n_terms), dtype='int64')
+    first, last = rows[0], rows[-1] + 1
+    start, end = offsets[first], offsets[last]
+    entry_user = np.repeat(message_user[first:last], np.diff(offsets[first:last + 1]))
+    keep = entry_user >= 0
+    return count_by_user(entry_user[keep], terms[start:end][keep], n_terms, n_users, counts[start:end][keep])
+
+
+def word_ranges(date_range):
+    # Whole months inside date_range, as [first, end) epoch months, and the day ranges left over at either end.
+    start, end = int(date_range[0]), int(date_range[1])
+    first = int(np.datetime64(start - 1, 'D').astype('datetime64[M]').astype('int64')) + 1
+    last = int(np.datetime64(end + 1, 'D').astype('datetime64[M]').astype('int64'))
+    if first >= last:
+        return first, first, [[start, end]]
+    first_day, last_day = (int(np.datetime64(month, 'M').astype('datetime64[D]').astype('int64'))
+                           for month in (first, last))
+    return first, last, [days for days in [[start, first_day - 1], [last_day, end]] if days[0] <= days[1]]
+
+
+def word_counts(tables, date_range, selected_users, hidden_flags):
+    # users x terms counts for the filters: the monthly blocks for the whole months, then the messages of the days
+    # at either end, found by binary search since messages are in time order.
+    messages, n_users, n_terms = tables['messages'], len(selected_users), len(tables['vocabulary'])
+    first, last, edges = word_ranges(date_range)
+    blocks, block_entries = tables['word_blocks'], tables['word_block_entries']
+    months = blocks.Month.values
+    block_user = np.where((first <= months) & (months < last) & ((blocks.Flags.values & hidden_flags) == 0),
+                          user_codes(blocks.User.values, selected_users), -1)
+    matrix = term_counts(np.append(blocks.Offset.values, len(block_entries)), block_entries.Term.values,
+                         block_entries.Count.values, block_user, n_users, n_terms)
+    offsets, entries = tables['word_offsets'].Offset.values, tables['word_entries']
+    timestamps = messages.Timestamp.values
+    for start_day, end_day in edges:
+        start, end = timestamps.searchsorted(np.array([start_day, end_day + 1], dtype='datetime64[D]')
+                                             .astype(timestamps.dtype))
+        message_user = np.where((messages.Flags.values[start:end] & hidden_flags) == 0,
+                                user_codes(messages.User.values[start:end], selected_users), -1)
+        matrix += term_counts(offsets[start:end + 1], entries.Term.values, entries.Count.values, message_user,
+                              n_users, n_terms)
+    return matrix
+
+
+def word_figures(matrix, terms, n_words, selected_users):
+    # The words_shown most used words and word pairs of the selection, from its users x terms counts, and a word
+    # cloud of both when the wordcloud package is installed.
+    totals = matrix.sum(axis=0)
+    figures = []
+    for words, title in [(1, 'Most used words'), (2, 'Most used word pairs')]:
+        candidates = np.flatnonzero((n_words == words) & (totals > 0))
+        if len(candidates) > words_shown:
+            candidates = candidates[np.argpartition(-totals[candidates], words_shown)[:words_shown]]
+        top = candidates[np.lexsort((candidates, -totals[candidates]))]
+        figures.append(stacked_bars(terms[top].tolist(), matrix[:, top], selected_users).update_layout(
+            title=title, xaxis={'title': 'Words' if words > 1 else 'Word', 'type': 'category'}))
+    if wordcloud_installed:
+        figures.append(word_cloud_figure(terms, totals))
+    return figures
+
+
+def word_cloud_figure(terms, totals):
+    # The notebook's word cloud, as an image laid out in a figure like the other panels. Seeded, so the same
+    # selection always gives the same image.
+    top = np.argsort(-totals, kind='stable')[:word_cloud_terms]
+    top = top[totals[top] > 0]
+    figure = go.Figure().update_layout(title='Word cloud', xaxis={'visible': False}, yaxis={'visible': False},
+                                       plot_bgcolor='white')
+    if not len(top):
+        return figure
+    image = wordcloud.WordCloud(width=800, height=400, background_color='white', random_state=0) \
+        .generate_from_frequencies(dict(zip(terms[top].tolist(), totals[top].tolist()))).to_image()
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    source = 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    return figure.add_layout_image(source=source, xref='paper', yref='paper', x=0, y=1, sizex=1, sizey=1,
+                                   sizing='contain')
+
+
+def build_dashboard(tables, date_range, selected_users, hidden_flags=0, panels=dashboard_panels):
+    # Stats lines and figures for the current filters, shared by the dashboard callbacks and the report export.
+    # Only the panels asked for are computed: the stats lines are empty without 'stats', and the figures are the
+    # graphs ('graphs') and the word figures ('words'). The timeline and the count figures are drawn separately,
+    # from the time pyramid. Sessions never include system lines and are not affected by the hidden
+    # categories.
+    words = []
+    if 'words' in panels and 'word_offsets' in tables:
+        vocabulary = tables['vocabulary']
+        words = word_figures(word_counts(tables, date_range, selected_users, hidden_flags), vocabulary.Term.values,
+                             vocabulary.Words.values, selected_users)
+    if not set(panels) - {'words'}:
+        # The words panel only reads its index, so the messages are not filtered for it.
+        return [], words
+    df = filter_dates(tables['messages'], date_range)
+    df = df[(df.Flags.values & hidden_flags) == 0]
+    replies = reply_analytics(df, selected_users) if 'stats' in panels or 'graphs' in panels else None
+    df = df[df.User.isin(selected_users)]
+    sessions = tables['sessions']
+    start_days = epoch_days(sessions.Start)
+    sessions = sessions[(date_range[0] <= start_days) & (start_days <= date_range[1])]
+    stats, figures = [], []
+    if 'stats' in panels:
+        lengths = length_stats(tables, date_range, selected_users, hidden_flags)
+        stats = [user_stats_lines(user, *lengths[i], user_emojis(df, user)) + reply_stats(replies, i) +
+                 session_stats(sessions, user)
+                 for i, user in enumerate(selected_users)]
+    messages = tables['messages']
+    selected = np.zeros(len(messages), dtype=bool)
+    selected[df.index.values] = True
+    if 'graphs' in panels:
+        links = tables['links']
+        links = links[selected[links.Row.values]]
+        figures += [
+            reply_figure(replies, selected_users),
+            session_figure(sessions, selected_users),
+            domain_figure(links.Domain.values, user_codes(messages.User.values[links.Row.values], selected_users),
+                          np.ones(len(links), dtype='int64'), selected_users)
+        ]
+    if 'reply_offsets' in tables and ('stats' in panels or 'graphs' in panels):
+        thread_stats, thread_fig = thread_summary(tables, selected, df, selected_users)
+        if 'stats' in panels:
+            stats = [lines + thread_lines for lines, thread_lines in zip(stats, thread_stats)]
+        if 'graphs' in panels:
+            figures.append(thread_fig)
+    return stats, figures + words
+
+
+def write_sqlite(df, sessions):
+    # One database file per upload, with the messages in time order; only its name travels through the page.
+    # Indexes are built after the bulk insert, which is several times faster than keeping them up to date.
+    os.makedirs(storage_dir, exist_ok=True)
+    # A random name, like the registry's keys: the reference is the only thing a page needs to read the chat.
+    filename = f'chat_{os.urandom(16).hex()}.sqlite'
+    users = sorted(df.User.unique())
+    codes = time_codes(df.Timestamp)
+    columns = [df.Timestamp.values.astype('datetime64[s]').astype('int64'), codes['hour'], codes['weekday'],
+               user_codes(df.User, users), df.Words.values, df.Flags.values, df.Session.values, df.Emojis.values,
+               df.Message.values]
+    if 'ReplyTo' in df:
+        # Parents by rowid (row + 1), NULL for messages that reply to nothing.
+        reply_to = np.where(df.ReplyTo.values >= 0, df.ReplyTo.values + 1, None)
+        columns += [reply_to, df.Depth.values, df.EditDelay.values, df.Forwarded.values.astype('int8')]
+    else:
+        columns += [np.full(len(df), None, dtype=object)] * 4
+    links = link_table(df)
+    words = word_tables(df)
+    offsets = words['word_offsets'].Offset.values
+    term_columns = [np.repeat(np.arange(1, len(df) + 1), np.diff(offsets)), words['word_entries'].Term.values,
+                    words['word_entries'].Count.values]
+    blocks, block_entries = words['word_blocks'], words['word_block_entries']
+    block_sizes = np.diff(np.append(blocks.Offset.values, len(block_entries)))
+    month_term_columns = [np.repeat(column, block_sizes) for column in
+                          (blocks.Month.values, blocks.User.cat.codes.values, blocks.Flags.values)]
+    month_term_columns += [block_entries.Term.values, block_entries.Count.values]
+    session_columns = [sessions.Start.values.astype('datetime64[s]').astype('int64'),
+                       sessions.End.values.astype('datetime64[s]').astype('int64'), sessions.Messages.values,
+                       sessions.Participants.values, user_codes(sessions.Initiator, users)]
+    with closing(sqlite3.connect(os.path.join(storage_dir, filename))) as db:
+        db.executescript(sqlite_schema)
+        db.executemany('INSERT INTO users VALUES (?, ?)', enumerate(users))
+        for start in range(0, len(df), sqlite_insert_rows):
+            db.executemany('INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           zip(*(column[start:start + sqlite_insert_rows].tolist() for column in columns)))
+        db.executemany('INSERT INTO sessions VALUES (?, ?, ?, ?, ?)', zip(*(column.tolist() for column in session_columns)))
+        db.executemany('INSERT INTO domains VALUES (?, ?)', enumerate(links.Domain.cat.categories))
+        db.executemany('INSERT INTO links VALUES (?, ?)',
+                       zip((links.Row.values + 1).tolist(), links.Domain.cat.codes.values.tolist()))
+        vocabulary = words['vocabulary']
+        db.executemany('INSERT INTO terms VALUES (?, ?, ?)',
+                       zip(itertools.count(), vocabulary.Term.values, vocabulary.Words.values.tolist()))
+        for start in range(0, len(term_columns[0]), sqlite_insert_rows):
+            db.executemany('INSERT INTO message_terms VALUES (?, ?, ?)',
+                           zip(*(column[start:start + sqlite_insert_rows].tolist() for column in term_columns)))
+        for start in range(0, len(block_entries), sqlite_insert_rows):
+            db.executemany('INSERT INTO month_terms VALUES (?, ?, ?, ?, ?)',
+                           zip(*(column[start:start + sqlite_insert_rows].tolist() for column in month_term_columns)))
+        db.executescript(sqlite_indexes)
+        db.commit()
+    return sqlite_prefix + filename
+
+
+def sqlite_path(reference):
+    return os.path.join(storage_dir, os.path.basename(reference[len(sqlite_prefix):]))
+
+
+def sqlite_filter(db, date_range, hidden_flags, user_ids=None):
+    # WHERE clause and parameters for the date, category and (optionally) user filters. Messages are stored in
+    # time order, so the date range is also a rowid range, found with two lookups on the ts index: wide ranges are
+    # read sequentially instead of row by row through an index, and the planner can still take the (user, ts)
+    # index when a few users are selected.
+    start, end = int(date_range[0]) * 86400, (int(date_range[1]) + 1) * 86400
+    first = db.execute('SELECT rowid FROM messages WHERE ts >= ? ORDER BY ts LIMIT 1', [start]).fetchone()
+    last = db.execute('SELECT rowid FROM messages WHERE ts < ? ORDER BY ts DESC LIMIT 1', [end]).fetchone()
+    where = 'rowid BETWEEN ? AND ? AND ts >= ? AND ts < ? AND flags & ? = 0'
+    params = [first[0] if first else 0, last[0] if last else -1, start, end, hidden_flags]
+    if user_ids is not None:
+        where += f' AND user IN ({", ".join("?" * len(user_ids))})'
+        params += user_ids
+    return where, params
+
+
+def sqlite_replies(db, date_range, hidden_flags, index, n_users):
+    # reply_analytics in SQL: LAG over the time-ordered rows finds speaker changes, and a lookup table gives the same delay
+    # bins as delay_bins(). Only histograms come back, so memory does not grow with the chat.
+    where, params = sqlite_filter(db, date_range, hidden_flags)
+    n_bins = int(delay_bins(np.array([max_reply_delay]))[0]) + 1
+    db.execute('CREATE TEMP TABLE delay_bins (delay INTEGER PRIMARY KEY, bin INTEGER NOT NULL)')
+    db.executemany('INSERT INTO delay_bins VALUES (?, ?)',
+                   enumerate(delay_bins(np.arange(max_reply_delay + 1)).tolist()))
+    db.execute(f"""CREATE TEMP TABLE replies AS
+                   SELECT user, hour, weekday, delay FROM (
+                       SELECT user, hour, weekday, LAG(user) OVER w AS previous_user, ts - LAG(ts) OVER w AS delay
+                       FROM messages WHERE {where} WINDOW w AS (ORDER BY rowid))
+                   WHERE previous_user != user""", params)
+    replies = {
+        'speaker_changes': db.execute('SELECT COUNT(*) FROM replies').fetchone()[0],
+        'delays': [{} for _ in range(n_users)]
+    }
+    selected = f'delay <= {max_reply_delay} AND user IN ({", ".join(str(user) for user in index)})'
+    for user, delay, count in db.execute(f'SELECT user, delay, COUNT(*) FROM replies WHERE {selected} '
+                                         'GROUP BY user, delay'):
+        replies['delays'][index[user]][delay] = count
+    by_weekday_hour = np.zeros((n_users, 7, 24, n_bins), dtype='int64')
+    for user, weekday, hour, delay_bin, count in db.execute(
+            f'SELECT user, weekday, hour, bin, COUNT(*) FROM replies JOIN delay_bins USING (delay) WHERE {selected} '
+            'GROUP BY user, weekday, hour, bin'):
+        by_weekday_hour[index[user], weekday, hour, delay_bin] = count
+    replies['by_hour'], replies['by_weekday'] = by_weekday_hour.sum(axis=1), by_weekday_hour.sum(axis=2)
+    return replies
+
+
+def sqlite_threads(db, where, params, index, n_users):
+    # thread_summary in SQL, through the index on reply_to; None for chats without reply data.
+    if db.execute('SELECT NOT EXISTS (SELECT 1 FROM messages WHERE depth IS NOT NULL)').fetchone()[0]:
+        return None
+    users = ', '.join(str(user) for user in index)
+    threads = {
+        'matrix': np.zeros((n_users, n_users), dtype='int64'),
+        'received': np.zeros(n_users, dtype='int64'),
+        'forwarded': np.zeros(n_users, dtype='int64'),
+        'edit_delays': [{} for _ in range(n_users)],
+        'depth': db.execute(f'SELECT COALESCE(MAX(depth), 0) FROM messages WHERE {where}', params).fetchone()[0]
+    }
+    for user, parent_user, count in db.execute(
+            f'SELECT replies.user, parents.user, COUNT(*) FROM (SELECT user, reply_to FROM messages '
+            f'WHERE {where} AND reply_to IS NOT NULL) AS replies JOIN messages AS parents '
+            f'ON parents.rowid = replies.reply_to WHERE parents.user IN ({users}) GROUP BY replies.user, parents.user',
+            params):
+        threads['matrix'][index[user], index[parent_user]] = count
+    for user, count in db.execute(
+            f'SELECT parents.user, COUNT(*) FROM (SELECT reply_to FROM messages WHERE {where} AND reply_to IS NOT NULL) '
+            f'AS replies JOIN (SELECT rowid AS id, user FROM messages WHERE {where}) AS parents '
+            'ON parents.id = replies.reply_to GROUP BY parents.user', params + params):
+        threads['received'][index[user]] = count
+    for user, count in db.execute(f'SELECT user, SUM(forwarded) FROM messages WHERE {where} GROUP BY user', params):
+        threads['forwarded'][index[user]] = count
+    for user, delay, count in db.execute(f'SELECT user, edit_delay, COUNT(*) FROM messages '
+                                         f'WHERE {where} AND edit_delay >= 0 GROUP BY user, edit_delay', params):
+        threads['edit_delays'][index[user]][delay] = count
+    return threads
+
+
+def sqlite_sessions(db, date_range):
+    rows = db.execute('SELECT started, ended, messages, participants, initiator FROM sessions '
+                      'WHERE started >= ? AND started < ? ORDER BY started',
+                      [int(date_range[0]) * 86400, (int(date_range[1]) + 1) * 86400]).fetchall()
+    started, ended, messages, participants, initiator = (np.array(column, dtype='int64').reshape(-1)
+                                                         for column in (zip(*rows) if rows else [[]] * 5))
+    users = [name for _, name in db.execute('SELECT id, name FROM users ORDER BY id')]
+    return pd.DataFrame({
+        'Start': started.astype('datetime64[s]').astype('datetime64[ns]'),
+        'End': ended.astype('datetime64[s]').astype('datetime64[ns]'),
+        'Messages': messages.astype('int32'),
+        'Participants': participants.astype('int16'),
+        'Initiator': pd.Categorical.from_codes(initiator, categories=users)
+    })
+
+
+def build_dashboard_sql(path, date_range, selected_users, hidden_flags=0, panels=dashboard_panels):
+    # build_dashboard over the SQLite backend, with the same stats and figures. Every aggregate is an indexed
+    # GROUP BY whose result depends on the number of users and bins, not on the number of messages.
+    n_users = len(selected_users)
+    threads = replies = sessions = None
+    with closing(sqlite3.connect(path)) as db:
+        ids = dict((name, user) for user, name in db.execute('SELECT id, name FROM users'))
+        index = {ids[user]: i for i, user in enumerate(selected_users) if user in ids}
+        where, params = sqlite_filter(db, date_range, hidden_flags, list(index))
+
+        words = [{} for _ in range(n_users)]
+        emoji_counts = [Counter() for _ in range(n_users)]
+        if 'stats' in panels:
+            for user, word_count, count in db.execute(
+                    f'SELECT user, words, COUNT(*) FROM messages WHERE {where} GROUP BY user, words', params):
+                words[index[user]][word_count] = count
+            for user, emojis in db.execute(f"SELECT user, emojis FROM messages WHERE {where} AND emojis != '' "
+                                           'ORDER BY user, ts, rowid', params):
+                emoji_counts[index[user]].update(emojis)
+        domains = []
+        if 'graphs' in panels:
+            domains = db.execute(f'SELECT user, name, COUNT(*) FROM links JOIN domains ON domains.id = links.domain '
+                                 f'JOIN (SELECT rowid AS message, user FROM messages WHERE {where}) USING (message) '
+                                 'GROUP BY user, links.domain', params).fetchall()
+        if 'words' in panels:
+            vocabulary = db.execute('SELECT term, words FROM terms ORDER BY id').fetchall()
+            # Whole months from month_terms, the days at either end from message_terms, as in word_counts.
+            first, last, edges = word_ranges(date_range)
+            term_rows = db.execute(f'SELECT user, term, SUM(count) FROM month_terms WHERE month >= ? AND month < ? '
+                                   f'AND flags & ? = 0 AND user IN ({", ".join("?" * len(index))}) GROUP BY user, term',
+                                   [first, last, hidden_flags] + list(index)).fetchall()
+            for days in edges:
+                edge_where, edge_params = sqlite_filter(db, days, hidden_flags, list(index))
+                term_rows += db.execute(f'SELECT user, term, SUM(count) FROM message_terms JOIN (SELECT rowid AS '
+                                        f'message, user FROM messages WHERE {edge_where}) USING (message) '
+                                        'GROUP BY user, term', edge_params).fetchall()
+        if 'stats' in panels or 'graphs' in panels:
+            threads = sqlite_threads(db, where, params, index, n_users)
+            replies = sqlite_replies(db, date_range, hidden_flags, index, n_users)
+            sessions = sqlite_sessions(db, date_range)
+
+    def histogram(counts):
+        values = np.array(sorted(counts), dtype='int64')
+        return values, np.array([counts[value] for value in values.tolist()], dtype='int64')
+
+    stats, figures = [], []
+    if 'stats' in panels:
+        stats = [user_stats_lines(user, *histogram_lengths(*histogram(words[i])), emoji_counts[i]) +
+                 reply_stats_lines(*histogram(replies['delays'][i])) + session_stats(sessions, user)
+                 for i, user in enumerate(selected_users)]
+        if threads is not None:
+            stats = [lines + thread_stats_lines(*histogram(threads['edit_delays'][i]), threads['received'][i],
+                                                threads['forwarded'][i]) for i, lines in enumerate(stats)]
+    if 'graphs' in panels:
+        figures += [
+            reply_figure(replies, selected_users),
+            session_figure(sessions, selected_users),
+            domain_figure([name for _, name, _ in domains], [index[user] for user, _, _ in domains],
+                          [count for _, _, count in domains], selected_users)
+        ]
+        if threads is not None:
+            figures.append(thread_figure(threads['matrix'], threads['depth'], selected_users))
+    if 'words' in panels:
+        user, term, count = (np.array(column, dtype='int64').reshape(-1)
+                             for column in (zip(*term_rows) if term_rows else [[]] * 3))
+        codes = np.zeros(max(index, default=0) + 1, dtype='int64')
+        codes[list(index)] = list(index.values())
+        matrix = count_by_user(codes[user], term, len(vocabulary), n_users, count)
+        terms, n_words = (np.array(column, dtype=object).reshape(-1)
+                          for column in (zip(*vocabulary) if vocabulary else [[]] * 2))
+        figures += word_figures(matrix, terms, n_words.astype('int64'), selected_users)
+    return stats, figures
+
+
+def sqlite_scatter_figure(path, selected_users, date_range, hidden_flags=0, x_range=None, y_range=None):
+    # message_scatter_figure over the SQLite backend. The viewport is filtered in SQL and counted first: up to
+    # scatter_point_budget messages are fetched as points, more are binned into the density grid by a GROUP BY,
+    # so no more than the budget ever leaves the database.
+    x0, x1, y0, y1 = scatter_viewport(date_range, x_range, y_range)
+    with closing(sqlite3.connect(path)) as db:
+        ids = dict((name, user) for user, name in db.execute('SELECT id, name FROM users'))
+        index = {ids[user]: i for i, user in enumerate(selected_users) if user in ids}
+        where, params = sqlite_filter(db, date_range, hidden_flags, list(index))
+        # The same day and hour of day as message_scatter_figure, in epoch ms and hours.
+        day_ms, hours = '(ts - ts % 86400) * 1000', '(ts % 86400) / 3600.0'
+        where += f' AND {day_ms} >= ? AND {day_ms} < ? AND {hours} >= ? AND {hours} <= ?'
+        params += [x0, x1, y0, y1]
+        count, = db.execute(f'SELECT COUNT(*) FROM messages WHERE {where}', params).fetchone()
+        if count > scatter_point_budget:
+            nx, ny = density_grid(x0, x1, len(selected_users))
+            cells = db.execute(
+                f'SELECT user, MIN(({day_ms} - ?) * ? / ?, ?) * ? + MIN(CAST(({hours} - ?) * ? / ? AS INTEGER), ?) '
+                f'AS cell, COUNT(*) FROM messages WHERE {where} GROUP BY user, cell',
+                [x0, nx, x1 - x0, nx - 1, ny, y0, ny, max(y1 - y0, 1e-9), ny - 1] + params).fetchall()
+            counts = np.zeros((len(selected_users), nx * ny), dtype='int64')
+            for user, cell, n in cells:
+                counts[index[user], cell] = n
+            return density_figure(counts, selected_users, x0, x1, y0, y1)
+        rows = db.execute(f'SELECT ts, user, words FROM messages WHERE {where} ORDER BY ts', params).fetchall()
+    ts, user, words = (np.array(column, dtype='int64').reshape(-1) for column in (zip(*rows) if rows else [[]] * 3))
+    df = pd.DataFrame({
+        'Timestamp': ts.astype('datetime64[s]').astype('datetime64[ns]'),
+        'User': pd.Categorical.from_codes(user, categories=sorted(ids, key=ids.get)),
+        'Words': words.astype('int32')
+    })
+    return message_scatter_figure(df, selected_users, date_range, x_range, y_range)
+
+
+def whatsapp_chunks(lines, n_lines=None):
+    # Blocks of whole messages, about n_lines lines each, from an iterable of export lines. The lines after a
+    # block's last header may still be continued on the next lines, so they are carried over to the next block.
+    n_lines = n_lines or chunk_rows
+    header = re.compile(whatsapp_header)
+    lines = iter(lines)
+    carry = []
+    day_first = None  # the date order, from the first block that shows it
+    while True:
+        block = list(itertools.islice(lines, n_lines))
+        if not block:
+            if carry:
+                yield split_whatsapp(''.join(carry), day_first)
+            return
+        block = carry + block
+        last = next((i for i in range(len(block) - 1, 0, -1) if header.match(block[i])), len(block))
+        carry = block[last:]
+        if day_first is None:
+            day_first = whatsapp_day_first(pd.Series(block[:last], dtype=object).str.extract(whatsapp_header))
+        yield split_whatsapp(''.join(block[:last]), day_first)
+
+
+def new_aggregates():
+    # Running state of a chunked ingest. Users and (user, flags) series get integer codes in order of appearance.
+    return {
+        'users': {},
+        'series': {},
+        'rows': 0,
+        'emojis': 0,
+        'start': None,
+        'end': None,
+        'partials': {name: [] for name in aggregate_keys},
+        'sessions': [],
+        'open_session': None,
+        'last_message': None
+    }
+
+
+def aggregate_how(name):
+    return {'Count': 'sum', **aggregate_values.get(name, {})}
+
+
+def partial_aggregate(name, columns):
+    frame = pd.DataFrame(columns)
+    frame['Count'] = 1
+    return frame.groupby(aggregate_keys[name], sort=False, observed=True).agg(aggregate_how(name)).reset_index()
+
+
+def add_partial(state, name, columns):
+    # Counts of one chunk's key tuples, merged into one table every aggregate_merge_every chunks. emojis also keep
+    # where each tuple was first seen, so ties in the most used emojis break as they do over the messages.
+    partials = state['partials'][name]
+    partials.append(partial_aggregate(name, columns))
+    if len(partials) >= aggregate_merge_every:
+        partials[:] = [merge_partials(partials, aggregate_keys[name], aggregate_how(name))]
+
+
+def merge_partials(partials, keys, how):
+    return pd.concat(partials, ignore_index=True).groupby(keys, sort=False, observed=True).agg(how).reset_index()
+
+
+def add_chunk(state, df):
+    # Reduces one parsed chunk into the aggregates and drops its messages. Chunks must come in time order: replies
+    # and sessions continue from the previous chunk's last message and open session.
+    if df.empty:
+        return
+    df = df.sort_values('Timestamp', kind='mergesort').reset_index(drop=True)
+    users, series_codes = state['users'], state['series']
+    for user in df.User.unique():
+        users.setdefault(user, len(users))
+    user = df.User.map(users).values.astype('int64')
+    series_key = user * 256 + df.Flags.values
+    for key in np.unique(series_key).tolist():
+        series_codes.setdefault(key, len(series_codes))
+    series = pd.Series(series_key).map(series_codes).values
+    codes = time_codes(df.Timestamp)
+    add_partial(state, 'counts', {'Series': series, 'Day': codes['day'], 'Hour': codes['hour']})
+    for name, columns in length_columns(df.User.values, df.Flags.values, codes['day'],
+                                        (df.Message.str.count(' ') + 1).values).items():
+        add_partial(state, name, columns)
+    lengths = df.Emojis.str.len().values
+    if lengths.sum():
+        row = np.repeat(np.arange(len(df)), lengths)
+        add_partial(state, 'emojis', {'Series': series[row], 'Day': codes['day'][row], 'Emoji': list(''.join(df.Emojis)),
+                                      'First': state['emojis'] + np.arange(len(row))})
+        state['emojis'] += len(row)
+    if state['start'] is None:
+        state['start'] = df.Timestamp.iloc[0]
+    links = link_table(df)
+    if len(links):
+        row = links.Row.values
+        add_partial(state, 'domains', {'Series': series[row], 'Day': codes['day'][row],
+                                       'Domain': links.Domain.astype(object).values})
+    state['rows'] += len(df)
+    state['end'] = df.Timestamp.iloc[-1]
+
+    conversation = df.loc[(df.Flags.values & message_flags['system']) == 0, ['Timestamp', 'User']]
+    if len(conversation):
+        add_replies(state, conversation)
+        add_sessions(state, conversation)
+
+
+def add_replies(state, conversation):
+    if state['last_message'] is not None:
+        conversation = pd.concat([state['last_message'], conversation], ignore_index=True)
+    state['last_message'] = conversation.iloc[-1:]
+    replies = reply_analytics(conversation, list(state['users']))
+    if len(replies['delay']):
+        codes = time_codes(replies['timestamp'])
+        bins = delay_bins(replies['delay'])
+        add_partial(state, 'replies', {'User': replies['replier'], 'Day': codes['day'], 'Bin': bins,
+                                       'Seconds': replies['delay']})
+        add_partial(state, 'reply_hours', {'User': replies['replier'], 'Month': codes['month'], 'Hour': codes['hour'],
+                                           'Bin': bins})
+
+
+def add_sessions(state, conversation):
+    # The chunk's first session may continue the open one; its last session stays open for the next chunk.
+    session_id, sessions = session_index(conversation)
+    first, last = ({'Start': row.Start, 'End': row.End, 'Messages': int(row.Messages), 'Initiator': row.Initiator,
+                    'Users': set(conversation.User.values[session_id == i])}
+                   for i, row in zip((0, len(sessions) - 1), sessions.iloc[[0, -1]].itertuples()))
+    open_session, closed = state['open_session'], []
+    if open_session is not None and (first['Start'] - open_session['End']).total_seconds() <= session_gap:
+        open_session.update(End=first['End'], Messages=open_session['Messages'] + first['Messages'])
+        open_session['Users'] |= first['Users']
+        if len(sessions) == 1:
+            return
+        closed.append(open_session)
+        sessions = sessions.iloc[1:-1]
+    else:
+        if open_session is not None:
+            closed.append(open_session)
+        sessions = sessions.iloc[:-1]
+    state['sessions'].append(session_rows(closed))
+    state['sessions'].append(sessions.assign(Initiator=sessions.Initiator.astype(object)))
+    state['open_session'] = last
+
+
+def session_rows(sessions):
+    return pd.DataFrame({
+        'Start': [session['Start'] for session in sessions],
+        'End': [session['End'] for session in sessions],
+        'Messages': np.array([session['Messages'] for session in sessions], dtype='int32'),
+        'Participants': np.array([len(session['Users']) for session in sessions], dtype='int16'),
+        'Initiator': [session['Initiator'] for session in sessions]
+    })
+
+
+def finish_aggregates(state):
+    # The aggregate tables of a chunked ingest, in the same codec as a dataset, with its metadata and time pyramid.
+    users = list(state['users'])
+    series = list(state['series'])
+    tables = {'series': pd.DataFrame({
+        'User': pd.Categorical.from_codes([key // 256 for key in series], categories=users),
+        'Flags': np.array([key % 256 for key in series], dtype='uint8')
+    })}
+    for name, keys in aggregate_keys.items():
+        partials, how = state['partials'][name], aggregate_how(name)
+        tables[name] = merge_partials(partials, keys, how) if partials else \
+            pd.DataFrame({column: np.zeros(0, dtype='int64') for column in keys + list(how)})
+    if state['open_session'] is not None:
+        state['sessions'].append(session_rows([state['open_session']]))
+    sessions = pd.concat(state['sessions'], ignore_index=True) if state['sessions'] else session_rows([])
+    tables['sessions'] = sessions.assign(Initiator=pd.Categorical(sessions.Initiator, categories=users))
+    # The pyramid lists its series sorted by user and flags, as time_pyramid does.
+    order = sorted(range(len(series)), key=lambda i: (users[series[i] // 256], series[i] % 256))
+    rank = np.argsort(order)
+    counts = tables['counts']
+    pyramid = pyramid_levels([[users[series[i] // 256], int(series[i] % 256)] for i in order],
+                             rank[counts.Series.values], counts.Day.values, counts.Hour.values, counts.Count.values)
+    return tables, aggregate_metadata(tables, state), pyramid
+
+
+def aggregate_metadata(tables, state):
+    counts, series = tables['counts'], tables['series']
+    per_series = np.bincount(counts.Series.values, weights=counts.Count.values, minlength=len(series)).astype('int64')
+    user_counts = pd.Series(per_series).groupby(series.User.values).sum()
+    return {
+        'start': state['start'].isoformat(),
+        'end': state['end'].isoformat(),
+        'start_day': int(counts.Day.min()),
+        'end_day': int(counts.Day.max()),
+        'messages': state['rows'],
+        'users': [{'name': user, 'messages': int(user_counts[user])} for user in sorted(user_counts.index)],
+        'categories': [{'name': category, 'messages': int(per_series[(series.Flags.values & flag) > 0].sum())}
+                       for category, flag in message_flags.items()]
+    }
+
+
+def ingest_chunks(chunks, parse):
+    state = new_aggregates()
+    for chunk in chunks:
+        add_chunk(state, parse(chunk))
+    if not state['rows']:
+        return None
+    tables, meta, pyramid = finish_aggregates(state)
+    return encode_dataset(tables), meta, pyramid
+
+
+def ingest_file(path):
+    # Chunked ingest straight from an export on disk, which never has to fit in memory as a whole.
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            return ingest_chunks(telegram_frames(f), parse_telegram)
+    with open(path, encoding='utf-8') as f:
+        return ingest_chunks(whatsapp_chunks(f), parse_whatsapp)
+
+
+def build_dashboard_aggregates(tables, date_range, selected_users, hidden_flags=0, panels=dashboard_panels):
+    # build_dashboard over the tables of a chunked ingest. Replies and sessions were found over all non-system
+    # messages at ingest, so hiding other categories does not change them. Reply delays are kept as delay bins, so
+    # the median reply time is its bin's midpoint, as in the reply figure, and the reply time by hour covers the
+    # whole months of the date range.
+    n_users = len(selected_users)
+    series = tables['series']
+    series_user = user_codes(series.User, selected_users)
+    series_user[(series.Flags.values & hidden_flags) > 0] = -1
+    global_user = user_codes(series.User.cat.categories, selected_users)
+
+    def select(name, user, period='Day', bounds=date_range):
+        table = tables[name]
+        user = user[table['Series' if 'Series' in table else 'User'].values]
+        keep = (user >= 0) & (bounds[0] <= table[period].values) & (table[period].values <= bounds[1])
+        return table[keep], user[keep]
+
+    bins, bins_user = select('replies', global_user)
+    hours, hours_user = select('reply_hours', global_user, 'Month', month_codes(np.array(date_range, dtype='int64')))
+    n_bins = int(delay_bins(np.array([max_reply_delay]))[0]) + 1
+    weekday = (bins.Day.values + 3) % 7
+    replies = {
+        'by_bin': count_by_user(bins_user, bins.Bin.values, n_bins, n_users, bins.Count.values),
+        'seconds': np.bincount(bins_user, weights=bins.Seconds.values, minlength=n_users),
+        'by_hour': count_by_user(hours_user, hours.Hour.values * n_bins + hours.Bin.values, 24 * n_bins, n_users,
+                                 hours.Count.values).reshape(n_users, 24, n_bins),
+        'by_weekday': count_by_user(bins_user, weekday * n_bins + bins.Bin.values, 7 * n_bins, n_users,
+                                    bins.Count.values).reshape(n_users, 7, n_bins)
+    }
+    n_replies = replies['by_bin'].sum(axis=1)
+    medians = histogram_medians(replies['by_bin'])
+    sessions = tables['sessions']
+    start_days = epoch_days(sessions.Start)
+    sessions = sessions[(date_range[0] <= start_days) & (start_days <= date_range[1])]
+
+    stats, figures = [], []
+    if 'stats' in panels:
+        lengths = length_stats(tables, date_range, selected_users, hidden_flags)
+        emojis, emojis_user = select('emojis', series_user)
+        for i, user in enumerate(selected_users):
+            emoji_counts = emojis[emojis_user == i].groupby('Emoji').agg({'Count': 'sum', 'First': 'min'}) \
+                .sort_values('First')
+            stats.append(user_stats_lines(user, *lengths[i], dict(emoji_counts.Count.items()))
+                         + reply_summary_lines(int(n_replies[i]), medians[i],
+                                               replies['seconds'][i] / max(n_replies[i], 1))
+                         + session_stats(sessions, user))
+    if 'graphs' in panels:
+        domains, domains_user = select('domains', series_user)
+        figures += [
+            reply_figure(replies, selected_users),
+            session_figure(sessions, selected_users),
+            domain_figure(domains.Domain.values, domains_user, domains.Count.values, selected_users)
+        ]
+    return stats, figures
+
+
+def stratified_sample(stratum, n_rows, seed=0):
+    # Rows of a proportional stratified sample of about n_rows rows, drawn without replacement, with every row of a
+    # stratum smaller than preview_min_stratum. Returns the rows in order, and each stratum's size and sample size.
+    sizes = np.bincount(stratum)
+    fraction = min(1.0, n_rows / max(len(stratum), 1))
+    taken = np.minimum(sizes, np.maximum(np.ceil(sizes * fraction), preview_min_stratum)).astype('int64')
+    order = np.lexsort((np.random.default_rng(seed).random(len(stratum)), stratum))
+    rank = np.arange(len(stratum)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return np.sort(order[rank < taken[stratum[order]]]), sizes, taken
+
+
+def stratified_estimate(s1, s2, sizes, taken):
+    # Estimated totals and their variances, per stratum, from the sum s1 and the sum of squares s2 of a value over
+    # each stratum's sampled rows (zero for rows outside the selection). s1 and s2 may have a bin axis after it.
+    shape = (-1,) + (1,) * (np.ndim(s1) - 1)
+    sizes, taken = sizes.reshape(shape).astype('float64'), taken.reshape(shape).astype('float64')
+    spread = (s2 - s1 ** 2 / taken) / np.maximum(taken - 1, 1)
+    return s1 * sizes / taken, sizes ** 2 * (1 - taken / sizes) * spread / taken
+
+
+def build_preview(tables, date_range, selected_users, hidden_flags=0, panels=dashboard_panels):
+    # build_dashboard's stats estimated from a preview sample, with 95% intervals. The 'graphs' panels, built from
+    # consecutive messages (replies, sessions), cannot be estimated from a sample and wait for the exact dashboard.
+    sample, strata = tables['sample'], tables['strata']
+    sizes, taken = strata.Size.values, strata.Sampled.values
+    n_users, n_strata = len(selected_users), len(strata)
+    strata_user = user_codes(strata.User, selected_users)
+    stratum = sample.Stratum.values
+    days = epoch_days(sample.Timestamp)
+    user = user_codes(sample.User, selected_users)
+    selected = (date_range[0] <= days) & (days <= date_range[1]) & ((sample.Flags.values & hidden_flags) == 0) & \
+        (user >= 0)
+
+    def by_user(values):
+        totals = np.zeros((n_users,) + values.shape[1:])
+        np.add.at(totals, strata_user[strata_user >= 0], values[strata_user >= 0])
+        return totals
+
+    def estimate(value):
+        s1 = np.bincount(stratum, weights=value, minlength=n_strata)
+        s2 = np.bincount(stratum, weights=value ** 2, minlength=n_strata)
+        return [by_user(part) for part in stratified_estimate(s1, s2, sizes, taken)]
+
+    stats = []
+    if 'stats' not in panels:
+        return stats, []
+
+    # Mean words by the ratio estimator, with its linearised variance.
+    words = sample.Words.values * selected
+    messages, messages_variance = estimate(selected.astype('float64'))
+    total_words, _ = estimate(words.astype('float64'))
+    mean = total_words / np.maximum(messages, 1)
+    residual = np.where(selected, (words - mean[user] * selected) / np.maximum(messages, 1)[user], 0)
+    _, mean_variance = estimate(residual)
+    weights = (sizes / taken)[stratum]
+    for i, name in enumerate(selected_users):
+        rows = selected & (user == i)
+        if not rows.any():
+            stats.append([f'User: {name}', 'Messages sent: 0'])
+            continue
+        order = np.argsort(sample.Words.values[rows], kind='stable')
+        cumulative = np.cumsum(weights[rows][order])
+        median = sample.Words.values[rows][order][np.searchsorted(cumulative, cumulative[-1] / 2)]
+        emoji_counts = Counter(x for y in sample.Emojis.values[rows] for x in y)
+        stats.append([
+            f'User: {name}',
+            f'Messages sent: about {messages[i]:,.0f} ± {1.96 * math.sqrt(messages_variance[i]):,.0f}',
+            f'Mean words per message: {mean[i]:.2f} ± {1.96 * math.sqrt(mean_variance[i]):.2f}',
+            f'Median words per message: about {median}',
+            f'Most used emojis: {" ".join(k for k, v in emoji_counts.most_common(5))}',
+            f'Preview from {int(rows.sum()):,} sampled messages; exact results follow'
         ])
-    ], style={'width': '14%', 'display': 'inline-block', 'vertical-align': 'top', 'margin': '5px'}),
-    html.Div([
-        html.Div(id='stats'),
-        html.Div(id='graphs')
-    ], style={'width': '84%', 'display': 'inline-block', 'margin': '5px'})
-])
+    return stats, []
+
+
+def render_report(stats, figures, date_range, selected_users):
+    # One HTML file: a single inlined plotly.js bundle, then every chart as pre-aggregated JSON.
+    cards = ''.join(
+        '<div class="card">' + '<br>'.join(escape(line) for line in lines) + '</div>' for lines in stats)
+    charts = ''.join(
+        '<div class="chart">' + pio.to_html(fig, full_html=False, include_plotlyjs=False) + '</div>' for fig in figures)
+    return report_template.format(
+        plotlyjs=plotly_offline.get_plotlyjs(),
+        subtitle=escape(f'{epoch_day_to_date(date_range[0])} to {epoch_day_to_date(date_range[1])}, '
+                        f'{", ".join(selected_users)}'),
+        cards=cards,
+        charts=charts
+    )
+
+
+def prune_reports(keep=reports_max):
+    # Deletes expired reports, then the oldest ones past keep.
+    if not os.path.isdir(reports_dir):
+        return
+    reports = []
+    for entry in os.scandir(reports_dir):
+        try:
+            reports.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            continue
+    reports.sort(reverse=True)
+    now = time.time()
+    for i, (written, path) in enumerate(reports):
+        if i >= keep or now - written > report_ttl:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def write_report(stats, figures, date_range, selected_users):
+    # The name is random, since whoever has the link can download the report.
+    prune_reports(max(reports_max - 1, 0))
+    os.makedirs(reports_dir, exist_ok=True)
+    filename = f'report_{os.urandom(16).hex()}.html'
+    with open(os.path.join(reports_dir, filename), 'w', encoding='utf-8') as file:
+        file.write(render_report(stats, figures, date_range, selected_users))
+    return filename
+
+
+class TaskFailed(Exception):
+    pass
+
+
+class NotCached(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def compute_pool():
+    return concurrent.futures.ProcessPoolExecutor(max_workers=compute_workers, mp_context=process_context)
+
+
+def run_task(function, *args, fallback=None):
+    # Runs function(*args) in the compute pool, so heavy work never holds the request threads that serve
+    # everyone else. At most compute_workers tasks run and compute_queue more wait; anything beyond that is
+    # turned away at once rather than queued. A slot is freed when its task ends, not when the request gives up.
+    # A task that raises NotCached is followed, on the same slot, by the (function, args) that fallback() returns.
+    if not compute_workers:
+        return function(*args)
+    if not compute_slots.acquire(blocking=False):
+        raise TaskFailed('The server is busy, please try again in a moment.')
+    future = None
+    try:
+        future = compute_pool().submit(function, *args)
+        try:
+            return task_result(future)
+        except NotCached:
+            if fallback is None:
+                raise
+        function, args = fallback()
+        future = compute_pool().submit(function, *args)
+        return task_result(future)
+    finally:
+        if future is None:
+            compute_slots.release()
+        else:
+            future.add_done_callback(lambda _: compute_slots.release())
+
+
+def task_result(future):
+    try:
+        return future.result(timeout=compute_timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TaskFailed(f'Gave up after {compute_timeout} seconds.')
+    except concurrent.futures.BrokenExecutor:
+        # A worker died (out of memory, usually); start a fresh pool for the next task.
+        compute_pool.cache_clear()
+        raise TaskFailed('The worker processing this request crashed.')
+
+
+def run_upload(function, *args):
+    # Runs function(*args) in a new process, for uploads: unlike a pool task, one still running after
+    # compute_timeout is killed, so a slow parse never keeps using the CPU it was given up on. Uploads beyond
+    # upload_workers are turned away at once.
+    if not compute_workers:
+        return function(*args)
+    if not upload_slots.acquire(blocking=False):
+        raise TaskFailed('The server is busy, please try again in a moment.')
+    receiver, sender = process_context.Pipe(duplex=False)
+    try:
+        process = process_context.Process(target=upload_process, args=(sender, function, args), daemon=True)
+        process.start()
+        sender.close()
+        if not receiver.poll(compute_timeout):
+            process.terminate()
+            process.join()
+            raise TaskFailed(f'Gave up after {compute_timeout} seconds.')
+        try:
+            failed, result = receiver.recv()
+        except EOFError:
+            raise TaskFailed('The worker processing this request crashed.')
+        process.join()
+    finally:
+        receiver.close()
+        upload_slots.release()
+    if failed:
+        raise result
+    return result
+
+
+def upload_process(sender, function, args):
+    try:
+        result = False, function(*args)
+    except Exception as e:
+        result = True, e
+    sender.send(result)
+    sender.close()
+
+
+def value_bytes(value):
+    # Memory held by a cached value: arrays by their buffers, containers by their items.
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_bytes(key) + value_bytes(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(value_bytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class DatasetRegistry:
+    # Encoded datasets of the in-memory backend, by key, with the values derived from each. Keeps their total
+    # size under budget by spilling the least recently used datasets to spill_dir (their derived values are just
+    # dropped) and reads them back when they are asked for again. Datasets unused for ttl seconds are deleted,
+    # as are the oldest spilled files past disk_budget; files are read and written outside the lock.
+    def __init__(self, budget, spill_dir, disk_budget=float('inf'), ttl=float('inf')):
+        self.budget = budget
+        self.spill_dir = spill_dir
+        self.disk_budget = disk_budget
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.spilling = {}  # entries taken out of memory whose file is being written
+        self.lock = threading.RLock()
+        self.spills = 0
+        self.reloads = 0
+        self.expired = 0
+        self.generation = 0  # of worker copies, see worker_key
+
+    def spill_path(self, key):
+        return os.path.join(self.spill_dir, f'{key}.json')
+
+    def add(self, payload, key=None):
+        key = key or os.urandom(16).hex()
+        with self.lock:
+            self.entries[key] = {'payload': payload, 'bytes': sys.getsizeof(payload), 'derived': {}, 'used': time.time()}
+            spilled = self.enforce_budget(key)
+        self.write_spills(spilled)
+        self.expire()
+        return key
+
+    def entry(self, key):
+        # The entry for key, moved to the most recently used end and read back from disk if it was spilled.
+        with self.lock:
+            entry = self.entries.get(key) or self.spilling.get(key)
+            if entry is not None:
+                spilled = self.touch(key, entry)
+        if entry is None:
+            try:
+                with open(self.spill_path(key)) as file:
+                    payload = file.read()
+            except FileNotFoundError:
+                return None
+            with self.lock:
+                entry = self.entries.get(key) or self.spilling.get(key)
+                if entry is None:
+                    # Unless it was removed while it was read.
+                    if not os.path.exists(self.spill_path(key)):
+                        return None
+                    self.reloads += 1
+                    entry = {'payload': payload, 'bytes': sys.getsizeof(payload), 'derived': {}}
+                spilled = self.touch(key, entry)
+        self.write_spills(spilled)
+        return entry
+
+    def touch(self, key, entry):
+        # Called with the lock held; returns what enforce_budget does.
+        entry['used'] = time.time()
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        return self.enforce_budget(key)
+
+    def has(self, key):
+        with self.lock:
+            return key in self.entries or key in self.spilling or os.path.exists(self.spill_path(key))
+
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.spilling.pop(key, None)
+        try:
+            os.remove(self.spill_path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        entry = self.entry(key)
+        return entry['payload'] if entry is not None else None
+
+    def derived(self, key, name, compute):
+        # compute() once per dataset and name, counted against the budget with the dataset.
+        entry = self.entry(key)
+        if entry is None:
+            return compute()
+        if name not in entry['derived']:
+            value = compute()
+            with self.lock:
+                entry['derived'][name] = (value, value_bytes(value))
+                entry['bytes'] += entry['derived'][name][1]
+                spilled = self.enforce_budget(key)
+            self.write_spills(spilled)
+            return value
+        return entry['derived'][name][0]
+
+    def worker_key(self, key, part):
+        # The key compute workers cache the decoded tables of part (a panel_tables key) of dataset key under, and
+        # those of every copy still counted. A copy is a derived value like any other, whose size worker_copy adds as
+        # workers report it; once dropped, its key leaves the list that every dataset task carries, and workers free
+        # it. The generation makes sure a copy dropped is never found again under the key of a later one.
+        entry = self.entry(key)
+        with self.lock:
+            if entry is None or key not in self.entries:
+                return None, None
+            name = f'worker {part}'
+            if name not in entry['derived']:
+                self.generation += 1
+                entry['derived'][name] = (f'{key} {part} {self.generation}', 0)
+            return entry['derived'][name][0], self.worker_keys()
+
+    def worker_keys(self):
+        return [value for entry in self.entries.values()
+                for name, (value, _) in entry['derived'].items() if name.startswith('worker ')]
+
+    def worker_copy(self, key, worker_key, size):
+        # A worker decoded and kept size bytes under worker_key; not counted if the copy was dropped meanwhile, as
+        # that worker frees it with its next task.
+        if not size:
+            return
+        name = f'worker {worker_key.split()[1]}'
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry['derived'].get(name, (None,))[0] != worker_key:
+                return
+            entry['derived'][name] = (worker_key, entry['derived'][name][1] + size)
+            entry['bytes'] += size
+            spilled = self.enforce_budget(key)
+        self.write_spills(spilled)
+
+    def enforce_budget(self, current):
+        # Called with the lock held. Derived values go first, as they are cheap to compute again: the entry in use's,
+        # then the others' from the least recently used. Only then are datasets spilled, least recently used first,
+        # never the entry in use even when it alone is over budget. Returns the keys whose files write_spills must
+        # write, once the lock is released.
+        total = sum(entry['bytes'] for entry in self.entries.values())
+        for key in [current] + [key for key in self.entries if key != current]:
+            entry = self.entries.get(key)
+            while total > self.budget and entry is not None and entry['derived']:
+                _, size = entry['derived'].pop(next(iter(entry['derived'])))
+                entry['bytes'] -= size
+                total -= size
+            if total <= self.budget:
+                break
+        spilled = []
+        for key in list(self.entries):
+            if total <= self.budget:
+                break
+            if key == current:
+                continue
+            entry = self.entries.pop(key)
+            if os.path.exists(self.spill_path(key)):
+                os.utime(self.spill_path(key), (entry['used'], entry['used']))
+            else:
+                self.spilling[key] = entry
+                spilled.append(key)
+            self.spills += 1
+            total -= entry['bytes']
+        return spilled
+
+    def write_spills(self, keys):
+        # The file's modification time is the dataset's last use, for expire().
+        if not keys:
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        for key in keys:
+            with self.lock:
+                entry = self.spilling.get(key)
+            if entry is None:
+                continue
+            with open(self.spill_path(key) + '.tmp', 'w') as file:
+                file.write(entry['payload'])
+            os.utime(self.spill_path(key) + '.tmp', (entry['used'], entry['used']))
+            os.replace(self.spill_path(key) + '.tmp', self.spill_path(key))
+            with self.lock:
+                # Removed while it was written: the file goes too.
+                if self.spilling.pop(key, None) is None and key not in self.entries:
+                    os.remove(self.spill_path(key))
+        self.expire()
+
+    def expire(self):
+        # Deletes the datasets unused for ttl seconds, in memory or on disk, then the least recently used spilled
+        # files past disk_budget.
+        now = time.time()
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if now - entry['used'] > self.ttl]:
+                del self.entries[key]
+                self.expired += 1
+        if not os.path.isdir(self.spill_dir):
+            return
+        files = []
+        for file in os.scandir(self.spill_dir):
+            try:
+                if file.name.endswith('.json'):
+                    files.append((file.stat().st_mtime, file.stat().st_size, file.name[:-len('.json')]))
+            except FileNotFoundError:
+                continue
+        size = 0
+        for used, file_bytes, key in sorted(files, reverse=True):
+            size += file_bytes
+            with self.lock:
+                if key in self.entries or key in self.spilling or (now - used <= self.ttl and size <= self.disk_budget):
+                    continue
+                self.expired += 1
+            try:
+                os.remove(self.spill_path(key))
+            except FileNotFoundError:
+                pass
+
+    def usage(self):
+        with self.lock:
+            spilled = [name for name in os.listdir(self.spill_dir)
+                       if name.endswith('.json')] if os.path.isdir(self.spill_dir) else []
+            return {
+                'budget_bytes': self.budget,
+                'memory_bytes': sum(entry['bytes'] for entry in self.entries.values()),
+                'worker_bytes': sum(size for entry in self.entries.values()
+                                    for name, (_, size) in entry['derived'].items() if name.startswith('worker ')),
+                'datasets_in_memory': len(self.entries),
+                'datasets_on_disk': len(spilled),
+                'disk_bytes': sum(os.path.getsize(os.path.join(self.spill_dir, name)) for name in spilled),
+                'spills': self.spills,
+                'reloads': self.reloads,
+                'expired': self.expired,
+                'datasets': [{
+                    'key': key[:-24],  # enough to tell them apart; a full key would give access to the chat
+                    'bytes': entry['bytes'],
+                    'dataset_bytes': entry['bytes'] - sum(size for _, size in entry['derived'].values()),
+                    'derived_values': len(entry['derived']),
+                    'worker_bytes': sum(size for name, (_, size) in entry['derived'].items()
+                                        if name.startswith('worker ')),
+                    'idle_seconds': round(time.time() - entry['used'], 1)
+                } for key, entry in reversed(self.entries.items())]
+            }
+
+
+dataset_registry = DatasetRegistry(dataset_memory_budget, os.path.join(storage_dir, 'datasets'), dataset_disk_budget,
+                                   dataset_ttl)
+# Uploads by fingerprint: the shared result of their ingest (a future while it runs) and how many pages hold it.
+uploads = {}
+uploads_lock = threading.Lock()
+
+
+def register_dataset(dataset, key=None):
+    # What the page holds for a dataset ingest returned: a registry key, or the reference of an on-disk one.
+    if dataset.startswith(sqlite_prefix):
+        return dataset
+    return dataset_prefix + dataset_registry.add(dataset, key)
+
+
+def pyramid_key(reference):
+    # Registry key of a dataset's time pyramid, which stays on the server next to it whatever the backend.
+    return 'pyramid-' + hashlib.blake2b(reference.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def register_pyramid(reference, pyramid):
+    dataset_registry.add(json.dumps(pyramid), pyramid_key(reference))
+
+
+def page_pyramid(pyramid):
+    # What the page gets of a pyramid: the hourly level the client-side charts read, and only with clientside_filters.
+    return {'series': pyramid['series'], 'levels': pyramid['levels'][:1]} if clientside_filters else None
+
+
+def dataset_pyramid(reference):
+    # The time pyramid of what the page holds, decoded once and cached with it.
+    key = pyramid_key(reference)
+    payload = dataset_registry.get(key)
+    if payload is None:
+        raise TaskFailed('This chat is no longer on the server, please upload it again.')
+    return dataset_registry.derived(key, 'decoded', lambda: json.loads(payload))
+
+
+class UploadReader(io.RawIOBase):
+    # The bytes of an upload's base64 contents from start on, decoded upload_hash_block characters at a time as they
+    # are read, so that the chunked ingest never holds the decoded upload whole.
+    def __init__(self, contents, start):
+        self.contents = contents
+        self.position = start
+        self.block = memoryview(b'')
 
+    def readable(self):
+        return True
 
-@app.callback(Output('intermediate-values', 'children'),
-              [Input('upload-data', 'contents')])
-def parse_data(contents):
+    def readinto(self, buffer):
+        while not self.block and self.position < len(self.contents):
+            self.block = memoryview(base64.b64decode(self.contents[self.position:self.position + upload_hash_block]))
+            self.position += upload_hash_block
+        n = min(len(buffer), len(self.block))
+        buffer[:n] = self.block[:n]
+        self.block = self.block[n:]
+        return n
+
+
+def upload_text(contents):
+    # The text of an upload as a stream; lines end at '\n' only, as in io.StringIO.
+    reader = UploadReader(contents, contents.index(',') + 1)
+    return io.TextIOWrapper(io.BufferedReader(reader), encoding='utf-8', newline='\n')
+
+
+def upload_fingerprint(contents):
+    # blake2b of the content type and the uploaded bytes, decoding the base64 one block at a time so the upload is
+    # never copied whole.
+    comma = contents.index(',')
+    digest = hashlib.blake2b(contents[:comma].encode('utf-8'), digest_size=16)
+    for start in range(comma + 1, len(contents), upload_hash_block):
+        digest.update(base64.b64decode(contents[start:start + upload_hash_block]))
+    return digest.hexdigest()
+
+
+def claim_upload(contents, fingerprint):
+    # The shared entry of an upload, held by one more page. Identical uploads are parsed once: the first claim
+    # starts the ingest, in a thread, and the others share its result (the stored dataset, read-only), waiting for
+    # it while it runs instead of starting their own. The result is the registered (reference, meta), or None if
+    # the upload could not be parsed.
+    with uploads_lock:
+        upload = live_upload(fingerprint)
+        if upload is None:
+            upload = uploads[fingerprint] = {'result': concurrent.futures.Future(), 'refs': 0}
+            threading.Thread(target=ingest_upload, args=(contents, fingerprint, upload), daemon=True).start()
+        upload['refs'] += 1
+    return upload
+
+
+def live_upload(fingerprint):
+    # The entry of an upload, unless its dataset or its pyramid has expired from the registry since; then it is
+    # forgotten, to be parsed again. Called with uploads_lock held.
+    upload = uploads.get(fingerprint)
+    reference = upload.get('reference') if upload is not None else None
+    if reference is None:
+        return upload
+    if not dataset_registry.has(pyramid_key(reference)) or \
+            reference.startswith(dataset_prefix) and not dataset_registry.has(reference[len(dataset_prefix):]):
+        del uploads[fingerprint]
+        delete_dataset(reference)
+        return None
+    return upload
+
+
+def ingest_upload(contents, fingerprint, upload):
+    # run_upload gives up after compute_timeout, so the result is always set. Failed uploads are forgotten, to be
+    # tried again by the next page that sends them, and so are uploads every page let go of while they were parsed.
+    try:
+        result = run_upload(ingest, contents)
+        if result is not None:
+            dataset, meta, pyramid = result
+            result = register_dataset(dataset), meta
+            register_pyramid(result[0], pyramid)
+    except Exception as e:
+        with uploads_lock:
+            if uploads.get(fingerprint) is upload:
+                del uploads[fingerprint]
+        upload['result'].set_exception(e)
+        return
+    with uploads_lock:
+        if result is not None:
+            upload['reference'] = result[0]
+        if result is None and uploads.get(fingerprint) is upload:
+            del uploads[fingerprint]
+        orphaned = result is not None and fingerprint not in uploads
+    if orphaned:
+        delete_dataset(result[0])
+    upload['result'].set_result(result)
+
+
+def release_upload(reference=None, fingerprint=None):
+    # Called when a page replaces the dataset it held, or gives up on one it was waiting for; the last page to let
+    # go of an upload deletes it. Previews belong to a single page and go at once.
+    if reference is not None and reference.startswith(dataset_prefix + 'preview-'):
+        delete_dataset(reference)
+        return
+    with uploads_lock:
+        if fingerprint is None:
+            fingerprint = next((key for key, upload in uploads.items() if upload.get('reference') == reference), None)
+        if fingerprint not in uploads:
+            return
+        uploads[fingerprint]['refs'] -= 1
+        if uploads[fingerprint]['refs'] > 0:
+            return
+        reference = uploads.pop(fingerprint).get('reference')
+    if reference is not None:
+        delete_dataset(reference)
+
+
+def delete_dataset(reference):
+    dataset_registry.remove(pyramid_key(reference))
+    if reference.startswith(dataset_prefix):
+        dataset_registry.remove(reference[len(dataset_prefix):])
+    elif os.path.exists(sqlite_path(reference)):
+        os.remove(sqlite_path(reference))
+
+
+def resolve_dataset(reference, tables=None):
+    # The dataset tasks take for what the page holds, cut down to tables (see select_dataset) when given; runs in the
+    # web process, where the registry lives. Anything but a registry key or an on-disk reference is turned down: it
+    # came from the page, and is never decoded as a dataset.
+    if reference.startswith(sqlite_prefix):
+        return reference
+    if not reference.startswith(dataset_prefix):
+        raise TaskFailed('This chat is not on the server, please upload it again.')
+    payload = dataset_registry.get(reference[len(dataset_prefix):])
+    if payload is None:
+        raise TaskFailed('This chat is no longer on the server, please upload it again.')
+    return payload if tables is None else select_dataset(payload, tables)
+
+
+def ingest(contents):
+    # Decode, parse and enrich an upload; runs in the compute pool.
     df = None
+    if contents is not None and storage_backend == 'chunked':
+        # Decoded as it is parsed, a block at a time.
+        content_type = contents[:contents.index(',')].lower()
+        if 'text' in content_type:
+            print("WhatsApp chat detected.")
+            return ingest_chunks(whatsapp_chunks(upload_text(contents)), parse_whatsapp)
+        if 'json' in content_type:
+            print("Telegram chat detected.")
+            try:
+                return ingest_chunks(telegram_frames(upload_text(contents)), parse_telegram)
+            except json.JSONDecodeError as e:
+                print("Error: Invalid JSON string.")
+                print(e)
+        return None
     if contents is not None:
         # Decode the contents from base64 and convert it to a string.
         content_type, content_string = contents.split(',')
@@ -142,162 +2670,671 @@ def parse_data(contents):
 
         if 'text' in str(content_type).lower():
             print("WhatsApp chat detected.")
-            # Split into list of messages and keep only relevant ones.
-            decoded = decoded.split('\n')
-            lines = [x for x in decoded if x.startswith('[')]
-            parsed_lines = [
-                [x[1:x.find(",")], # up to first comma, for date
-                 x[x.find(",")+2:x.find("]")], # from first comma to first ], for time
-                 x[x.find("]")+1:][:x[x.find("]"):].find(':')-1], # from first ] to next : for name
-                 x[x.find("]")+1:][x[x.find("]")+1:].find(':')+2:-1] # message
-                ] for x in lines]
-            df = pd.DataFrame(parsed_lines, columns=['Date', 'Time', 'User', 'Message'])
-            df = parse_whatsapp(df)
-            
+            parts = split_whatsapp(decoded)
+            if len(parts):
+                df = parse_whatsapp(parts)
+            else:
+                print("Error: No messages found in text data.")
+
         if 'json' in str(content_type).lower():
             print("Telegram chat detected.")
             try:
-                json_data = json.loads(decoded)
-                print("JSON is valid.")
-                if json_data:
-                    df = pd.DataFrame(json_data)
-                    if 'messages' in df:
-                        df = pd.json_normalize(df.messages)
-                        df = df[['date_unixtime', 'from', 'text']]
-                        df = parse_telegram(df)  
-                    else:
-                        print("Error: 'messages' field not found in JSON data.")
+                frames = list(telegram_frames(io.StringIO(decoded)))
+                if frames:
+                    df = parse_telegram(pd.concat(frames, ignore_index=True))
                 else:
-                    print("Error: Empty JSON data.")
+                    print("Error: No messages found in JSON data.")
             except json.JSONDecodeError as e:
                 print("Error: Invalid JSON string.")
                 print(e)
-        
-
-        # Uncomment line below to exclude all media messages
-        # df = df[df.Message != '<Media omitted>']
 
         # Uncomment lines below to anonymize users
         # df.User = [f'User {x}' for x in df['from'].factorize()[0]]
 
-    return df.to_json(date_format='iso', orient='split')
-    
+    if df is None:
+        return None
+
+    df = df.sort_values('Timestamp', kind='mergesort').reset_index(drop=True)
+    df['Words'] = (df.Message.str.count(' ') + 1).astype('int32')
+    if 'MessageId' in df:
+        df = add_thread_columns(df)
+    # System lines neither start nor extend a session.
+    conversation = (df.Flags.values & message_flags['system']) == 0
+    session_id, sessions = session_index(df[conversation])
+    df['Session'] = np.full(len(df), -1, dtype='int32')
+    df.loc[conversation, 'Session'] = session_id
+    if storage_backend == 'sqlite':
+        dataset = write_sqlite(df, sessions)
+    else:
+        dataset = encode_dataset(message_tables(df, sessions))
+    return dataset, dataset_metadata(df), time_pyramid(df)
+
+
+def preview_source(contents):
+    # Timestamp, User and Flags of every message of an upload, from the cheap part of parsing it, and a function
+    # that parses the given rows of it in full; None when it holds no messages.
+    content_type, content_string = contents.split(',')
+    decoded = base64.b64decode(content_string).decode('utf-8')
+    if 'text' in str(content_type).lower():
+        print("WhatsApp chat detected.")
+        parts = split_whatsapp(decoded)
+        if not len(parts):
+            print("Error: No messages found in text data.")
+            return None
+        light = pd.DataFrame({'Timestamp': parts.Timestamp, 'User': parts.User, 'Flags': classify_whatsapp(parts)})
+        return light, lambda rows: parse_whatsapp(parts.iloc[rows])
+    if 'json' in str(content_type).lower():
+        print("Telegram chat detected.")
+        frames = list(telegram_frames(io.StringIO(decoded)))
+        if not frames:
+            print("Error: No messages found in JSON data.")
+            return None
+        raw = pd.concat(frames, ignore_index=True)
+        flags = classify_telegram(raw.assign(Message=raw.text))
+        kept = np.flatnonzero((raw.text.str.len() > 0).values |
+                              ((flags & (message_flags['media'] | message_flags['system'])) > 0))
+        light = pd.DataFrame({
+            'Timestamp': pd.to_datetime(pd.to_numeric(raw.date_unixtime).values[kept] + 8 * 60 * 60, unit='s'),
+            'User': raw['from'].fillna(raw['actor']).values[kept],
+            'Flags': flags[kept]
+        })
+        return light, lambda rows: parse_telegram(raw.iloc[kept[rows]])
+    return None
+
+
+def ingest_preview(contents):
+    # The preview of an upload: a stratified sample of its messages by user and month, parsed in full, with the
+    # size of every stratum. The metadata and the time pyramid are exact, from every message. Runs in the compute
+    # pool, ahead of the full ingest.
+    source = preview_source(contents)
+    if source is None or len(source[0]) == 0:
+        return None
+    light, parse_rows = source
+    order = np.argsort(light.Timestamp.values, kind='stable')
+    light = light.iloc[order].reset_index(drop=True)
+    users = sorted(light.User.unique())
+    months = light.Timestamp.values.astype('datetime64[M]').astype('int64')
+    keys, stratum = np.unique(user_codes(light.User, users) * (1 << 20) + months - months.min(), return_inverse=True)
+    rows, sizes, taken = stratified_sample(stratum, preview_rows)
+    sample = parse_rows(order[rows])
+    tables = {
+        'sample': pd.DataFrame({
+            'Timestamp': sample.Timestamp.values,
+            'User': pd.Categorical(sample.User.values, categories=users),
+            'Words': (sample.Message.str.count(' ') + 1).values.astype('int32'),
+            'Flags': sample.Flags.values,
+            'Emojis': sample.Emojis.values,
+            'Stratum': stratum[rows].astype('int32')
+        }),
+        'strata': pd.DataFrame({
+            'User': pd.Categorical.from_codes(keys // (1 << 20), categories=users),
+            'Size': sizes,
+            'Sampled': taken
+        })
+    }
+    return encode_dataset(tables), dataset_metadata(light), time_pyramid(light)
+
+
+def message_tables(df, sessions):
+    # The tables of an in-memory dataset: the messages and everything precomputed from them at ingest.
+    tables = {'messages': df, 'sessions': sessions, 'links': link_table(df), **length_tables(df), **word_tables(df)}
+    if 'ReplyTo' in df:
+        offsets, children = reply_index(df.ReplyTo.values)
+        tables['reply_offsets'] = pd.DataFrame({'Offset': offsets})
+        tables['reply_children'] = pd.DataFrame({'Row': children})
+    return tables
+
+
+# Decoded tables of this compute worker, by the registry's worker_key; each is counted in the registry's budget.
+worker_tables = {}
+
+
+def worker_dataset(payload, key, kept):
+    # The decoded tables of payload, kept under key, and the bytes they newly take (0 when they were kept already).
+    # Those the registry no longer counts (not in kept) are freed first. payload may be None: NotCached is raised
+    # when they are not kept, for the caller to send them.
+    for stale in [stale for stale in worker_tables if stale not in kept]:
+        del worker_tables[stale]
+    if key in worker_tables:
+        return worker_tables[key], 0
+    if payload is None:
+        raise NotCached(key)
+    tables = decode_dataset(payload)
+    worker_tables[key] = tables
+    return tables, sum(int(table.memory_usage(index=False, deep=True).sum()) for table in tables.values())
+
+
+def worker_task(function, payload, key, kept, *args):
+    # function(tables, *args) over the tables worker_dataset gives, with the bytes they newly take.
+    tables, size = worker_dataset(payload, key, set(kept))
+    return function(tables, *args), size
+
+
+def run_dataset_task(function, reference, tables, *args):
+    # run_task for function(dataset, *args) over the tables of what the page holds (a panel_tables key). For an
+    # in-memory dataset the task is first sent without them, in case its worker has them decoded already.
+    if not reference.startswith(dataset_prefix) or not compute_workers:
+        return run_task(function, resolve_dataset(reference, panel_tables[tables]), *args)
+    key = reference[len(dataset_prefix):]
+    worker_key, kept = dataset_registry.worker_key(key, tables)
+    if worker_key is None:
+        raise TaskFailed('This chat is no longer on the server, please upload it again.')
+
+    def send():
+        return worker_task, (function, resolve_dataset(reference, panel_tables[tables]), worker_key, kept) + args
+    result, size = run_task(worker_task, function, None, worker_key, kept, *args, fallback=send)
+    dataset_registry.worker_copy(key, worker_key, size)
+    return result
+
+
+def dataset_dashboard(dataset, date_range, selected_users, hidden_flags, panels=dashboard_panels):
+    # dataset: its decoded tables, an encoded dataset or an on-disk reference.
+    if isinstance(dataset, str) and dataset.startswith(sqlite_prefix):
+        return build_dashboard_sql(sqlite_path(dataset), date_range, selected_users, hidden_flags, panels)
+    tables = decode_dataset(dataset) if isinstance(dataset, str) else dataset
+    if 'sample' in tables:
+        return build_preview(tables, date_range, selected_users, hidden_flags, panels)
+    if 'messages' not in tables:
+        return build_dashboard_aggregates(tables, date_range, selected_users, hidden_flags, panels)
+    return build_dashboard(tables, date_range, selected_users, hidden_flags, panels)
+
+
+def dataset_scatter(dataset, selected_users, date_range, hidden_flags, x_range=None, y_range=None):
+    # The message scatter of a dataset, as dataset_dashboard takes it; None in chunked mode, which keeps no messages.
+    if isinstance(dataset, str) and dataset.startswith(sqlite_prefix):
+        return sqlite_scatter_figure(sqlite_path(dataset), selected_users, date_range, hidden_flags, x_range, y_range)
+    tables = decode_dataset(dataset) if isinstance(dataset, str) else dataset
+    if 'messages' not in tables:
+        return None
+    df = tables['messages']
+    df = df[df.User.isin(selected_users) & ((df.Flags.values & hidden_flags) == 0)]
+    return message_scatter_figure(df, selected_users, date_range, x_range, y_range)
+
+
+def dashboard_task(dataset, panel, date_range, selected_users, hidden_flags):
+    # One panel of the dashboard: its stats lines, or its figures as dicts.
+    stats, figures = dataset_dashboard(dataset, date_range, selected_users, hidden_flags, (panel,))
+    return stats if panel == 'stats' else [fig.to_dict() for fig in figures]
+
+
+def message_scatter_task(dataset, selected_users, date_range, hidden_flags, x_range=None, y_range=None):
+    fig = dataset_scatter(dataset, selected_users, date_range, hidden_flags, x_range, y_range)
+    return None if fig is None else fig.to_dict()
+
+
+def report_task(intermediate_values, pyramid, date_range, selected_users, hidden_flags):
+    stats, figures = dataset_dashboard(intermediate_values, date_range, selected_users, hidden_flags)
+    scatter = dataset_scatter(intermediate_values, selected_users, date_range, hidden_flags)
+    # The count figures from the pyramid, as on the page.
+    weekday_hour = pyramid_weekday_hour(pyramid, selected_users, date_range, hidden_flags)
+    figures = [timeline_figure(pyramid, selected_users, date_range, hidden_flags)] + \
+        ([scatter] if scatter is not None else []) + count_figures(weekday_hour, selected_users) + figures
+    return write_report(stats, figures, date_range, selected_users)
+
+
+# Responses are compressed by flask-compress; it reads its settings once, when Dash registers it.
+server = flask.Flask(__name__)
+server.config.update(
+    COMPRESS_ALGORITHM=['br', 'gzip'],
+    COMPRESS_BR_LEVEL=4,
+    COMPRESS_LEVEL=6,
+    COMPRESS_MIN_SIZE=500
+)
+
+app = dash.Dash(
+    __name__,
+    server=server,
+    compress=True,
+    external_stylesheets=[
+        "https://fonts.googleapis.com/css?family=Product+Sans:400,400i,700,700i",
+        "https://cdn.rawgit.com/plotly/dash-app-stylesheets/2cc54b8c03f4126569a3440aae611bbef1d7a5dd/stylesheet.css",
+        "https://codepen.io/bcd/pen/KQrXdb.css"
+    ]
+)
+
+def serve_layout():
+    # Built per page load rather than at import time.
+    return html.Div([
+        html.Div([
+            html.Div(
+                children=[
+                    html.Div(dcc.Upload(
+                        id='upload-data',
+                        children=html.Div([
+                            'Drag and Drop or ',
+                            html.A('Select File (.txt or .json)')
+                        ]),
+                        style={
+                            'width': '100%',
+                            'height': '40',
+                            'lineHeight': '60px',
+                            'borderWidth': '1px',
+                            'borderStyle': 'dashed',
+                            'borderRadius': '5px',
+                            'textAlign': 'center',
+                            'margin-bottom': '5px',
+                            'font-size': '14px'
+                        }
+                    )),
+                ]
+            ),
+            dcc.Checklist(id='upload-options', options=[{'label': 'Preview large chats first', 'value': 'preview'}],
+                          value=[], style={'margin-bottom': '5px', 'font-size': '14px'}),
+            html.Div(id='upload-status', style={'margin-bottom': '5px', 'font-size': '14px'}),
+            dcc.Interval(id='refine-interval', interval=preview_poll_ms, disabled=True),
+            dcc.Store(id='pending-upload'),
+            dcc.Store(id='dataset-refined'),
+            html.Div(id='intermediate-values', style={'display': 'none'}),
+            dcc.Store(id='stats-state'),
+            dcc.Store(id='graphs-state'),
+            dcc.Store(id='words-state'),
+            dcc.Store(id='dataset-meta'),
+            dcc.Store(id='dataset-pyramid'),
+            html.Div(id='filter-selection', children=[
+                html.Div(
+                    children=[dcc.RangeSlider(
+                        id='date-range'
+                    )],
+                    style={'margin-bottom': '5px', 'font-size': '14px', 'display': 'none'}
+                ),
+                html.Div(
+                    id='date-range-label',
+                    style={'margin-bottom': '5px', 'font-size': '14px', 'display': 'none'}
+                ),
+                html.Div(
+                    children=[dcc.Checklist(
+                        id='user-selection'
+                    )],
+                    style={'display': 'none'}
+                ),
+                html.Div(
+                    children=[dcc.Checklist(
+                        id='hidden-categories'
+                    )],
+                    style={'display': 'none'}
+                ),
+                html.Div(
+                    children=[html.Button('Submit', id='submit-val', n_clicks=0),
+                              html.Button('Export report', id='export-report', n_clicks=0)],
+                    style={'display': 'none'}
+                ),
+            ]),
+            html.Div(id='report-link', style={'margin-top': '5px', 'font-size': '14px'})
+        ], style={'width': '14%', 'display': 'inline-block', 'vertical-align': 'top', 'margin': '5px'}),
+        html.Div([
+            html.Div(id='stats'),
+            html.Div(dcc.Graph(id='timeline'), id='timeline-container', style={'display': 'none'}),
+            html.Div(dcc.Graph(id='message-scatter'), id='message-scatter-container', style={'display': 'none'}),
+            html.Div(count_graphs(), id='count-graphs', style={'display': 'none'}),
+            html.Div(id='graphs'),
+            html.Div(id='words')
+        ], style={'width': '84%', 'display': 'inline-block', 'margin': '5px'})
+    ])
+
+
+def count_graphs():
+    # The hour, weekday and heatmap charts. With CLIENTSIDE_FILTERS, assets/clientside.js draws them, with the
+    # settings it needs and the hour binning control.
+    graphs = [html.Div(dcc.Graph(id=graph_id), style={'width': '50%', 'display': 'inline-block'})
+              for graph_id in count_graph_ids]
+    if not clientside_filters:
+        return graphs
+    return [
+        dcc.Store(id='client-config', data={'flags': message_flags, 'colors': color_theme(), 'days': days_of_week}),
+        html.Div(['Hours per bar ',
+                  dcc.RadioItems(id='hour-bin', options=[{'label': str(n), 'value': n} for n in hour_bins], value=1,
+                                 labelStyle={'display': 'inline-block', 'margin-right': '10px'})],
+                 style={'font-size': '14px', 'margin-bottom': '5px'})
+    ] + graphs
+
+
+app.layout = serve_layout
+
+
+@app.callback([Output('intermediate-values', 'children'),
+               Output('dataset-meta', 'data'),
+               Output('dataset-pyramid', 'data'),
+               Output('upload-status', 'children'),
+               Output('refine-interval', 'disabled'),
+               Output('pending-upload', 'data'),
+               Output('dataset-refined', 'data')],
+              [Input('upload-data', 'contents'),
+               Input('refine-interval', 'n_intervals')],
+              [State('intermediate-values', 'children'),
+               State('upload-options', 'value'),
+               State('pending-upload', 'data')])
+def parse_data(contents, n_intervals, previous_dataset, upload_options, pending):
+    # With the preview option, the page first gets a dataset of sampled messages and then polls, through
+    # refine-interval, for the full ingest running behind it.
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    if 'refine-interval.n_intervals' in triggered:
+        return refine_upload(pending, previous_dataset)
+    if contents is None:
+        raise PreventUpdate
+    fingerprint = upload_fingerprint(contents)
+    with uploads_lock:
+        upload = live_upload(fingerprint)
+    done = upload is not None and upload['result'].done()
+    try:
+        preview = None
+        if 'preview' in (upload_options or []) and storage_backend != 'chunked' and not done:
+            preview = run_upload(ingest_preview, contents)
+        upload = claim_upload(contents, fingerprint)
+        result = upload['result'].result() if preview is None else None
+    except TaskFailed as e:
+        return upload_failed(str(e))
+    except Exception as e:
+        print(f'Upload failed: {e!r}')
+        return upload_failed('This file could not be read as a WhatsApp or Telegram export.')
+    if preview is None and result is None:
+        return upload_failed('No messages were found in this file.')
+    # Only now that the new upload parsed does the page let go of what it held; a failed upload leaves it as it was.
+    if previous_dataset:
+        release_upload(previous_dataset)
+    if pending:
+        release_upload(fingerprint=pending['fingerprint'])
+    if preview is not None:
+        dataset, meta, pyramid = preview
+        reference = register_dataset(dataset, 'preview-' + os.urandom(16).hex())
+        register_pyramid(reference, pyramid)
+        return (reference, meta, page_pyramid(pyramid),
+                'Showing a preview from a sample of the messages; exact results follow.',
+                False, {'fingerprint': fingerprint}, dash.no_update)
+    reference, meta = result
+    try:
+        pyramid = page_pyramid(dataset_pyramid(reference)) if clientside_filters else None
+    except TaskFailed as e:
+        return upload_failed(str(e))
+    return reference, meta, pyramid, '', True, None, dash.no_update
+
+
+def upload_failed(status):
+    # parse_data's outputs for an upload that gave no dataset: only the status changes.
+    return dash.no_update, dash.no_update, dash.no_update, status, dash.no_update, dash.no_update, dash.no_update
+
+
+def refine_upload(pending, preview):
+    # parse_data for refine-interval: swaps the preview for the exact dataset once the full ingest is done. The
+    # metadata and the pyramid were exact already, so the filters are left as they are.
+    with uploads_lock:
+        upload = uploads.get(pending['fingerprint']) if pending else None
+    if upload is not None and not upload['result'].done():
+        raise PreventUpdate
+    result = upload['result'].result() if upload is not None else None
+    if result is None:
+        return (dash.no_update, dash.no_update, dash.no_update, 'Exact results could not be computed; showing the preview.',
+                True, None, dash.no_update)
+    release_upload(preview)
+    return result[0], dash.no_update, dash.no_update, '', True, None, time.time()
+
 
 @app.callback(Output('filter-selection', 'children'),
-              [Input('intermediate-values', 'children')])
-def generate_filters(intermediate_values):
-    df = pd.read_json(intermediate_values, orient='split')
-    date_range = [str(x)[:10] for x in df.Date.unique()]
-    users = sorted(df.User.unique())
+              [Input('dataset-meta', 'data')])
+def generate_filters(meta):
+    if meta is None:
+        raise PreventUpdate
+    start_day, end_day = meta['start_day'], meta['end_day']
+    users = [user['name'] for user in meta['users']]
 
     children = [
         html.Div(
-            children=[dcc.Dropdown(
-                id='start-date',
-                options=[dict(label=i, value=i) for i in date_range],
-                value=date_range[0]
+            children=[dcc.RangeSlider(
+                id='date-range',
+                min=start_day,
+                max=end_day,
+                step=1,
+                marks=date_marks(start_day, end_day),
+                value=[start_day, end_day]
             )],
             style={'margin-bottom': '5px', 'font-size': '14px'}
         ),
         html.Div(
-            children=[dcc.Dropdown(
-                id='end-date',
-                options=[dict(label=i, value=i) for i in date_range],
-                value=date_range[-1]
-            )],
+            id='date-range-label',
             style={'margin-bottom': '5px', 'font-size': '14px'}
         ),
         html.Div(
             children=[dcc.Checklist(
                 id='user-selection',
-                options=[{'label': user, 'value': user} for user in users],
+                options=[{'label': f"{user['name']} ({user['messages']})", 'value': user['name']}
+                         for user in meta['users']],
                 labelStyle={'display': 'block'},
-                value=[user for user in users]
+                value=[user for user in users if user != system_user]
             )],
             style={'margin-bottom': '5px', 'font-size': '14px'}
         ),
-        html.Div(children=[html.Button('Submit', id='submit-val', n_clicks=0)])
+        html.Div(
+            children=['Hide',
+                      dcc.Checklist(
+                          id='hidden-categories',
+                          options=[{'label': f"{category['name']} ({category['messages']})", 'value': category['name']}
+                                   for category in meta['categories']],
+                          labelStyle={'display': 'block'},
+                          value=default_hidden_categories
+                      )],
+            style={'margin-bottom': '5px', 'font-size': '14px'}
+        ),
+        html.Div(children=[html.Button('Submit', id='submit-val', n_clicks=0),
+                           html.Button('Export report', id='export-report', n_clicks=0)])
     ]
     return children
 
 
+@app.callback(Output('date-range-label', 'children'),
+              [Input('date-range', 'value')])
+def update_date_range_label(date_range):
+    if not date_range:
+        raise PreventUpdate
+    return f'{epoch_day_to_date(date_range[0])} to {epoch_day_to_date(date_range[1])}'
+
+
+def dashboard_panel(panel, intermediate_values, date_range, selected_users, hidden_categories):
+    # One panel's dashboard_task. Results for in-memory datasets are cached with the dataset, one entry per panel
+    # and filters, so a panel is only computed again when its own inputs change.
+    args = (date_range, selected_users, flags_mask(hidden_categories))
+
+    def compute():
+        return run_dataset_task(dashboard_task, intermediate_values, panel, panel, *args)
+    if intermediate_values.startswith(dataset_prefix):
+        return dataset_registry.derived(intermediate_values[len(dataset_prefix):], f'{panel} {dumps(args)}', compute)
+    return compute()
+
+
+def dataset_digest(intermediate_values):
+    return hashlib.blake2b(intermediate_values.encode('utf-8'), digest_size=8).hexdigest()
+
+
+# The stats cards, the count charts, the other figures and the word figures each have their own callback, so they
+# are computed concurrently (all but the count charts in separate compute pool tasks) and each shows as soon as it
+# is ready.
 @app.callback(
     [Output('stats', 'children'),
-     Output('graphs', 'children')],
-    [Input('submit-val', 'n_clicks')],
+     Output('stats-state', 'data')],
+    [Input('submit-val', 'n_clicks'),
+     Input('dataset-refined', 'data')],
     [State('intermediate-values', 'children'),
-     State('start-date', 'value'),
-     State('end-date', 'value'),
-     State('user-selection', 'value')]
+     State('date-range', 'value'),
+     State('user-selection', 'value'),
+     State('hidden-categories', 'value'),
+     State('stats-state', 'data')]
 )
-def update_graphs(n_clicks, intermediate_values, start, end, selected_users):
-    df = pd.read_json(intermediate_values, orient='split')
-    df.Date = df.Date.dt.tz_localize(None)
-    df.Day = df.Day.astype('category')
-    df.Day.cat.reorder_categories(days_of_week, ordered=True, inplace=True)
-    df = df[
-        (datetime.strptime(start, "%Y-%m-%d") <= df.Date)
-        & (df.Date <= (datetime.strptime(end, "%Y-%m-%d")))
-        & (df.User.isin(selected_users))
-        ]
+def update_stats(n_clicks, refined, intermediate_values, date_range, selected_users, hidden_categories,
+                 previous_state):
+    if not n_clicks or intermediate_values is None:
+        raise PreventUpdate
+    try:
+        stats = dashboard_panel('stats', intermediate_values, date_range, selected_users, hidden_categories)
+    except TaskFailed as e:
+        return html.P(str(e), style={'font-size': '14px'}), None
+    state = stats_state(dataset_digest(intermediate_values), selected_users, stats)
+    return stats_updates(previous_state, state, stats), state
 
-    output_stats = []
-
-    for user in selected_users:
-        df_user = df[df.User == user]
-        message_lengths = df_user.Message.apply(lambda x: len(x.split(' ')))
-        all_emojis = [x for y in df_user.Emojis.apply(lambda z: list(z)) for x in y]
-        emoji_counts = Counter(all_emojis)
-        output_stats.append(html.Div([html.P([
-            f'User: {user}', html.Br(),
-            f'Messages sent: {df_user.shape[0]}', html.Br(),
-            f'Mean words per message: {mean(message_lengths)}', html.Br(),
-            f'Median words per message: {int(median(message_lengths))}', html.Br(),
-            f'Standard deviation: {stdev(message_lengths)}', html.Br(),
-            f'Max message length: {max(message_lengths)}', html.Br(),
-            f'Most used emojis: {" ".join(k for k, v in sorted(emoji_counts.items(), key=lambda item: item[1], reverse=True)[:5])}'
-        ], style={'font-size': '14px', 'backgroundColor': 'white', 'padding': '10px'})],
-            style={'display': 'inline-block', 'margin-right': '10px'}))
-
-    df_heatmap = df \
-        .groupby(['Day', 'Hour']) \
-        .Message \
-        .count() \
-        .reset_index() \
-        .sort_values(['Hour', 'Day']) \
-        .reset_index(drop=True)
-
-    dcc_graphs = [
-        dcc.Graph(
-            figure=px.histogram(df, x='MMYYYY', color='User',
-                                color_discrete_sequence=color_theme).update_layout(bargap=0.1)
-        ),
-        dcc.Graph(
-            figure=px.histogram(df, x='Hour', color='User', color_discrete_sequence=color_theme).update_layout(
-                xaxis={'categoryorder': 'array', 'categoryarray': list(range(24))})
-        ),
-        dcc.Graph(
-            figure=px.histogram(df, x='Day', color='User', color_discrete_sequence=color_theme).update_layout(
-                bargap=0.1, xaxis={'categoryorder': 'array', 'categoryarray': days_of_week})
-        ),
-        dcc.Graph(
-            figure=dict(data=[
-                go.Heatmap(
-                    x=df_heatmap.Hour,
-                    y=df_heatmap.Day,
-                    z=df_heatmap.Message
-                )
-            ])
-        )
-    ]
 
-    output_graphs = [html.Div([graph], style={'width': '50%', 'display': 'inline-block', 'margin-bottom': '10px'}) for
-                     graph in dcc_graphs]
+def figures_callback(panel):
+    # update_graphs and update_words: the 'graphs' and 'words' panels, with partial updates against their state.
+    def update_figures(n_clicks, refined, intermediate_values, date_range, selected_users, hidden_categories,
+                       previous_state):
+        if not n_clicks or intermediate_values is None:
+            raise PreventUpdate
+        try:
+            figures = dashboard_panel(panel, intermediate_values, date_range, selected_users, hidden_categories)
+        except TaskFailed as e:
+            # update_stats shows the same error.
+            print(f'{panel.capitalize()}: {e}')
+            return dash.no_update, None
+        figures = [encode_figure(fig) for fig in figures]
+        state = graphs_state(dataset_digest(intermediate_values), figures)
+        return graphs_updates(previous_state, state, figures), state
+    return update_figures
 
-    if n_clicks > 0:
-        return output_stats, output_graphs
-    else:
-        return None
+
+update_graphs, update_words = figures_callback('graphs'), figures_callback('words')
+for panel, callback in [('graphs', update_graphs), ('words', update_words)]:
+    app.callback([Output(panel, 'children'),
+                  Output(f'{panel}-state', 'data')],
+                 [Input('submit-val', 'n_clicks'),
+                  Input('dataset-refined', 'data')],
+                 [State('intermediate-values', 'children'),
+                  State('date-range', 'value'),
+                  State('user-selection', 'value'),
+                  State('hidden-categories', 'value'),
+                  State(f'{panel}-state', 'data')])(callback)
+
+
+def count_graph_callback(i):
+    # The i-th count chart, from the time pyramid in the request thread, like the timeline: a few milliseconds
+    # whatever the size of the chat.
+    def update_count_graph(n_clicks, intermediate_values, date_range, selected_users, hidden_categories):
+        if not n_clicks or intermediate_values is None:
+            raise PreventUpdate
+        try:
+            pyramid = dataset_pyramid(intermediate_values)
+        except TaskFailed as e:
+            print(f'Count charts: {e}')
+            raise PreventUpdate
+        weekday_hour = pyramid_weekday_hour(pyramid, selected_users, date_range, flags_mask(hidden_categories))
+        return encode_figure(count_figure(weekday_hour, selected_users, i))
+    return update_count_graph
+
+
+if clientside_filters:
+    app.clientside_callback(ClientsideFunction('chat', 'showCharts'),
+                            Output('count-graphs', 'style'),
+                            [Input('dataset-pyramid', 'data')])
+    for graph_id, chart in zip(count_graph_ids, ['hourFigure', 'weekdayFigure', 'heatmapFigure']):
+        app.clientside_callback(ClientsideFunction('chat', chart),
+                                Output(graph_id, 'figure'),
+                                [Input('dataset-pyramid', 'data'),
+                                 Input('date-range', 'value'),
+                                 Input('user-selection', 'value'),
+                                 Input('hidden-categories', 'value'),
+                                 Input('hour-bin', 'value')],
+                                [State('client-config', 'data')])
+else:
+    @app.callback(Output('count-graphs', 'style'),
+                  [Input('submit-val', 'n_clicks')],
+                  [State('intermediate-values', 'children')])
+    def show_count_graphs(n_clicks, intermediate_values):
+        if not n_clicks or intermediate_values is None:
+            raise PreventUpdate
+        return {'margin-bottom': '10px'}
+
+    for i, graph_id in enumerate(count_graph_ids):
+        app.callback(Output(graph_id, 'figure'),
+                     [Input('submit-val', 'n_clicks')],
+                     [State('intermediate-values', 'children'),
+                      State('date-range', 'value'),
+                      State('user-selection', 'value'),
+                      State('hidden-categories', 'value')])(count_graph_callback(i))
+
+
+@app.callback([Output('timeline', 'figure'),
+               Output('timeline-container', 'style')],
+              [Input('submit-val', 'n_clicks'),
+               Input('timeline', 'relayoutData')],
+              [State('intermediate-values', 'children'),
+               State('date-range', 'value'),
+               State('user-selection', 'value'),
+               State('hidden-categories', 'value')])
+def update_timeline(n_clicks, relayout_data, intermediate_values, date_range, selected_users, hidden_categories):
+    if not n_clicks or intermediate_values is None:
+        raise PreventUpdate
+    try:
+        pyramid = dataset_pyramid(intermediate_values)
+    except TaskFailed as e:
+        print(f'Timeline: {e}')
+        raise PreventUpdate
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    if 'timeline.relayoutData' in triggered:
+        if not relayout_data or not any(key.startswith('xaxis.') for key in relayout_data):
+            raise PreventUpdate
+        figure = timeline_figure(pyramid, selected_users, date_range, flags_mask(hidden_categories),
+                                 relayout_range(relayout_data))
+        return encode_figure(figure), dash.no_update
+    figure = timeline_figure(pyramid, selected_users, date_range, flags_mask(hidden_categories))
+    return encode_figure(figure), {'margin-bottom': '10px'}
+
+
+@app.callback([Output('message-scatter', 'figure'),
+               Output('message-scatter-container', 'style')],
+              [Input('submit-val', 'n_clicks'),
+               Input('message-scatter', 'relayoutData'),
+               Input('dataset-refined', 'data')],
+              [State('intermediate-values', 'children'),
+               State('date-range', 'value'),
+               State('user-selection', 'value'),
+               State('hidden-categories', 'value')])
+def update_message_scatter(n_clicks, relayout_data, refined, intermediate_values, date_range, selected_users,
+                           hidden_categories):
+    if not n_clicks or intermediate_values is None:
+        raise PreventUpdate
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    try:
+        args = (intermediate_values, 'scatter', selected_users, date_range, flags_mask(hidden_categories))
+        if 'message-scatter.relayoutData' in triggered:
+            if not relayout_data or not any(key.startswith(('xaxis.', 'yaxis.')) for key in relayout_data):
+                raise PreventUpdate
+            figure = run_dataset_task(message_scatter_task, *args, relayout_range(relayout_data, 'xaxis'),
+                                      relayout_range(relayout_data, 'yaxis'))
+            if figure is None:
+                raise PreventUpdate
+            return encode_figure(figure), dash.no_update
+        figure = run_dataset_task(message_scatter_task, *args)
+        if figure is None:
+            raise PreventUpdate
+        return encode_figure(figure), {'margin-bottom': '10px'}
+    except TaskFailed as e:
+        print(f'Message scatter: {e}')
+        raise PreventUpdate
+
+
+@app.callback(Output('report-link', 'children'),
+              [Input('export-report', 'n_clicks')],
+              [State('intermediate-values', 'children'),
+               State('date-range', 'value'),
+               State('user-selection', 'value'),
+               State('hidden-categories', 'value')])
+def export_report(n_clicks, intermediate_values, date_range, selected_users, hidden_categories):
+    if not n_clicks or intermediate_values is None:
+        raise PreventUpdate
+    try:
+        filename = run_task(report_task, resolve_dataset(intermediate_values), dataset_pyramid(intermediate_values),
+                            date_range, selected_users, flags_mask(hidden_categories))
+    except TaskFailed as e:
+        return str(e)
+    return html.A(f'Download {filename}', href=f'/reports/{filename}', download=filename)
+
+
+@server.route('/reports/<path:filename>')
+def serve_report(filename):
+    prune_reports()
+    return flask.send_from_directory(reports_dir, filename, as_attachment=True)
+
+
+@server.route('/datasets/usage')
+def dataset_usage():
+    if flask.request.remote_addr not in usage_addresses:
+        flask.abort(404)
+    return flask.jsonify(dataset_registry.usage())
 
 
 if __name__ == '__main__':